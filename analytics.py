@@ -0,0 +1,166 @@
+import math
+
+import numpy as np
+
+from blockchain import Blockchain
+from crypto_utils import ALGORITHM_IDS
+
+ANALYTICS_COLUMNS = ('algorithm', 'timestamp', 'file_size_bytes', 'enc_time_ms', 'dec_time_ms',
+                     'cipher_time_ms', 'stored_size_bytes')
+# Per operation: the end-to-end time the cost model is fitted on (its fixed term absorbs the KDF),
+# and the (bytes, time) columns throughput is computed from. Encryption throughput is the cipher
+# phase alone over the bytes it enciphered; decryption has only its end-to-end timing.
+OPERATIONS = {'encrypt': 'enc_time_ms', 'decrypt': 'dec_time_ms'}
+THROUGHPUT_COLUMNS = {
+    'encrypt': ('cipher_size_bytes', 'cipher_time_ms'),
+    'decrypt': ('file_size_bytes', 'dec_time_ms')
+}
+MIB = 1024 * 1024
+
+# Size buckets are powers of SIZE_BUCKET_BASE bytes: [1K, 4K), [4K, 16K), ...
+SIZE_BUCKET_BASE = 4
+PERCENTILES = (10, 25, 50, 75, 90)
+# Trend windows: about TREND_WINDOWS of them across the data unless a width is given, which is
+# widened to at least MIN_WINDOW_SECONDS and to no more than MAX_TREND_WINDOWS windows; the rolling
+# median covers the last ROLLING_WINDOWS windows
+TREND_WINDOWS = 24
+MAX_TREND_WINDOWS = 1000
+ROLLING_WINDOWS = 3
+MIN_WINDOW_SECONDS = 60
+
+def format_bytes(size):
+    for unit, scale in (('G', 1024 ** 3), ('M', MIB), ('K', 1024)):
+        if size >= scale:
+            return f'{size / scale:g}{unit}'
+    return f'{size:g}'
+
+def load_columns(blockchain):
+    # {column: ndarray}; missing timings become NaN and timestamps seconds since the epoch.
+    # cipher_size_bytes is COALESCE(stored_size_bytes, file_size_bytes): compressed files were
+    # enciphered at their stored size
+    values = dict(zip(ANALYTICS_COLUMNS, blockchain.get_benchmark_columns(ANALYTICS_COLUMNS)))
+    columns = {column: np.array(values[column], dtype=float)
+               for column in ('file_size_bytes', 'enc_time_ms', 'dec_time_ms', 'cipher_time_ms', 'stored_size_bytes')}
+    columns['cipher_size_bytes'] = np.where(np.isnan(columns['stored_size_bytes']), columns['file_size_bytes'],
+                                            columns['stored_size_bytes'])
+    columns['algorithm'] = np.array(values['algorithm'], dtype=object)
+    columns['timestamp'] = np.array(values['timestamp'], dtype='datetime64[us]').astype('int64') / 1e6
+    return columns
+
+def size_buckets(sizes):
+    # Bucket number k covers [BASE^k, BASE^(k+1)) bytes; empty files share the first bucket
+    return np.floor(np.log(np.maximum(sizes, 1)) / math.log(SIZE_BUCKET_BASE)).astype(int)
+
+def throughput(sizes, times_ms):
+    # MB/s, NaN where the operation was not timed
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mb_per_s = sizes / MIB / (times_ms / 1000)
+    mb_per_s[~np.isfinite(mb_per_s) | (times_ms <= 0)] = np.nan
+    return mb_per_s
+
+def fit_cost_model(sizes, times_ms):
+    # time_ms = fixed_ms + ms_per_mib * size, fitted on relative error (each row divided by its
+    # time) so a handful of large files cannot drown out the per-file overhead
+    valid = np.isfinite(times_ms) & (times_ms > 0)
+    sizes, times_ms = sizes[valid] / MIB, times_ms[valid]
+    if len(times_ms) < 2 or np.ptp(sizes) == 0:
+        return None
+    
+    design = np.column_stack([np.ones_like(sizes), sizes])
+    weighted = design / times_ms[:, None]
+    (fixed_ms, ms_per_mib), *_ = np.linalg.lstsq(weighted, np.ones_like(times_ms), rcond=None)
+    predicted = design @ np.array([fixed_ms, ms_per_mib])
+    residual = np.sum((times_ms - predicted) ** 2)
+    total = np.sum((times_ms - times_ms.mean()) ** 2)
+    return {
+        'samples': int(len(times_ms)),
+        'fixed_ms': float(fixed_ms),
+        'ms_per_mib': float(ms_per_mib),
+        'asymptotic_mb_per_s': float(1000 / ms_per_mib) if ms_per_mib > 0 else None,
+        'r_squared': float(1 - residual / total) if total > 0 else None
+    }
+
+def model_throughput(model, sizes):
+    # MB/s the fitted cost model predicts for files of the given sizes (bytes)
+    sizes = np.asarray(sizes, dtype=float)
+    return sizes / MIB / ((model['fixed_ms'] + model['ms_per_mib'] * sizes / MIB) / 1000)
+
+def percentile_summary(values):
+    summary = {'count': int(len(values)), 'mean': float(values.mean())}
+    for q, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        summary[f'p{q}'] = float(value)
+    return summary
+
+def size_profile(buckets, mb_per_s, algorithm_mask):
+    profile = []
+    for bucket in np.unique(buckets[algorithm_mask]):
+        values = mb_per_s[algorithm_mask & (buckets == bucket)]
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            continue
+        low, high = SIZE_BUCKET_BASE ** int(bucket), SIZE_BUCKET_BASE ** (int(bucket) + 1)
+        entry = {'bucket': f'{format_bytes(low)}-{format_bytes(high)}', 'min_size_bytes': low,
+                 'max_size_bytes': high}
+        entry.update(percentile_summary(values))
+        profile.append(entry)
+    return profile
+
+def trend(timestamps, mb_per_s, start, window_seconds):
+    # Median throughput per time window, plus a rolling median over the last ROLLING_WINDOWS windows
+    valid = ~np.isnan(mb_per_s)
+    timestamps, mb_per_s = timestamps[valid], mb_per_s[valid]
+    if len(mb_per_s) == 0:
+        return []
+    windows = ((timestamps - start) // window_seconds).astype(int)
+    # Sorted by window once, every window and every rolling range is a contiguous slice
+    order = np.argsort(windows, kind='stable')
+    windows, mb_per_s = windows[order], mb_per_s[order]
+    window_ids, offsets = np.unique(windows, return_index=True)
+    ends = np.append(offsets[1:], len(windows))
+    rolling_starts = offsets[np.searchsorted(window_ids, window_ids - ROLLING_WINDOWS, side='right')]
+    points = []
+    for window, offset, end, rolling_start in zip(window_ids, offsets, ends, rolling_starts):
+        points.append({
+            'start': float(start + window * window_seconds),
+            'count': int(end - offset),
+            'p50_mb_per_s': float(np.median(mb_per_s[offset:end])),
+            'rolling_p50_mb_per_s': float(np.median(mb_per_s[rolling_start:end]))
+        })
+    return points
+
+def compute_analytics(blockchain=None, window_seconds=None):
+    blockchain = blockchain or Blockchain()
+    columns = load_columns(blockchain)
+    timestamps = columns['timestamp']
+    
+    span = float(timestamps.max() - timestamps.min()) if len(timestamps) else 0.0
+    if window_seconds is None:
+        window_seconds = math.ceil(span / TREND_WINDOWS)
+    window_seconds = max(window_seconds, MIN_WINDOW_SECONDS, math.ceil(span / MAX_TREND_WINDOWS))
+    start = float(timestamps.min()) if len(timestamps) else 0.0
+    
+    sizes = columns['file_size_bytes']
+    buckets = size_buckets(sizes)
+    rates = {operation: throughput(columns[size_column], columns[time_column])
+             for operation, (size_column, time_column) in THROUGHPUT_COLUMNS.items()}
+    
+    algorithms = {}
+    for algorithm in ALGORITHM_IDS:
+        mask = columns['algorithm'] == algorithm
+        result = {'count': int(mask.sum())}
+        for operation, time_column in OPERATIONS.items():
+            result[operation] = {
+                'by_size': size_profile(buckets, rates[operation], mask),
+                'cost_model': fit_cost_model(sizes[mask], columns[time_column][mask]),
+                'trend': trend(timestamps[mask], rates[operation][mask], start, window_seconds)
+            }
+        algorithms[algorithm] = result
+    
+    return {
+        'blocks': int(len(timestamps)),
+        'size_bucket_base': SIZE_BUCKET_BASE,
+        'percentiles': list(PERCENTILES),
+        'window_seconds': window_seconds,
+        'rolling_windows': ROLLING_WINDOWS,
+        'algorithms': algorithms
+    }
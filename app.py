@@ -1,21 +1,421 @@
 import os
+import atexit
+import base64
 import hashlib
-from flask import Flask, render_template, request, jsonify, send_file
+import json
+import multiprocessing
+import re
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager, nullcontext
+from flask import Flask, g, render_template, request, jsonify, send_file
 from werkzeug.utils import secure_filename
-from crypto_utils import encrypt_file, decrypt_file
-from blockchain import Blockchain
-from benchmark import generate_benchmark_chart, get_benchmark_stats
+from crypto_utils import StreamDecryptor, encrypt_stream, encrypt_path, decrypt_stream, decrypt_path
+from blockchain import Blockchain, DEFAULT_PAGE_SIZE
+from ledger_writer import LedgerWriter
+from sharded_ledger import ShardedBlockchain, ShardedLedgerWriter
+from jobs import FINISHED_STATES, JobManager, JobQueueFull
+from cipher_select import AlgorithmSelector
+import metrics
+from benchmark import (
+    DEFAULT_CHART_DPI, chart_cache_key, chart_etag, get_benchmark_chart, get_benchmark_stats
+)
+from analytics import compute_analytics
 
 app = Flask(__name__)
-app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024
+app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024 * 1024
 app.config['UPLOAD_FOLDER'] = 'storage'
 app.config['ENCRYPTED_FOLDER'] = 'storage/encrypted'
 app.config['DECRYPTED_FOLDER'] = 'storage/decrypted'
+app.config['JOB_FOLDER'] = 'storage/jobs'
+# 'session' derives one KDF master key per passphrase and a cheap HKDF subkey per file;
+# 'file' runs the full KDF derivation for every file
+app.config['KEY_MODE'] = 'session'
+# Key derivation for new files as 'name:param=value,...' (pbkdf2-sha256 or scrypt); the choice is recorded
+# in each file's header, so changing it never breaks older files. Pick values for this host with
+# python cipher_bench.py --calibrate-kdf scrypt --target-ms 250
+app.config['KDF'] = 'pbkdf2-sha256:iterations=200000'
+# Group commit: up to LEDGER_BATCH_SIZE appends per transaction, waiting at most LEDGER_FLUSH_INTERVAL seconds
+app.config['LEDGER_BATCH_SIZE'] = 256
+app.config['LEDGER_FLUSH_INTERVAL'] = 0.002
+# Blocks kept in ledger.db; older ones are archived to immutable segment files in LEDGER_ARCHIVE_FOLDER
+# by the ledger writer (None disables archival)
+app.config['LEDGER_HOT_BLOCKS'] = 100000
+app.config['LEDGER_ARCHIVE_FOLDER'] = 'ledger_segments'
+# Above 1, the ledger is split into LEDGER_SHARDS hash chains in separate databases that append concurrently,
+# with entries routed by LEDGER_SHARD_KEY ('file_hash' or 'algorithm'). Every LEDGER_ANCHOR_INTERVAL seconds
+# the shard heads are committed to a root chain in ledger.db. Both are fixed once a sharded ledger exists.
+app.config['LEDGER_SHARDS'] = 1
+app.config['LEDGER_SHARD_KEY'] = 'file_hash'
+app.config['LEDGER_ANCHOR_INTERVAL'] = 5
+# Worker processes for /api/encrypt/batch (None = one per core), the most files accepted per batch, and
+# the most bytes a batch may spool once its archive is unpacked (guards against zip/tar bombs)
+app.config['BATCH_WORKERS'] = None
+app.config['BATCH_MAX_FILES'] = 10000
+app.config['BATCH_MAX_BYTES'] = app.config['MAX_CONTENT_LENGTH']
+# Threads sealing or opening the segments of a single file; 1 keeps the sequential path
+app.config['CIPHER_WORKERS'] = 1
+# Pre-encryption compression: 'auto' deflates files whose first segment probes as compressible,
+# 'always' deflates every file, 'off' never does. Off by default: compressed length depends on the
+# content, and the ledger publishes it as stored_size_bytes
+app.config['COMPRESSION'] = 'off'
+# algorithm='auto' picks the fastest algorithm for the file's size bucket from ledger cipher timings
+# (or a micro-benchmark until there are enough); the measurements are re-read this often
+app.config['AUTO_ALGORITHM_REFRESH_SECONDS'] = 300
+# Background jobs: concurrent jobs (None = one per core), extra jobs allowed to wait before submissions
+# get a 429, seconds without a status poll before a job counts as abandoned, and how long results are kept
+app.config['JOB_WORKERS'] = None
+app.config['JOB_QUEUE_SIZE'] = 32
+app.config['JOB_ABANDON_SECONDS'] = 60
+app.config['JOB_RETENTION_SECONDS'] = 600
+app.config['JOB_EVENT_KEEPALIVE'] = 15
+
+ALGORITHMS = ['AES-256-GCM', 'Blowfish-256-EAX', 'ChaCha20-Poly1305']
+AUTO_ALGORITHM = 'auto'
+ENCRYPTED_TOKEN_BYTES = 8
+ENCRYPTED_SUFFIX = re.compile(r'_encrypted(-[0-9a-f]{16})?')
+BATCH_COPY_CHUNK_SIZE = 1024 * 1024
+
+class CiphertextMismatch(ValueError):
+    pass
 
 os.makedirs(app.config['ENCRYPTED_FOLDER'], exist_ok=True)
 os.makedirs(app.config['DECRYPTED_FOLDER'], exist_ok=True)
+os.makedirs(app.config['JOB_FOLDER'], exist_ok=True)
+
+if app.config['LEDGER_SHARDS'] > 1:
+    blockchain = ShardedBlockchain(
+        shards=app.config['LEDGER_SHARDS'],
+        shard_key=app.config['LEDGER_SHARD_KEY'],
+        archive_dir=app.config['LEDGER_ARCHIVE_FOLDER'],
+        hot_blocks=app.config['LEDGER_HOT_BLOCKS']
+    )
+    ledger_writer = ShardedLedgerWriter(
+        blockchain,
+        batch_size=app.config['LEDGER_BATCH_SIZE'],
+        flush_interval=app.config['LEDGER_FLUSH_INTERVAL'],
+        anchor_interval=app.config['LEDGER_ANCHOR_INTERVAL']
+    )
+else:
+    blockchain = Blockchain(archive_dir=app.config['LEDGER_ARCHIVE_FOLDER'], hot_blocks=app.config['LEDGER_HOT_BLOCKS'])
+    ledger_writer = LedgerWriter(
+        blockchain,
+        batch_size=app.config['LEDGER_BATCH_SIZE'],
+        flush_interval=app.config['LEDGER_FLUSH_INTERVAL']
+    )
+atexit.register(ledger_writer.close)
+
+algorithm_selector = AlgorithmSelector(
+    blockchain, ALGORITHMS, refresh_interval=app.config['AUTO_ALGORITHM_REFRESH_SECONDS']
+)
+
+job_manager = JobManager(
+    max_workers=app.config['JOB_WORKERS'],
+    max_queued=app.config['JOB_QUEUE_SIZE'],
+    abandon_after=app.config['JOB_ABANDON_SECONDS'],
+    retention=app.config['JOB_RETENTION_SECONDS']
+)
+
+HTTP_REQUESTS = metrics.counter('encdec_http_requests_total', 'HTTP requests by route, method and status',
+                                ('route', 'method', 'status'))
+HTTP_ERRORS = metrics.counter('encdec_http_request_errors_total', 'HTTP requests answered with a 5xx status',
+                              ('route',))
+HTTP_LATENCY = metrics.histogram('encdec_http_request_duration_seconds',
+                                 'Time to produce a response (streamed bodies are not included)', ('route',))
+CRYPTO_LATENCY = metrics.histogram('encdec_crypto_duration_seconds', 'Encrypt/decrypt time per file',
+                                   ('operation', 'algorithm'))
+CRYPTO_THROUGHPUT = metrics.histogram('encdec_crypto_throughput_bytes_per_second', 'Plaintext bytes per second per file',
+                                      ('operation', 'algorithm'), buckets=metrics.THROUGHPUT_BUCKETS)
+CRYPTO_BYTES = metrics.counter('encdec_crypto_bytes_total', 'Plaintext bytes encrypted/decrypted',
+                               ('operation', 'algorithm'))
+metrics.gauge('encdec_ledger_queue_depth', 'Ledger entries waiting for the writer thread',
+              callback=lambda: ledger_writer.pending)
+metrics.gauge('encdec_jobs', 'Background jobs by status', ('status',),
+              callback=lambda: {(status,): count for status, count in job_manager.counts().items()})
+# Registered after the ledger writer so it runs first at exit: jobs still append blocks while finishing
+atexit.register(job_manager.close)
+
+batch_pool = None
+batch_pool_lock = threading.Lock()
+
+def get_batch_pool():
+    global batch_pool
+    with batch_pool_lock:
+        if batch_pool is None:
+            # forkserver, not fork: a forked child of this threaded server could inherit a lock
+            # (a session cache, the key cache, a metrics histogram) that another thread was holding
+            batch_pool = ProcessPoolExecutor(max_workers=app.config['BATCH_WORKERS'],
+                                             mp_context=multiprocessing.get_context('forkserver'))
+            atexit.register(batch_pool.shutdown)
+        return batch_pool
+
+def discard_batch_pool(pool):
+    # A worker that died takes the whole pool down; the next batch starts a fresh one
+    global batch_pool
+    with batch_pool_lock:
+        if batch_pool is pool:
+            batch_pool = None
+    pool.shutdown(wait=False)
+
+@contextmanager
+def atomic_output(path):
+    # Write to a temporary sibling so a failed or unauthenticated stream never leaves a partial file behind;
+    # the random suffix keeps concurrent requests for the same output name from sharing it
+    tmp_path = f"{path}.{os.urandom(8).hex()}.part"
+    try:
+        with open(tmp_path, 'wb') as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def encrypted_name(original_filename):
+    # The random token gives every block its own ciphertext file, so a later upload with the same
+    # name cannot replace the file an older block points to
+    stem, ext = os.path.splitext(original_filename)
+    return f"{stem}_encrypted-{os.urandom(ENCRYPTED_TOKEN_BYTES).hex()}{ext}.enc"
+
+def decrypted_name(encrypted_filename):
+    # Strips what encrypted_name added (older files have no token)
+    return ENCRYPTED_SUFFIX.sub('', encrypted_filename[:-len('.enc')], count=1)
+
+def check_ciphertext(decryptor, block):
+    # The file at ciphertext_path must be the one this block was written for; runs on the header
+    # alone, before any response header is sent
+    if (decryptor.algorithm != block['algorithm']
+            or base64.b64encode(decryptor.nonce).decode('utf-8') != block['nonce_b64']
+            or decryptor.total_size not in (None, block['file_size_bytes'])):
+        raise CiphertextMismatch(f"Ciphertext at {block['ciphertext_path']} does not belong to block {block['tx_hash']}")
+
+def observe_crypto(operation, algorithm, elapsed_ms, size):
+    seconds = elapsed_ms / 1000
+    CRYPTO_LATENCY.observe(seconds, operation=operation, algorithm=algorithm)
+    CRYPTO_BYTES.inc(size, operation=operation, algorithm=algorithm)
+    if seconds > 0:
+        CRYPTO_THROUGHPUT.observe(size / seconds, operation=operation, algorithm=algorithm)
+
+def ledger_entry(algorithm, original_filename, encrypted_path, result):
+    enc_time_ms, file_hash, salt, nonce, tag, file_size, phase_times_ms, stored_size = result
+    return dict(
+        algorithm=algorithm,
+        file_name=original_filename,
+        file_hash=file_hash,
+        ciphertext_path=encrypted_path,
+        nonce=nonce,
+        tag=tag,
+        salt=salt,
+        file_size_bytes=file_size,
+        enc_time_ms=enc_time_ms,
+        dec_time_ms=None,
+        kdf_time_ms=phase_times_ms['kdf'],
+        cipher_time_ms=phase_times_ms['cipher'],
+        hash_time_ms=phase_times_ms['hash'],
+        header_time_ms=phase_times_ms['header'],
+        write_time_ms=phase_times_ms['write'],
+        compress_time_ms=phase_times_ms['compress'],
+        stored_size_bytes=stored_size
+    )
+
+def collect_batch_inputs(files, archive, work_dir):
+    # Spools every uploaded file (or archive member) to work_dir; returns [(original_filename, path)]
+    inputs = []
+    max_bytes = app.config['BATCH_MAX_BYTES']
+    total_bytes = 0
+    
+    def add(name, source, declared_size=0):
+        # declared_size is the archive's own claim, checked before anything is written; the bytes
+        # actually copied are counted as well, since that claim can lie
+        nonlocal total_bytes
+        if len(inputs) >= app.config['BATCH_MAX_FILES']:
+            raise ValueError(f"Too many files in batch (max {app.config['BATCH_MAX_FILES']})")
+        if total_bytes + declared_size > max_bytes:
+            raise ValueError(f"Batch is too large once unpacked (max {max_bytes} bytes)")
+        path = os.path.join(work_dir, f"{len(inputs)}.in")
+        with open(path, 'wb') as dest:
+            while chunk := source.read(BATCH_COPY_CHUNK_SIZE):
+                total_bytes += len(chunk)
+                if total_bytes > max_bytes:
+                    raise ValueError(f"Batch is too large once unpacked (max {max_bytes} bytes)")
+                dest.write(chunk)
+        inputs.append((secure_filename(name) or f"file_{len(inputs)}", path))
+    
+    for file in files:
+        add(file.filename, file.stream)
+    
+    if archive is not None and archive.filename:
+        archive_path = os.path.join(work_dir, 'archive')
+        archive.save(archive_path)
+        if zipfile.is_zipfile(archive_path):
+            with zipfile.ZipFile(archive_path) as zf:
+                for info in zf.infolist():
+                    if not info.is_dir():
+                        with zf.open(info) as source:
+                            add(info.filename, source, info.file_size)
+        elif tarfile.is_tarfile(archive_path):
+            with tarfile.open(archive_path) as tf:
+                for member in tf:
+                    if member.isfile():
+                        add(member.name, tf.extractfile(member), member.size)
+        else:
+            raise ValueError('Unsupported archive format (expected zip or tar)')
+        os.remove(archive_path)
+    
+    return inputs
+
+def read_encrypt_form():
+    # Returns (file, passphrase, algorithm, error message)
+    if 'file' not in request.files:
+        return None, None, None, 'No file uploaded'
+    
+    file = request.files['file']
+    if file.filename == '':
+        return None, None, None, 'No file selected'
+    
+    passphrase = request.form.get('passphrase')
+    algorithm = request.form.get('algorithm')
+    
+    if not passphrase:
+        return None, None, None, 'Passphrase is required'
+    
+    if algorithm not in ALGORITHMS and algorithm != AUTO_ALGORITHM:
+        return None, None, None, 'Invalid algorithm'
+    
+    return file, passphrase, algorithm, None
 
-blockchain = Blockchain()
+def read_decrypt_form():
+    # Returns (file, passphrase, error message)
+    if 'file' not in request.files:
+        return None, None, 'No file uploaded'
+    
+    file = request.files['file']
+    if file.filename == '':
+        return None, None, 'No file selected'
+    
+    passphrase = request.form.get('passphrase')
+    
+    if not passphrase:
+        return None, None, 'Passphrase is required'
+    
+    return file, passphrase, None
+
+def source_size(source):
+    # Bytes left in a seekable stream, or None when it cannot be measured
+    try:
+        position = source.tell()
+        size = source.seek(0, os.SEEK_END) - position
+        source.seek(position)
+        return size
+    except (AttributeError, OSError, ValueError):
+        return None
+
+def run_encrypt(source, filename, passphrase, algorithm, progress=None):
+    original_filename = secure_filename(filename)
+    if algorithm == AUTO_ALGORITHM:
+        algorithm = algorithm_selector.choose(source_size(source))
+    
+    encrypted_filename = encrypted_name(original_filename)
+    encrypted_path = os.path.join(app.config['ENCRYPTED_FOLDER'], encrypted_filename)
+    
+    with atomic_output(encrypted_path) as f:
+        result = encrypt_stream(source, f, passphrase, algorithm, key_mode=app.config['KEY_MODE'],
+                                workers=app.config['CIPHER_WORKERS'], progress=progress,
+                                compression=app.config['COMPRESSION'], kdf=app.config['KDF'])
+    enc_time_ms, _, _, _, _, file_size, phase_times_ms, stored_size = result
+    observe_crypto('encrypt', algorithm, enc_time_ms, file_size)
+    
+    ledger_writer.append(**ledger_entry(algorithm, original_filename, encrypted_path, result))
+    
+    return {
+        'success': True,
+        'message': f'File encrypted successfully using {algorithm}',
+        'encrypted_filename': encrypted_filename,
+        'enc_time_ms': round(enc_time_ms, 2),
+        'file_size_kb': round(file_size / 1024, 2),
+        'stored_size_kb': round(stored_size / 1024, 2),
+        'algorithm': algorithm,
+        'phase_times_ms': {phase: round(ms, 3) for phase, ms in phase_times_ms.items()}
+    }
+
+def run_decrypt(source, filename, passphrase, progress=None):
+    # source is an upload stream, or the path of a file on disk, which is decrypted through mmap
+    original_filename = secure_filename(filename)
+    if original_filename.endswith('.enc'):
+        decrypted_filename = decrypted_name(original_filename)
+    else:
+        decrypted_filename = f"decrypted_{original_filename}"
+    
+    decrypted_path = os.path.join(app.config['DECRYPTED_FOLDER'], decrypted_filename)
+    
+    with atomic_output(decrypted_path) as f:
+        decrypt = decrypt_path if isinstance(source, str) else decrypt_stream
+        dec_time_ms, algorithm, file_hash, file_size = decrypt(
+            source, f, passphrase, workers=app.config['CIPHER_WORKERS'], progress=progress
+        )
+    observe_crypto('decrypt', algorithm, dec_time_ms, file_size)
+    
+    blockchain.update_block_dec_time(file_hash, dec_time_ms)
+    
+    return {
+        'success': True,
+        'message': f'File decrypted successfully using {algorithm}',
+        'decrypted_filename': decrypted_filename,
+        'dec_time_ms': round(dec_time_ms, 2),
+        'file_size_kb': round(file_size / 1024, 2),
+        'algorithm': algorithm
+    }
+
+def submit_job(kind, work):
+    # Spools the upload so the request returns immediately; work(upload_path, job) runs on the job pool
+    file = request.files['file']
+    upload_path = os.path.join(app.config['JOB_FOLDER'], f"{os.urandom(16).hex()}.upload")
+    file.save(upload_path)
+    
+    def run(job):
+        return work(upload_path, job)
+    
+    def cleanup():
+        if os.path.exists(upload_path):
+            os.remove(upload_path)
+    
+    try:
+        job = job_manager.submit(kind, run, total=os.path.getsize(upload_path), cleanup=cleanup)
+    except BaseException:
+        cleanup()
+        raise
+    
+    return jsonify({
+        'success': True,
+        'job_id': job.id,
+        'status_url': f'/api/jobs/{job.id}',
+        'events_url': f'/api/jobs/{job.id}/events'
+    }), 202
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    # Labelled by route pattern, not the raw path, so label cardinality stays bounded
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    HTTP_REQUESTS.inc(route=route, method=request.method, status=response.status_code)
+    if response.status_code >= 500:
+        HTTP_ERRORS.inc(route=route)
+    if 'request_start' in g:
+        HTTP_LATENCY.observe(time.perf_counter() - g.request_start, route=route)
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return app.response_class(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route('/')
 def index():
@@ -32,12 +432,23 @@ def ledger():
 @app.route('/api/encrypt', methods=['POST'])
 def api_encrypt():
     try:
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file uploaded'}), 400
+        file, passphrase, algorithm, error = read_encrypt_form()
+        if error:
+            return jsonify({'error': error}), 400
         
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'error': 'No file selected'}), 400
+        return jsonify(run_encrypt(file.stream, file.filename, passphrase, algorithm))
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/encrypt/batch', methods=['POST'])
+def api_encrypt_batch():
+    work_dir = None
+    try:
+        files = [f for f in request.files.getlist('files') if f.filename]
+        archive = request.files.get('archive')
+        if not files and (archive is None or archive.filename == ''):
+            return jsonify({'error': 'No files uploaded'}), 400
         
         passphrase = request.form.get('passphrase')
         algorithm = request.form.get('algorithm')
@@ -45,92 +456,275 @@ def api_encrypt():
         if not passphrase:
             return jsonify({'error': 'Passphrase is required'}), 400
         
-        if algorithm not in ['AES-256-GCM', 'Blowfish-256-EAX', 'ChaCha20-Poly1305']:
+        if algorithm not in ALGORITHMS and algorithm != AUTO_ALGORITHM:
             return jsonify({'error': 'Invalid algorithm'}), 400
         
-        file_data = file.read()
-        original_filename = secure_filename(file.filename)
+        start_time = time.perf_counter()
+        work_dir = tempfile.mkdtemp(prefix='batch-', dir=app.config['UPLOAD_FOLDER'])
+        try:
+            inputs = collect_batch_inputs(files, archive, work_dir)
+        except (ValueError, zipfile.BadZipFile, tarfile.TarError) as e:
+            return jsonify({'error': str(e)}), 400
+        if not inputs:
+            return jsonify({'error': 'No files found in upload'}), 400
         
-        encrypted_data, enc_time_ms, file_hash, salt, nonce, tag = encrypt_file(
-            file_data, passphrase, algorithm
-        )
+        # KDF and cipher work fans out to the process pool; each worker writes its own .part file
+        pool = get_batch_pool()
+        jobs = []
+        for original_filename, input_path in inputs:
+            encrypted_filename = encrypted_name(original_filename)
+            encrypted_path = os.path.join(app.config['ENCRYPTED_FOLDER'], encrypted_filename)
+            # With 'auto' each file gets the algorithm for its own size
+            file_algorithm = algorithm
+            if algorithm == AUTO_ALGORITHM:
+                file_algorithm = algorithm_selector.choose(os.path.getsize(input_path))
+            future = pool.submit(encrypt_path, input_path, f"{encrypted_path}.part", passphrase, file_algorithm,
+                                 key_mode=app.config['KEY_MODE'], compression=app.config['COMPRESSION'],
+                                 kdf=app.config['KDF'])
+            jobs.append((original_filename, encrypted_filename, encrypted_path, file_algorithm, future))
         
-        encrypted_filename = f"{os.path.splitext(original_filename)[0]}_encrypted{os.path.splitext(original_filename)[1]}.enc"
-        encrypted_path = os.path.join(app.config['ENCRYPTED_FOLDER'], encrypted_filename)
-        
-        with open(encrypted_path, 'wb') as f:
-            f.write(encrypted_data)
-        
-        blockchain.add_block(
-            algorithm=algorithm,
-            file_name=original_filename,
-            file_hash=file_hash,
-            ciphertext_path=encrypted_path,
-            nonce=nonce,
-            tag=tag,
-            salt=salt,
-            file_size_bytes=len(file_data),
-            enc_time_ms=enc_time_ms,
-            dec_time_ms=None
-        )
+        manifest = []
+        entries = []
+        appended = []
+        for original_filename, encrypted_filename, encrypted_path, file_algorithm, future in jobs:
+            try:
+                result = future.result()
+                os.replace(f"{encrypted_path}.part", encrypted_path)
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    discard_batch_pool(pool)
+                if os.path.exists(f"{encrypted_path}.part"):
+                    os.remove(f"{encrypted_path}.part")
+                manifest.append({'file_name': original_filename, 'success': False, 'error': str(e)})
+                continue
+            
+            enc_time_ms, file_hash, _, _, _, file_size, phase_times_ms, stored_size = result
+            observe_crypto('encrypt', file_algorithm, enc_time_ms, file_size)
+            entries.append(ledger_entry(file_algorithm, original_filename, encrypted_path, result))
+            appended.append((len(manifest), encrypted_path))
+            manifest.append({
+                'file_name': original_filename,
+                'success': True,
+                'encrypted_filename': encrypted_filename,
+                'algorithm': file_algorithm,
+                'file_hash': file_hash,
+                'enc_time_ms': round(enc_time_ms, 2),
+                'file_size_kb': round(file_size / 1024, 2),
+                'stored_size_kb': round(stored_size / 1024, 2),
+                'phase_times_ms': {phase: round(ms, 3) for phase, ms in phase_times_ms.items()}
+            })
+        
+        # Successful files go through the group-commit writer like every other append, queued together
+        # so they land contiguously and in upload order
+        futures = ledger_writer.submit_many(entries)
+        for (position, encrypted_path), future in zip(appended, futures):
+            try:
+                manifest[position]['tx_hash'] = future.result()
+            except Exception as e:
+                os.remove(encrypted_path)
+                manifest[position] = {'file_name': manifest[position]['file_name'], 'success': False,
+                                      'error': str(e)}
+        succeeded = sum(item['success'] for item in manifest)
         
         return jsonify({
             'success': True,
-            'message': f'File encrypted successfully using {algorithm}',
-            'encrypted_filename': encrypted_filename,
-            'enc_time_ms': round(enc_time_ms, 2),
-            'file_size_kb': round(len(file_data) / 1024, 2),
-            'algorithm': algorithm
+            'message': f'Encrypted {succeeded} of {len(manifest)} files using {algorithm}',
+            'algorithm': algorithm,
+            'total': len(manifest),
+            'succeeded': succeeded,
+            'failed': len(manifest) - succeeded,
+            'total_time_ms': round((time.perf_counter() - start_time) * 1000, 2),
+            'files': manifest
         })
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+    finally:
+        if work_dir is not None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+@app.route('/api/algorithms/auto')
+def api_auto_algorithm():
+    try:
+        if request.args.get('refresh', '').lower() in ('1', 'true', 'yes'):
+            algorithm_selector.refresh()
+        return jsonify(algorithm_selector.snapshot())
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/api/decrypt', methods=['POST'])
 def api_decrypt():
     try:
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file uploaded'}), 400
+        file, passphrase, error = read_decrypt_form()
+        if error:
+            return jsonify({'error': error}), 400
         
-        file = request.files['file']
-        if file.filename == '':
-            return jsonify({'error': 'No file selected'}), 400
+        return jsonify(run_decrypt(file.stream, file.filename, passphrase))
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/decrypt/ref', methods=['POST'])
+def api_decrypt_ref():
+    source = None
+    try:
+        params = request.get_json(silent=True) or request.form
+        tx_hash = params.get('tx_hash')
+        file_hash = params.get('file_hash')
+        passphrase = params.get('passphrase')
+        persist = str(params.get('persist', '')).lower() in ('1', 'true', 'yes', 'on')
         
-        passphrase = request.form.get('passphrase')
+        if not tx_hash and not file_hash:
+            return jsonify({'error': 'tx_hash or file_hash is required'}), 400
         
         if not passphrase:
             return jsonify({'error': 'Passphrase is required'}), 400
         
-        encrypted_data = file.read()
+        block = blockchain.get_block(tx_hash=tx_hash) if tx_hash else blockchain.get_block(file_hash=file_hash)
+        if block is None:
+            return jsonify({'error': 'Block not found'}), 404
+        if not os.path.isfile(block['ciphertext_path']):
+            return jsonify({'error': 'Ciphertext not found'}), 404
         
-        decrypted_data, dec_time_ms, algorithm = decrypt_file(encrypted_data, passphrase)
-        
-        original_filename = secure_filename(file.filename)
-        if original_filename.endswith('.enc'):
-            decrypted_filename = original_filename.replace('_encrypted', '').replace('.enc', '')
+        source = open(block['ciphertext_path'], 'rb')
+        start_time = time.perf_counter()
+        decryptor = StreamDecryptor(source, passphrase, workers=app.config['CIPHER_WORKERS'])
+        check_ciphertext(decryptor, block)
+        if decryptor.version == 1:
+            # Version 1 files only authenticate at the very end, so they are decrypted in full before
+            # anything is sent; they were written by the in-memory API and fit in memory
+            chunks = iter([b''.join(decryptor)])
         else:
-            decrypted_filename = f"decrypted_{original_filename}"
+            chunks = iter(decryptor)
+        # Decrypting the first segment up front turns a wrong passphrase into an error response
+        first_chunk = next(chunks)
+        first_seconds = time.perf_counter() - start_time
+    except CiphertextMismatch as e:
+        source.close()
+        return jsonify({'error': str(e)}), 409
+    except Exception as e:
+        if source is not None:
+            source.close()
+        return jsonify({'error': str(e)}), 500
+    
+    decrypted_path = os.path.join(app.config['DECRYPTED_FOLDER'], secure_filename(block['file_name']))
+    
+    def generate():
+        # Only time spent decrypting counts towards dec_time_ms, not time waiting on the client
+        # Each chunk is held back until the next one is decrypted, so the last one is only sent once the
+        # whole file hashes to the block's file_hash; on a mismatch the response ends short of its
+        # Content-Length and the client sees a failed download, not a complete one
+        hasher = hashlib.sha256()
+        decrypt_seconds = first_seconds
+        size = 0
+        try:
+            with atomic_output(decrypted_path) if persist else nullcontext() as out:
+                chunk = first_chunk
+                while chunk is not None:
+                    chunk_start = time.perf_counter()
+                    next_chunk = next(chunks, None)
+                    decrypt_seconds += time.perf_counter() - chunk_start
+                    hasher.update(chunk)
+                    size += len(chunk)
+                    if next_chunk is None and (hasher.hexdigest() != block['file_hash']
+                                               or size != block['file_size_bytes']):
+                        raise CiphertextMismatch(f"Decrypted file does not match block {block['tx_hash']}")
+                    if out is not None:
+                        out.write(chunk)
+                    yield chunk
+                    chunk = next_chunk
+        finally:
+            source.close()
         
-        decrypted_path = os.path.join(app.config['DECRYPTED_FOLDER'], decrypted_filename)
+        observe_crypto('decrypt', decryptor.algorithm, decrypt_seconds * 1000, block['file_size_bytes'])
+        blockchain.update_block_dec_time_by_tx_hash(block['tx_hash'], decrypt_seconds * 1000)
+    
+    response = app.response_class(generate(), mimetype='application/octet-stream')
+    response.headers['Content-Disposition'] = f"attachment; filename=\"{secure_filename(block['file_name'])}\""
+    response.headers['Content-Length'] = str(block['file_size_bytes'])
+    response.headers['X-Tx-Hash'] = block['tx_hash']
+    response.headers['X-Algorithm'] = decryptor.algorithm
+    return response
+
+@app.route('/api/jobs/encrypt', methods=['POST'])
+def api_job_encrypt():
+    try:
+        file, passphrase, algorithm, error = read_encrypt_form()
+        if error:
+            return jsonify({'error': error}), 400
         
-        with open(decrypted_path, 'wb') as f:
-            f.write(decrypted_data)
+        filename = file.filename
+        def work(upload_path, job):
+            with open(upload_path, 'rb') as source:
+                return run_encrypt(source, filename, passphrase, algorithm, progress=job.progress)
         
-        file_hash = hashlib.sha256(decrypted_data).hexdigest()
-        blockchain.update_block_dec_time(file_hash, dec_time_ms)
+        return submit_job('encrypt', work)
+    
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 429, {'Retry-After': '5'}
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs/decrypt', methods=['POST'])
+def api_job_decrypt():
+    try:
+        file, passphrase, error = read_decrypt_form()
+        if error:
+            return jsonify({'error': error}), 400
         
-        return jsonify({
-            'success': True,
-            'message': f'File decrypted successfully using {algorithm}',
-            'decrypted_filename': decrypted_filename,
-            'dec_time_ms': round(dec_time_ms, 2),
-            'file_size_kb': round(len(decrypted_data) / 1024, 2),
-            'algorithm': algorithm
-        })
+        filename = file.filename
+        return submit_job('decrypt', lambda upload_path, job: run_decrypt(
+            upload_path, filename, passphrase, progress=job.progress
+        ))
     
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 429, {'Retry-After': '5'}
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET', 'DELETE'])
+def api_job_status(job_id):
+    try:
+        if request.method == 'DELETE':
+            job = job_manager.cancel(job_id)
+        else:
+            job = job_manager.get(job_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+        
+        _, status = job.snapshot()
+        return jsonify({'success': True, **status})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/jobs/<job_id>/events')
+def api_job_events(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    
+    def stream():
+        # Sends the latest state whenever it changes (intermediate updates are coalesced) until the job ends
+        sent_version = None
+        while True:
+            job.touch()
+            version, status = job.snapshot()
+            if version != sent_version:
+                sent_version = version
+                yield f"data: {json.dumps(status)}\n\n"
+                if status['status'] in FINISHED_STATES:
+                    return
+            else:
+                yield ": keepalive\n\n"
+            job.wait(version, app.config['JOB_EVENT_KEEPALIVE'])
+    
+    return app.response_class(stream(), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/download/<path:filename>')
 def download_file(filename):
     try:
@@ -138,9 +732,10 @@ def download_file(filename):
         decrypted_path = os.path.join(app.config['DECRYPTED_FOLDER'], filename)
         
         if os.path.exists(encrypted_path):
-            return send_file(encrypted_path, as_attachment=True, download_name=filename)
+            # send_file resolves relative paths against the app root, not the working directory
+            return send_file(os.path.abspath(encrypted_path), as_attachment=True, download_name=filename)
         elif os.path.exists(decrypted_path):
-            return send_file(decrypted_path, as_attachment=True, download_name=filename)
+            return send_file(os.path.abspath(decrypted_path), as_attachment=True, download_name=filename)
         else:
             return jsonify({'error': 'File not found'}), 404
     except Exception as e:
@@ -149,33 +744,98 @@ def download_file(filename):
 @app.route('/api/benchmark/chart')
 def api_benchmark_chart():
     try:
-        chart_base64 = generate_benchmark_chart()
-        if chart_base64:
-            return jsonify({'success': True, 'chart': chart_base64})
-        else:
+        dpi = request.args.get('dpi', DEFAULT_CHART_DPI, type=int)
+        if not 50 <= dpi <= 300:
+            return jsonify({'error': 'dpi must be between 50 and 300'}), 400
+        output_format = request.args.get('format', 'json')
+        if output_format not in ('json', 'png'):
+            return jsonify({'error': 'format must be json or png'}), 400
+        
+        # The ETag is derived from the cache key, so unchanged charts get a 304 without rendering
+        cache_key = chart_cache_key(blockchain, dpi) + (output_format,)
+        etag = chart_etag(cache_key)
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            return response
+        
+        png = get_benchmark_chart(blockchain, dpi, cache_key[:-1])
+        if png is None:
+            if output_format == 'png':
+                return jsonify({'success': False, 'message': 'No data available for benchmark'}), 404
             return jsonify({'success': False, 'message': 'No data available for benchmark'})
+        
+        if output_format == 'png':
+            response = app.response_class(png, mimetype='image/png')
+        else:
+            response = jsonify({'success': True, 'chart': base64.b64encode(png).decode('utf-8')})
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/benchmark/stats')
 def api_benchmark_stats():
     try:
-        stats = get_benchmark_stats()
+        stats = get_benchmark_stats(blockchain)
         return jsonify({'success': True, 'stats': stats})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/benchmark/analytics')
+def api_benchmark_analytics():
+    try:
+        window = request.args.get('window', type=int)
+        if window is not None and window <= 0:
+            return jsonify({'error': 'window must be a positive number of seconds'}), 400
+        return jsonify({'success': True, 'analytics': compute_analytics(blockchain, window)})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/ledger')
 def api_ledger():
     try:
-        blocks = blockchain.get_all_blocks()
-        return jsonify({'success': True, 'blocks': blocks})
+        args = request.args
+        blocks, next_cursor = blockchain.get_blocks_page(
+            limit=args.get('limit', DEFAULT_PAGE_SIZE, type=int),
+            # A block_index, or one per shard on a sharded ledger
+            cursor=args.get('cursor'),
+            order=args.get('order', 'desc'),
+            algorithm=args.get('algorithm'),
+            file_name=args.get('file_name'),
+            file_hash=args.get('file_hash'),
+            tx_hash=args.get('tx_hash'),
+            block_hash=args.get('hash'),
+            since=args.get('since'),
+            until=args.get('until'),
+            min_size=args.get('min_size', type=int),
+            max_size=args.get('max_size', type=int)
+        )
+        return jsonify({'success': True, 'blocks': [block.to_dict() for block in blocks], 'next_cursor': next_cursor})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/verify')
 def api_verify():
     try:
+        if request.args.get('mode') == 'full':
+            workers = request.args.get('workers', type=int)
+            if workers is not None:
+                if workers < 1:
+                    return jsonify({'error': 'workers must be at least 1'}), 400
+                # Every pool process is started up front, so the client cannot ask for more than the cores
+                workers = min(workers, os.cpu_count() or 1)
+            is_valid, message, first_bad_index = blockchain.audit_chain(workers=workers)
+            return jsonify({
+                'success': True,
+                'is_valid': is_valid,
+                'message': message,
+                'first_bad_index': first_bad_index
+            })
+        
         is_valid, message = blockchain.verify_chain()
         return jsonify({
             'success': True,
@@ -185,6 +845,16 @@ def api_verify():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/proof/<tx_hash>')
+def api_proof(tx_hash):
+    try:
+        proof = blockchain.get_inclusion_proof(tx_hash)
+        if proof is None:
+            return jsonify({'error': 'Block not found'}), 404
+        return jsonify({'success': True, 'proof': proof})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/benchmark/clear', methods=['POST'])
 def api_benchmark_clear():
     try:
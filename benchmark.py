@@ -1,35 +1,99 @@
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
 import io
+import math
 import base64
-from blockchain import Blockchain
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+import numpy as np
+import metrics
+from analytics import compute_analytics, model_throughput
+from blockchain import Blockchain, PHASE_COLUMNS, sketch_quantile
 
-def generate_benchmark_chart():
-    blockchain = Blockchain()
-    blocks = blockchain.get_blocks_for_benchmark()
-    
-    if not blocks:
-        return None
-    
-    data = {
-        'AES-256-GCM': {'enc_times': [], 'dec_times': [], 'file_sizes': []},
-        'Blowfish-256-EAX': {'enc_times': [], 'dec_times': [], 'file_sizes': []},
-        'ChaCha20-Poly1305': {'enc_times': [], 'dec_times': [], 'file_sizes': []}
+ALGORITHMS = ['AES-256-GCM', 'Blowfish-256-EAX', 'ChaCha20-Poly1305']
+
+CHART_CACHE_SIZE = 16
+DEFAULT_CHART_DPI = 100
+
+_chart_cache = OrderedDict()
+_chart_cache_lock = threading.Lock()
+_chart_render_lock = threading.Lock()
+
+CHART_RENDER_SECONDS = metrics.histogram('encdec_chart_render_seconds', 'Benchmark chart render time (cache misses)')
+
+def load_pyplot():
+    # matplotlib is only imported once a chart actually has to be rendered
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+def summarize(aggregate):
+    if not aggregate or aggregate['count'] == 0:
+        return {'count': 0, 'mean': 0, 'stddev': 0, 'min': 0, 'max': 0, 'p50': 0, 'p95': 0, 'p99': 0}
+    
+    count = aggregate['count']
+    mean = aggregate['sum'] / count
+    variance = max(aggregate['sum_sq'] / count - mean * mean, 0.0)
+    return {
+        'count': count,
+        'mean': mean,
+        'stddev': math.sqrt(variance),
+        'min': aggregate['min'],
+        'max': aggregate['max'],
+        'p50': sketch_quantile(aggregate['histogram'], 0.50),
+        'p95': sketch_quantile(aggregate['histogram'], 0.95),
+        'p99': sketch_quantile(aggregate['histogram'], 0.99)
     }
+
+def chart_cache_key(blockchain, dpi=DEFAULT_CHART_DPI):
+    # Changes whenever a block is appended, a decrypt time is recorded or the benchmark is cleared;
+    # built from the ledger's cheap benchmark version so a 304 revalidation reads no sketch
+    return (blockchain.get_benchmark_version(), dpi)
+
+def chart_etag(cache_key):
+    return hashlib.sha256(repr(cache_key).encode()).hexdigest()[:32]
+
+def get_benchmark_chart(blockchain=None, dpi=DEFAULT_CHART_DPI, cache_key=None):
+    # Returns PNG bytes (or None when there is no data), rendering only on a cache miss
+    blockchain = blockchain or Blockchain()
+    cache_key = cache_key or chart_cache_key(blockchain, dpi)
+    
+    with _chart_cache_lock:
+        if cache_key in _chart_cache:
+            _chart_cache.move_to_end(cache_key)
+            return _chart_cache[cache_key]
+    
+    # Concurrent misses wait for a single render instead of each running matplotlib
+    with _chart_render_lock:
+        with _chart_cache_lock:
+            if cache_key in _chart_cache:
+                return _chart_cache[cache_key]
+        with CHART_RENDER_SECONDS.time():
+            png = render_benchmark_chart(blockchain, dpi)
+        with _chart_cache_lock:
+            _chart_cache[cache_key] = png
+            while len(_chart_cache) > CHART_CACHE_SIZE:
+                _chart_cache.popitem(last=False)
+    return png
+
+def generate_benchmark_chart(blockchain=None):
+    png = get_benchmark_chart(blockchain)
+    if png is None:
+        return None
+    return base64.b64encode(png).decode('utf-8')
+
+def render_benchmark_chart(blockchain, dpi=DEFAULT_CHART_DPI):
+    aggregates = blockchain.get_benchmark_aggregates()
     
-    for block in blocks:
-        algo = block['algorithm']
-        if algo in data:
-            data[algo]['enc_times'].append(block['enc_time_ms'])
-            if block['dec_time_ms'] > 0:
-                data[algo]['dec_times'].append(block['dec_time_ms'])
-            data[algo]['file_sizes'].append(block['file_size_bytes'] / 1024)
+    if not any(aggregates.get(algo, {}).get('enc_time_ms') for algo in ALGORITHMS):
+        return None
     
-    fig, axes = plt.subplots(2, 2, figsize=(14, 10))
+    plt = load_pyplot()
+    fig, axes = plt.subplots(3, 2, figsize=(14, 15))
     fig.suptitle('Encryption and Decryption Algorithm Performance Comparison', fontsize=16, fontweight='bold')
     
-    algorithms = ['AES-256-GCM', 'Blowfish-256-EAX', 'ChaCha20-Poly1305']
+    algorithms = ALGORITHMS
     colors = ['#5B7FFF', '#8E5BFF', '#FF5BCD']
     
     avg_enc_times = []
@@ -37,13 +101,10 @@ def generate_benchmark_chart():
     avg_file_sizes = []
     
     for algo in algorithms:
-        enc_times = data[algo]['enc_times']
-        dec_times = data[algo]['dec_times']
-        file_sizes = data[algo]['file_sizes']
-        
-        avg_enc_times.append(sum(enc_times) / len(enc_times) if enc_times else 0)
-        avg_dec_times.append(sum(dec_times) / len(dec_times) if dec_times else 0)
-        avg_file_sizes.append(sum(file_sizes) / len(file_sizes) if file_sizes else 0)
+        algo_aggregates = aggregates.get(algo, {})
+        avg_enc_times.append(summarize(algo_aggregates.get('enc_time_ms'))['mean'])
+        avg_dec_times.append(summarize(algo_aggregates.get('dec_time_ms'))['mean'])
+        avg_file_sizes.append(summarize(algo_aggregates.get('file_size_bytes'))['mean'] / 1024)
     
     axes[0, 0].bar(algorithms, avg_enc_times, color=colors, alpha=0.8)
     axes[0, 0].set_title('Average Encryption Time', fontweight='bold')
@@ -82,38 +143,82 @@ def generate_benchmark_chart():
     axes[1, 1].legend()
     axes[1, 1].grid(axis='y', alpha=0.3)
     
+    plot_analytics(axes[2, 0], axes[2, 1], compute_analytics(blockchain), algorithms, colors)
+    
     plt.tight_layout()
     
     img_buffer = io.BytesIO()
-    plt.savefig(img_buffer, format='png', dpi=100, bbox_inches='tight')
-    img_buffer.seek(0)
-    img_base64 = base64.b64encode(img_buffer.read()).decode('utf-8')
+    plt.savefig(img_buffer, format='png', dpi=dpi, bbox_inches='tight')
     plt.close()
     
-    return img_base64
+    return img_buffer.getvalue()
 
-def get_benchmark_stats():
-    blockchain = Blockchain()
-    blocks = blockchain.get_blocks_for_benchmark()
-    
-    stats = {
-        'AES-256-GCM': {'count': 0, 'avg_enc': 0, 'avg_dec': 0, 'avg_size': 0},
-        'Blowfish-256-EAX': {'count': 0, 'avg_enc': 0, 'avg_dec': 0, 'avg_size': 0},
-        'ChaCha20-Poly1305': {'count': 0, 'avg_enc': 0, 'avg_dec': 0, 'avg_size': 0}
-    }
-    
-    for block in blocks:
-        algo = block['algorithm']
-        if algo in stats:
-            stats[algo]['count'] += 1
-            stats[algo]['avg_enc'] += block['enc_time_ms']
-            stats[algo]['avg_dec'] += block['dec_time_ms']
-            stats[algo]['avg_size'] += block['file_size_bytes'] / 1024
-    
-    for algo in stats:
-        if stats[algo]['count'] > 0:
-            stats[algo]['avg_enc'] /= stats[algo]['count']
-            stats[algo]['avg_dec'] /= stats[algo]['count']
-            stats[algo]['avg_size'] /= stats[algo]['count']
+def plot_analytics(size_axis, trend_axis, analytics, algorithms, colors):
+    # Size-normalized panels: median cipher throughput per size bucket with its p10-p90 band and the
+    # end-to-end throughput the fitted cost model predicts, and the rolling median throughput over time
+    for algo, color in zip(algorithms, colors):
+        encrypt = analytics['algorithms'][algo]['encrypt']
+        by_size = encrypt['by_size']
+        if by_size:
+            centers = [math.sqrt(bucket['min_size_bytes'] * bucket['max_size_bytes']) for bucket in by_size]
+            size_axis.plot(centers, [bucket['p50'] for bucket in by_size], marker='o', color=color, label=algo)
+            size_axis.fill_between(centers, [bucket['p10'] for bucket in by_size],
+                                   [bucket['p90'] for bucket in by_size], color=color, alpha=0.15)
+            model = encrypt['cost_model']
+            if model and len(centers) > 1:
+                sizes = np.geomspace(centers[0], centers[-1], 50)
+                size_axis.plot(sizes, model_throughput(model, sizes), linestyle='--', color=color, alpha=0.7)
+        
+        points = encrypt['trend']
+        if points:
+            times = [datetime.fromtimestamp(point['start'], timezone.utc) for point in points]
+            trend_axis.plot(times, [point['rolling_p50_mb_per_s'] for point in points], marker='.', color=color,
+                            label=algo)
+    
+    size_axis.set_xscale('log')
+    size_axis.set_title('Encryption Throughput by File Size (cipher p50, p10-p90; end-to-end cost model)',
+                        fontweight='bold')
+    size_axis.set_xlabel('File size (bytes)')
+    size_axis.set_ylabel('Throughput (MB/s)')
+    size_axis.grid(alpha=0.3)
+    
+    trend_axis.set_title(f'Encryption Throughput Trend (rolling p50, {analytics["window_seconds"]}s windows)',
+                         fontweight='bold')
+    trend_axis.set_ylabel('Throughput (MB/s)')
+    trend_axis.tick_params(axis='x', rotation=15)
+    trend_axis.grid(alpha=0.3)
+    for axis in (size_axis, trend_axis):
+        if axis.get_legend_handles_labels()[0]:
+            axis.legend()
+
+def get_benchmark_stats(blockchain=None):
+    blockchain = blockchain or Blockchain()
+    aggregates = blockchain.get_benchmark_aggregates()
+    
+    stats = {}
+    for algo in ALGORITHMS:
+        algo_aggregates = aggregates.get(algo, {})
+        enc = summarize(algo_aggregates.get('enc_time_ms'))
+        dec = summarize(algo_aggregates.get('dec_time_ms'))
+        size = summarize(algo_aggregates.get('file_size_bytes'))
+        
+        phases = {column: summarize(algo_aggregates.get(column))['mean'] for column in PHASE_COLUMNS}
+        cipher_bytes = algo_aggregates.get('cipher_bytes')
+        cipher_time = algo_aggregates.get('cipher_time_ms')
+        cipher_mb_per_s = 0
+        if cipher_bytes and cipher_time and cipher_time['sum'] > 0:
+            cipher_mb_per_s = cipher_bytes['sum'] / (1024 * 1024) / (cipher_time['sum'] / 1000)
+        
+        stats[algo] = {
+            'count': enc['count'],
+            'dec_count': dec['count'],
+            'avg_enc': enc['mean'],
+            'avg_dec': dec['mean'],
+            'avg_size': size['mean'] / 1024,
+            'enc': enc,
+            'dec': dec,
+            'phases': phases,
+            'cipher_mb_per_s': cipher_mb_per_s
+        }
     
     return stats
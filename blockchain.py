@@ -1,17 +1,419 @@
 import sqlite3
 import hashlib
 import json
+import math
+import multiprocessing
 from datetime import datetime
 import base64
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from functools import partial
+from itertools import chain
+from operator import itemgetter
 
-class Blockchain:
-    def __init__(self, db_path='ledger.db'):
+import metrics
+from ledger_archive import LedgerSegment, file_sha256, write_segment
+from merkle import GENESIS_BATCH_HASH, compute_batch_hash, merkle_path, merkle_root
+
+# Per-phase timings stored next to each block. They are measurement metadata, not part of the hashed block.
+PHASE_COLUMNS = [
+    'kdf_time_ms',
+    'cipher_time_ms',
+    'hash_time_ms',
+    'header_time_ms',
+    'write_time_ms',
+    'ledger_time_ms',
+    'compress_time_ms'
+]
+
+BLOCK_COLUMNS = [
+    'block_index', 'timestamp', 'prev_hash', 'tx_hash', 'algorithm', 'file_name',
+    'file_hash', 'ciphertext_path', 'nonce_b64', 'tag_b64', 'salt_b64',
+    'file_size_bytes', 'enc_time_ms', 'dec_time_ms'
+] + PHASE_COLUMNS + ['hash_version', 'stored_size_bytes']
+
+# Block attribute names: the columns, with block_index exposed as index
+BLOCK_FIELDS = ['index'] + BLOCK_COLUMNS[1:]
+BLOCK_FIELD_INDEX = {field: i for i, field in enumerate(BLOCK_FIELDS)}
+
+# Applied to every pooled connection. WAL lets readers run alongside the single writer, and
+# synchronous=NORMAL only fsyncs at checkpoints, which is still durable against application crashes.
+CONNECTION_PRAGMAS = [
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA cache_size = -16000',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA busy_timeout = 30000'
+]
+
+BLOCK_ENTRY_DEFAULTS = {
+    'dec_time_ms': None,
+    'kdf_time_ms': None,
+    'cipher_time_ms': None,
+    'hash_time_ms': None,
+    'header_time_ms': None,
+    'write_time_ms': None,
+    'compress_time_ms': None,
+    'stored_size_bytes': None
+}
+
+class Block(namedtuple('BlockRecord', BLOCK_FIELDS)):
+    """Immutable, tuple-backed ledger row.
+
+    Fields are attributes (block.tx_hash); block['tx_hash'] is also accepted so code written
+    against the old dict rows keeps working. Use to_dict() for JSON.
+    """
+    __slots__ = ()
+    
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            if key not in BLOCK_FIELD_INDEX:
+                raise KeyError(key)
+            return tuple.__getitem__(self, BLOCK_FIELD_INDEX[key])
+        return tuple.__getitem__(self, key)
+    
+    def get(self, key, default=None):
+        return self[key] if key in BLOCK_FIELD_INDEX else default
+    
+    def to_dict(self):
+        return dict(zip(BLOCK_FIELDS, self))
+    
+    @classmethod
+    def from_mapping(cls, mapping):
+        # Blocks serialized before hash versions existed were all hashed as version 0
+        values = {'hash_version': 0, **mapping}
+        return tuple.__new__(cls, [values.get(field) for field in BLOCK_FIELDS])
+    
+    def hash_matches(self):
+        if self.hash_version == 1:
+            return hashlib.sha256(encode_block(binary_hashed_values(self))).hexdigest() == self.tx_hash
+        if self.hash_version:
+            return False
+        block_data = {field: self[field] for field in HASHED_FIELDS}
+        if compute_block_hash(block_data, 0) == self.tx_hash:
+            return True
+        # update_block_dec_time fills in dec_time_ms after the block was sealed with 0.0
+        if self.dec_time_ms:
+            block_data['dec_time_ms'] = 0.0
+            return compute_block_hash(block_data, 0) == self.tx_hash
+        return False
+
+# Rows are selected in BLOCK_COLUMNS order, so they map straight onto Block without a Python-level call
+row_to_block = partial(tuple.__new__, Block)
+
+# Hash version 0 hashes these fields as sorted-key JSON
+HASHED_FIELDS = [
+    'index', 'timestamp', 'prev_hash', 'algorithm', 'file_name', 'file_hash',
+    'ciphertext_path', 'nonce_b64', 'tag_b64', 'salt_b64', 'file_size_bytes',
+    'enc_time_ms', 'dec_time_ms'
+]
+
+# Hash version 1 uses encode_block over the same fields minus dec_time_ms, which is filled in after sealing
+HASH_VERSION = 1
+BINARY_HASHED_FIELDS = [field for field in HASHED_FIELDS if field != 'dec_time_ms']
+BLOCK_ENCODING_MAGIC = b'BLK'
+NONE_LENGTH = struct.pack('>I', 0xFFFFFFFF)
+binary_hashed_values = itemgetter(*[BLOCK_FIELD_INDEX[field] for field in BINARY_HASHED_FIELDS])
+
+def encode_block(values):
+    # Canonical binary encoding (hash version 1) of BINARY_HASHED_FIELDS values, in that order:
+    # fixed-width big-endian numbers and length-prefixed UTF-8 strings
+    index, *strings, file_size_bytes, enc_time_ms = values
+    parts = [BLOCK_ENCODING_MAGIC, struct.pack('>BQ', 1, index)]
+    for value in strings:
+        if value is None:
+            parts.append(NONE_LENGTH)
+        else:
+            data = value.encode('utf-8')
+            parts.append(struct.pack('>I', len(data)))
+            parts.append(data)
+    parts.append(struct.pack('>qd', file_size_bytes, enc_time_ms))
+    return b''.join(parts)
+
+BLOCK_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_blocks_file_hash ON blocks (file_hash, dec_time_ms)',
+    'CREATE INDEX IF NOT EXISTS idx_blocks_tx_hash ON blocks (tx_hash)',
+    'CREATE INDEX IF NOT EXISTS idx_blocks_algorithm ON blocks (algorithm, block_index)',
+    'CREATE INDEX IF NOT EXISTS idx_blocks_file_name ON blocks (file_name)',
+    'CREATE INDEX IF NOT EXISTS idx_blocks_timestamp ON blocks (timestamp)',
+    'CREATE INDEX IF NOT EXISTS idx_blocks_file_size ON blocks (file_size_bytes)'
+]
+
+# Running per-algorithm benchmark aggregates. Decrypt times are only counted for blocks that
+# were actually decrypted; cipher_bytes sums the sizes of blocks that carry a cipher timing.
+AGGREGATE_METRICS = ['enc_time_ms', 'dec_time_ms', 'file_size_bytes', 'cipher_bytes'] + PHASE_COLUMNS
+# Version 2 keeps each sketch bucket in its own benchmark_sketch row instead of a JSON histogram
+AGGREGATES_VERSION = '2'
+
+# Log-bucketed sketch with ~2% relative error; buckets are fixed so sketches merge by adding counts
+SKETCH_GAMMA = 1.02 / 0.98
+SKETCH_ZERO_BUCKET = 'zero'
+
+def sketch_bucket(value):
+    if value <= 0:
+        return SKETCH_ZERO_BUCKET
+    return str(math.ceil(math.log(value, SKETCH_GAMMA)))
+
+def sketch_quantile(histogram, q):
+    total = sum(histogram.values())
+    if total == 0:
+        return None
+    
+    rank = q * (total - 1)
+    seen = 0
+    buckets = sorted(histogram, key=lambda b: float('-inf') if b == SKETCH_ZERO_BUCKET else int(b))
+    for bucket in buckets:
+        seen += histogram[bucket]
+        if seen > rank:
+            if bucket == SKETCH_ZERO_BUCKET:
+                return 0.0
+            return 2 * SKETCH_GAMMA ** int(bucket) / (SKETCH_GAMMA + 1)
+    return None
+
+def new_aggregate():
+    return {'count': 0, 'sum': 0.0, 'sum_sq': 0.0, 'min': None, 'max': None, 'histogram': {}}
+
+def aggregate_add(aggregate, value):
+    aggregate['count'] += 1
+    aggregate['sum'] += value
+    aggregate['sum_sq'] += value * value
+    aggregate['min'] = value if aggregate['min'] is None else min(aggregate['min'], value)
+    aggregate['max'] = value if aggregate['max'] is None else max(aggregate['max'], value)
+    bucket = sketch_bucket(value)
+    aggregate['histogram'][bucket] = aggregate['histogram'].get(bucket, 0) + 1
+
+def aggregate_merge(target, other):
+    target['count'] += other['count']
+    target['sum'] += other['sum']
+    target['sum_sq'] += other['sum_sq']
+    for key, pick in (('min', min), ('max', max)):
+        if other[key] is not None:
+            target[key] = other[key] if target[key] is None else pick(target[key], other[key])
+    for bucket, count in other['histogram'].items():
+        target['histogram'][bucket] = target['histogram'].get(bucket, 0) + count
+    return target
+
+def block_metric_values(block):
+    values = [('enc_time_ms', block['enc_time_ms']), ('file_size_bytes', block['file_size_bytes'])]
+    if block['dec_time_ms']:
+        values.append(('dec_time_ms', block['dec_time_ms']))
+    if block['cipher_time_ms'] is not None:
+        # Compressed files put fewer bytes through the cipher than the original size
+        cipher_bytes = block['stored_size_bytes']
+        values.append(('cipher_bytes', block['file_size_bytes'] if cipher_bytes is None else cipher_bytes))
+    for column in PHASE_COLUMNS:
+        if block[column] is not None:
+            values.append((column, block[column]))
+    return values
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+GENESIS_PREV_HASH = '0' * 64
+# Blocks are grouped into fixed-size batches; each full batch gets a Merkle root chained to the previous batch
+MERKLE_BATCH_SIZE = 1024
+VERIFY_RANGE_SIZE = 50000
+# Archived blocks move to segment files of this many blocks; always whole Merkle batches
+DEFAULT_SEGMENT_BLOCKS = 16 * MERKLE_BATCH_SIZE
+# Filled in when reading segments written before these columns existed
+SEGMENT_COLUMN_DEFAULTS = {'hash_version': 0}
+
+LEDGER_APPEND_SECONDS = metrics.histogram(
+    'encdec_ledger_append_seconds', 'Time from ledger submission to insert, including queueing and the write lock'
+)
+LEDGER_VERIFY_SECONDS = metrics.histogram('encdec_ledger_verify_seconds', 'Chain verification time', ('mode',))
+
+def compute_block_hash(block_data, hash_version=HASH_VERSION):
+    if hash_version == 0:
+        block_string = json.dumps(block_data, sort_keys=True).encode()
+    elif hash_version == 1:
+        block_string = encode_block([block_data[field] for field in BINARY_HASHED_FIELDS])
+    else:
+        raise ValueError(f"Unknown hash version: {hash_version}")
+    return hashlib.sha256(block_string).hexdigest()
+
+def block_hash_matches(block):
+    # Accepts a Block or a plain dict (e.g. a block from an inclusion proof)
+    if not isinstance(block, Block):
+        block = Block.from_mapping(block)
+    return block.hash_matches()
+
+def check_blocks(blocks, expected_index, prev_hash):
+    # Returns (count, last_tx_hash, error) where error is (block_index, message) or None.
+    # prev_hash=None skips the link check for the first block (checked by the caller when stitching).
+    count = 0
+    for block in blocks:
+        if block.index != expected_index:
+            return count, prev_hash, (expected_index, f"Block {expected_index} is missing")
+        if prev_hash is not None and block.prev_hash != prev_hash:
+            if block.index == 0:
+                return count, prev_hash, (0, "Genesis block has invalid prev_hash")
+            return count, prev_hash, (block.index, f"Block {block.index} has broken chain link")
+        if not block.hash_matches():
+            return count, prev_hash, (block.index, f"Block {block.index} has invalid transaction hash")
+        prev_hash = block.tx_hash
+        expected_index += 1
+        count += 1
+    return count, prev_hash, None
+
+def block_filter(algorithm=None, file_name=None, file_hash=None, tx_hash=None, block_hash=None,
+                 since=None, until=None, min_size=None, max_size=None):
+    # Python counterpart of the get_blocks_page SQL conditions, applied to archived blocks
+    def matches(block):
+        return ((not algorithm or block.algorithm == algorithm) and
+                (not file_name or (block.file_name or '').startswith(file_name)) and
+                (not file_hash or block.file_hash == file_hash) and
+                (not tx_hash or block.tx_hash == tx_hash) and
+                (not block_hash or block_hash in (block.tx_hash, block.file_hash)) and
+                (not since or block.timestamp >= since) and
+                (not until or block.timestamp <= until) and
+                (min_size is None or block.file_size_bytes >= int(min_size)) and
+                (max_size is None or block.file_size_bytes <= int(max_size)))
+    return matches
+
+def verify_segment(path, start, end, expected_sha256, head_hash):
+    # Worker for Blockchain.audit_chain: checks an archived segment file against its catalog entry.
+    # Returns the same shape as verify_block_range.
+    result = {'start': start, 'end': end, 'count': 0, 'first_prev_hash': None, 'last_tx_hash': None,
+              'error': None}
+    try:
+        if file_sha256(path) != expected_sha256:
+            result['error'] = (start, f"Ledger segment for blocks {start}-{end} has been modified")
+            return result
+        segment = LedgerSegment(path)
+    except (OSError, ValueError) as e:
+        result['error'] = (start, f"Ledger segment for blocks {start}-{end} is unreadable: {e}")
+        return result
+    try:
+        if (segment.start_index, segment.end_index, segment.head_hash) != (start, end, head_hash):
+            result['error'] = (start, f"Ledger segment for blocks {start}-{end} does not match its catalog entry")
+            return result
+        result['first_prev_hash'] = segment.first_prev_hash
+        blocks = map(row_to_block, segment.rows(BLOCK_COLUMNS, defaults=SEGMENT_COLUMN_DEFAULTS))
+        count, last_tx_hash, error = check_blocks(blocks, start, segment.first_prev_hash)
+        if error is None and count != end - start + 1:
+            error = (start + count, f"Block {start + count} is missing")
+        result.update(count=count, last_tx_hash=last_tx_hash, error=error)
+        return result
+    finally:
+        segment.close()
+
+def verify_block_range(db_path, start, end):
+    # Worker for Blockchain.audit_chain; runs in a separate process with its own read-only connection
+    conn = sqlite3.connect(f'file:{db_path}?mode=ro', uri=True, timeout=30)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f'''
+            SELECT {", ".join(BLOCK_COLUMNS)} FROM blocks
+            WHERE block_index BETWEEN ? AND ? ORDER BY block_index ASC
+        ''', (start, end))
+        blocks = (row_to_block(row) for row in cursor)
+        
+        first = next(blocks, None)
+        if first is None:
+            return {'start': start, 'end': end, 'count': 0, 'first_prev_hash': None,
+                    'last_tx_hash': None, 'error': (start, f"Block {start} is missing")}
+        first_prev_hash = first['prev_hash']
+        count, last_tx_hash, error = check_blocks(chain([first], blocks), start, first_prev_hash)
+        if error is None and count != end - start + 1:
+            error = (start + count, f"Block {start + count} is missing")
+        return {'start': start, 'end': end, 'count': count, 'first_prev_hash': first_prev_hash,
+                'last_tx_hash': last_tx_hash, 'error': error}
+    finally:
+        conn.close()
+
+class LedgerDatabase:
+    """Per-thread SQLite connections with the ledger's pragmas and transaction helpers."""
+    
+    def __init__(self, db_path):
         self.db_path = db_path
+        self._local = threading.local()
+    
+    def connection(self):
+        # One connection per thread (and per process, so forked workers never share a handle)
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+    
+    def close(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local.conn = None
+    
+    @contextmanager
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the write lock up front, so reading the tip and inserting the
+        # next block cannot interleave with another writer
+        conn = self.connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            yield conn.cursor()
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        else:
+            conn.execute('COMMIT')
+    
+    @contextmanager
+    def snapshot(self):
+        # Read transaction, so the segment catalog and the hot table are seen at the same point and an
+        # archive committing meanwhile can neither hide nor duplicate blocks. Joins an open transaction.
+        conn = self.connection()
+        if conn.in_transaction:
+            yield conn.cursor()
+            return
+        conn.execute('BEGIN')
+        try:
+            yield conn.cursor()
+        finally:
+            conn.execute('COMMIT')
+
+class Blockchain(LedgerDatabase):
+    """SQLite hash-chain ledger with an optional cold tier.
+
+    With ``hot_blocks`` set, archive_blocks() moves all but the newest ``hot_blocks`` blocks into
+    immutable segment files under ``archive_dir`` (default: ``<db name>_segments`` next to the
+    database). Readers and verification span both tiers transparently.
+    """
+    
+    def __init__(self, db_path='ledger.db', archive_dir=None, hot_blocks=None,
+                 segment_blocks=DEFAULT_SEGMENT_BLOCKS):
+        if segment_blocks < MERKLE_BATCH_SIZE or segment_blocks % MERKLE_BATCH_SIZE:
+            raise ValueError(f"segment_blocks must be a multiple of {MERKLE_BATCH_SIZE}")
+        super().__init__(db_path)
+        self.archive_dir = archive_dir or f"{os.path.splitext(db_path)[0]}_segments"
+        self.hot_blocks = hot_blocks
+        self.segment_blocks = segment_blocks
+        self._segments = {}
+        self._segments_lock = threading.Lock()
+        self._archive_lock = threading.Lock()
         self.init_db()
     
     def init_db(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        conn = self.connection()
+        conn.execute('PRAGMA journal_mode = WAL')
+        with self.transaction() as cursor:
+            self._create_schema(cursor)
+            cursor.execute('SELECT value FROM benchmark_state WHERE key = ?', ('aggregates_version',))
+            row = cursor.fetchone()
+            if row is None or row[0] != AGGREGATES_VERSION:
+                self._rebuild_benchmark_aggregates(cursor)
+            # Backfills batches for ledgers written before Merkle batching existed
+            self._seal_merkle_batches(cursor)
+    
+    def _create_schema(self, cursor):
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS blocks (
                 block_index INTEGER PRIMARY KEY,
@@ -27,193 +429,920 @@ class Blockchain:
                 salt_b64 TEXT,
                 file_size_bytes INTEGER,
                 enc_time_ms REAL,
-                dec_time_ms REAL
+                dec_time_ms REAL,
+                kdf_time_ms REAL,
+                cipher_time_ms REAL,
+                hash_time_ms REAL,
+                header_time_ms REAL,
+                write_time_ms REAL,
+                ledger_time_ms REAL,
+                hash_version INTEGER DEFAULT 0,
+                compress_time_ms REAL,
+                stored_size_bytes INTEGER
             )
         ''')
+        cursor.execute('PRAGMA table_info(blocks)')
+        existing_columns = {row[1] for row in cursor.fetchall()}
+        for column in PHASE_COLUMNS:
+            if column not in existing_columns:
+                cursor.execute(f'ALTER TABLE blocks ADD COLUMN {column} REAL')
+        if 'hash_version' not in existing_columns:
+            # Every block written before hash versions existed is JSON-hashed (version 0)
+            cursor.execute('ALTER TABLE blocks ADD COLUMN hash_version INTEGER DEFAULT 0')
+        if 'stored_size_bytes' not in existing_columns:
+            cursor.execute('ALTER TABLE blocks ADD COLUMN stored_size_bytes INTEGER')
+        for index_sql in BLOCK_INDEXES:
+            cursor.execute(index_sql)
         cursor.execute('''
             CREATE TABLE IF NOT EXISTS benchmark_state (
                 key TEXT PRIMARY KEY,
                 value TEXT
             )
         ''')
-        conn.commit()
-        conn.close()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS benchmark_aggregates (
+                epoch INTEGER,
+                algorithm TEXT,
+                metric TEXT,
+                count INTEGER,
+                total REAL,
+                total_sq REAL,
+                min_value REAL,
+                max_value REAL,
+                PRIMARY KEY (epoch, algorithm, metric)
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS benchmark_sketch (
+                epoch INTEGER,
+                algorithm TEXT,
+                metric TEXT,
+                bucket TEXT,
+                count INTEGER,
+                PRIMARY KEY (epoch, algorithm, metric, bucket)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ledger_state (
+                key TEXT PRIMARY KEY,
+                value TEXT
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS merkle_batches (
+                batch_number INTEGER PRIMARY KEY,
+                start_index INTEGER,
+                end_index INTEGER,
+                merkle_root TEXT,
+                prev_batch_hash TEXT,
+                batch_hash TEXT,
+                created_at TEXT
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS ledger_segments (
+                segment_number INTEGER PRIMARY KEY,
+                start_index INTEGER,
+                end_index INTEGER,
+                first_prev_hash TEXT,
+                head_hash TEXT,
+                first_timestamp TEXT,
+                last_timestamp TEXT,
+                file_name TEXT,
+                file_sha256 TEXT,
+                size_bytes INTEGER,
+                created_at TEXT
+            )
+        ''')
     
     def get_last_block(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM blocks ORDER BY block_index DESC LIMIT 1')
+        with self.snapshot() as cursor:
+            return self._get_last_block(cursor)
+    
+    def _get_last_block(self, cursor):
+        cursor.execute(f'SELECT {", ".join(BLOCK_COLUMNS)} FROM blocks ORDER BY block_index DESC LIMIT 1')
         row = cursor.fetchone()
-        conn.close()
         
         if row:
-            return {
-                'index': row[0],
-                'timestamp': row[1],
-                'prev_hash': row[2],
-                'tx_hash': row[3],
-                'algorithm': row[4],
-                'file_name': row[5],
-                'file_hash': row[6],
-                'ciphertext_path': row[7],
-                'nonce_b64': row[8],
-                'tag_b64': row[9],
-                'salt_b64': row[10],
-                'file_size_bytes': row[11],
-                'enc_time_ms': row[12],
-                'dec_time_ms': row[13]
-            }
+            return row_to_block(row)
+        # Everything has been archived; the tip is the last block of the newest segment
+        segments = self._cold_segments(cursor)
+        if segments:
+            return next(self._cold_segment_blocks(segments[-1], segments[-1].end_index, None))
         return None
     
-    def calculate_hash(self, block_data):
-        block_string = json.dumps(block_data, sort_keys=True).encode()
-        return hashlib.sha256(block_string).hexdigest()
+    def _open_segment(self, file_name):
+        # Segment files are immutable, so one mmap per file is shared by every thread
+        with self._segments_lock:
+            segment = self._segments.get(file_name)
+            if segment is None:
+                segment = LedgerSegment(os.path.join(self.archive_dir, file_name))
+                self._segments[file_name] = segment
+            return segment
+    
+    def _cold_segments(self, cursor, since=None):
+        # Archived segments in index order; since skips segments holding nothing newer than it
+        if since is None:
+            cursor.execute('SELECT file_name FROM ledger_segments ORDER BY segment_number')
+        else:
+            cursor.execute('SELECT file_name FROM ledger_segments WHERE last_timestamp > ? ORDER BY segment_number',
+                           (since,))
+        return [self._open_segment(row[0]) for row in cursor.fetchall()]
+    
+    def _cold_segment_blocks(self, segment, start=None, end=None, reverse=False):
+        rows = segment.rows(BLOCK_COLUMNS, start, end, reverse, defaults=SEGMENT_COLUMN_DEFAULTS)
+        return map(row_to_block, rows)
+    
+    def _cold_blocks(self, cursor, start=None, end=None, since=None):
+        # Archived blocks in index order. The catalog is read up front, so cursor is free again on return.
+        segments = self._cold_segments(cursor, since)
+        blocks = chain.from_iterable(self._cold_segment_blocks(segment, start, end) for segment in segments)
+        if since is None:
+            return blocks
+        return (block for block in blocks if block.timestamp > since)
+    
+    def _cold_end(self, cursor):
+        cursor.execute('SELECT MAX(end_index) FROM ledger_segments')
+        end_index = cursor.fetchone()[0]
+        return -1 if end_index is None else end_index
+    
+    def _tx_hashes(self, cursor, start, end):
+        tx_hashes = [row[0] for segment in self._cold_segments(cursor) for row in segment.rows(['tx_hash'], start, end)]
+        cursor.execute('SELECT tx_hash FROM blocks WHERE block_index BETWEEN ? AND ? ORDER BY block_index',
+                       (start, end))
+        return tx_hashes + [row[0] for row in cursor.fetchall()]
+    
+    def calculate_hash(self, block_data, hash_version=HASH_VERSION):
+        return compute_block_hash(block_data, hash_version)
     
     def add_block(self, algorithm, file_name, file_hash, ciphertext_path, 
-                  nonce, tag, salt, file_size_bytes, enc_time_ms, dec_time_ms=None):
-        last_block = self.get_last_block()
+                  nonce, tag, salt, file_size_bytes, enc_time_ms, dec_time_ms=None,
+                  kdf_time_ms=None, cipher_time_ms=None, hash_time_ms=None,
+                  header_time_ms=None, write_time_ms=None, compress_time_ms=None, stored_size_bytes=None):
+        entry = {
+            'algorithm': algorithm,
+            'file_name': file_name,
+            'file_hash': file_hash,
+            'ciphertext_path': ciphertext_path,
+            'nonce': nonce,
+            'tag': tag,
+            'salt': salt,
+            'file_size_bytes': file_size_bytes,
+            'enc_time_ms': enc_time_ms,
+            'dec_time_ms': dec_time_ms,
+            'kdf_time_ms': kdf_time_ms,
+            'cipher_time_ms': cipher_time_ms,
+            'hash_time_ms': hash_time_ms,
+            'header_time_ms': header_time_ms,
+            'write_time_ms': write_time_ms,
+            'compress_time_ms': compress_time_ms,
+            'stored_size_bytes': stored_size_bytes
+        }
+        return self.add_blocks([entry])[0]
+    
+    def add_blocks(self, entries, start_times=None):
+        # Appends entries (dicts of add_block arguments) in order, all in one transaction
+        if start_times is None:
+            start_times = [time.perf_counter()] * len(entries)
         
-        if last_block:
-            index = last_block['index'] + 1
-            prev_hash = last_block['tx_hash']
-        else:
-            index = 0
-            prev_hash = '0' * 64
+        tx_hashes = []
+        with self.transaction() as cursor:
+            last_block = self._get_last_block(cursor)
+            if last_block:
+                index = last_block['index'] + 1
+                prev_hash = last_block['tx_hash']
+            else:
+                index = 0
+                prev_hash = GENESIS_PREV_HASH
+            
+            updates = {}
+            for entry, start_time in zip(entries, start_times):
+                entry = {**BLOCK_ENTRY_DEFAULTS, **entry}
+                prev_hash, ledger_time_ms = self._append_block(cursor, entry, index, prev_hash, start_time)
+                LEDGER_APPEND_SECONDS.observe(ledger_time_ms / 1000)
+                tx_hashes.append(prev_hash)
+                index += 1
+                
+                entry['ledger_time_ms'] = ledger_time_ms
+                for metric, value in block_metric_values(entry):
+                    aggregate = updates.setdefault((entry['algorithm'], metric), new_aggregate())
+                    aggregate_add(aggregate, value)
+            
+            self._merge_aggregates(cursor, updates)
+            if index % MERKLE_BATCH_SIZE < len(entries):
+                self._seal_merkle_batches(cursor)
         
+        return tx_hashes
+    
+    def _append_block(self, cursor, entry, index, prev_hash, start_time):
         timestamp = datetime.utcnow().isoformat()
         
-        nonce_b64 = base64.b64encode(nonce).decode('utf-8')
-        tag_b64 = base64.b64encode(tag).decode('utf-8')
-        salt_b64 = base64.b64encode(salt).decode('utf-8')
+        dec_time_ms = entry['dec_time_ms'] if entry['dec_time_ms'] is not None else 0.0
         
         block_data = {
             'index': index,
             'timestamp': timestamp,
             'prev_hash': prev_hash,
-            'algorithm': algorithm,
-            'file_name': file_name,
-            'file_hash': file_hash,
-            'ciphertext_path': ciphertext_path,
-            'nonce_b64': nonce_b64,
-            'tag_b64': tag_b64,
-            'salt_b64': salt_b64,
-            'file_size_bytes': file_size_bytes,
-            'enc_time_ms': enc_time_ms,
-            'dec_time_ms': dec_time_ms if dec_time_ms is not None else 0.0
+            'algorithm': entry['algorithm'],
+            'file_name': entry['file_name'],
+            'file_hash': entry['file_hash'],
+            'ciphertext_path': entry['ciphertext_path'],
+            'nonce_b64': base64.b64encode(entry['nonce']).decode('utf-8'),
+            'tag_b64': base64.b64encode(entry['tag']).decode('utf-8'),
+            'salt_b64': base64.b64encode(entry['salt']).decode('utf-8'),
+            'file_size_bytes': entry['file_size_bytes'],
+            'enc_time_ms': entry['enc_time_ms'],
+            'dec_time_ms': dec_time_ms
         }
         
         tx_hash = self.calculate_hash(block_data)
         
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('''
-            INSERT INTO blocks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        # ledger_time_ms covers queueing, waiting for the write lock, tip lookup, hashing and the
+        # insert; the commit itself cannot be timed into the row it commits
+        ledger_time_ms = (time.perf_counter() - start_time) * 1000
+        cursor.execute(f'''
+            INSERT INTO blocks ({", ".join(BLOCK_COLUMNS)})
+            VALUES ({", ".join("?" * len(BLOCK_COLUMNS))})
         ''', (
             index, timestamp, prev_hash, tx_hash,
-            algorithm, file_name, file_hash, ciphertext_path,
-            nonce_b64, tag_b64, salt_b64, file_size_bytes,
-            enc_time_ms, dec_time_ms if dec_time_ms is not None else 0.0
+            block_data['algorithm'], block_data['file_name'], block_data['file_hash'],
+            block_data['ciphertext_path'], block_data['nonce_b64'], block_data['tag_b64'],
+            block_data['salt_b64'], block_data['file_size_bytes'], block_data['enc_time_ms'],
+            dec_time_ms, entry['kdf_time_ms'], entry['cipher_time_ms'], entry['hash_time_ms'],
+            entry['header_time_ms'], entry['write_time_ms'], ledger_time_ms, entry['compress_time_ms'],
+            HASH_VERSION, entry['stored_size_bytes']
         ))
-        conn.commit()
-        conn.close()
         
-        return tx_hash
+        return tx_hash, ledger_time_ms
     
     def update_block_dec_time(self, file_hash, dec_time_ms):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        # Only hot blocks are updated; archived segments are immutable
+        with self.transaction() as cursor:
+            cursor.execute('''
+                SELECT block_index, algorithm, timestamp FROM blocks
+                WHERE file_hash = ? AND dec_time_ms = 0.0
+            ''', (file_hash,))
+            self._record_dec_time(cursor, cursor.fetchall(), dec_time_ms)
+    
+    def update_block_dec_time_by_index(self, block_index, dec_time_ms):
+        # Targets exactly one block by primary key; like update_block_dec_time, only the first decrypt is kept
+        with self.transaction() as cursor:
+            cursor.execute('''
+                SELECT block_index, algorithm, timestamp FROM blocks
+                WHERE block_index = ? AND dec_time_ms = 0.0
+            ''', (block_index,))
+            self._record_dec_time(cursor, cursor.fetchall(), dec_time_ms)
+    
+    def update_block_dec_time_by_tx_hash(self, tx_hash, dec_time_ms):
+        # Same as update_block_dec_time_by_index, for callers that only hold the block's tx_hash.
+        # Returns whether a block was updated.
+        with self.transaction() as cursor:
+            cursor.execute('''
+                SELECT block_index, algorithm, timestamp FROM blocks
+                WHERE tx_hash = ? AND dec_time_ms = 0.0
+            ''', (tx_hash,))
+            rows = cursor.fetchall()
+            self._record_dec_time(cursor, rows, dec_time_ms)
+        return bool(rows)
+    
+    def _record_dec_time(self, cursor, rows, dec_time_ms):
+        if not rows:
+            return
+        
+        cursor.executemany('UPDATE blocks SET dec_time_ms = ? WHERE block_index = ?',
+                           [(dec_time_ms, row[0]) for row in rows])
+        
+        # Blocks sealed before the last benchmark clear belong to an earlier epoch
+        clear_timestamp = self._get_benchmark_state(cursor, 'last_cleared_at')
+        updates = {}
+        for _, algorithm, timestamp in rows:
+            if clear_timestamp is None or timestamp > clear_timestamp:
+                aggregate_add(updates.setdefault((algorithm, 'dec_time_ms'), new_aggregate()), dec_time_ms)
+        self._merge_aggregates(cursor, updates)
+    
+    def get_block(self, tx_hash=None, file_hash=None):
+        # Looks a block up by tx_hash, or the newest block for a file_hash; None if there is none
+        if tx_hash is not None:
+            condition, param = 'tx_hash = ?', tx_hash
+        elif file_hash is not None:
+            condition, param = 'file_hash = ?', file_hash
+        else:
+            raise ValueError("tx_hash or file_hash is required")
+        
+        with self.snapshot() as cursor:
+            return self._get_block(cursor, condition, param)
+    
+    def _get_block(self, cursor, condition, param):
+        cursor.execute(f'''
+            SELECT {", ".join(BLOCK_COLUMNS)} FROM blocks
+            WHERE {condition} ORDER BY block_index DESC LIMIT 1
+        ''', (param,))
+        row = cursor.fetchone()
+        if row:
+            return row_to_block(row)
+        
+        # Not hot: look it up in the segment indexes, newest segment first
+        column = condition.split()[0]
+        for segment in reversed(self._cold_segments(cursor)):
+            indexes = segment.find(column, param)
+            rows = segment.rows_at(indexes, BLOCK_COLUMNS, SEGMENT_COLUMN_DEFAULTS)
+            for block in reversed(list(map(row_to_block, rows))):
+                if block[column] == param:
+                    return block
+        return None
+    
+    def _seal_merkle_batches(self, cursor):
+        # Seals every full batch after the last sealed one; the trailing partial batch stays open
+        cursor.execute('SELECT batch_number, batch_hash FROM merkle_batches ORDER BY batch_number DESC LIMIT 1')
+        row = cursor.fetchone()
+        batch_number, prev_batch_hash = (row[0] + 1, row[1]) if row else (0, GENESIS_BATCH_HASH)
+        
+        cursor.execute('SELECT MAX(block_index) FROM blocks')
+        last_index = cursor.fetchone()[0]
+        if last_index is None:
+            return
+        
+        while (batch_number + 1) * MERKLE_BATCH_SIZE - 1 <= last_index:
+            start_index = batch_number * MERKLE_BATCH_SIZE
+            end_index = start_index + MERKLE_BATCH_SIZE - 1
+            cursor.execute('SELECT tx_hash FROM blocks WHERE block_index BETWEEN ? AND ? ORDER BY block_index',
+                           (start_index, end_index))
+            root = merkle_root([r[0] for r in cursor.fetchall()])
+            batch_hash = compute_batch_hash(batch_number, start_index, end_index, root, prev_batch_hash)
+            cursor.execute('''
+                INSERT INTO merkle_batches
+                (batch_number, start_index, end_index, merkle_root, prev_batch_hash, batch_hash, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (batch_number, start_index, end_index, root, prev_batch_hash, batch_hash,
+                  datetime.utcnow().isoformat()))
+            batch_number += 1
+            prev_batch_hash = batch_hash
+    
+    def get_merkle_batch(self, batch_number):
+        cursor = self.connection().cursor()
         cursor.execute('''
-            UPDATE blocks SET dec_time_ms = ? WHERE file_hash = ? AND dec_time_ms = 0.0
-        ''', (dec_time_ms, file_hash))
-        conn.commit()
-        conn.close()
+            SELECT batch_number, start_index, end_index, merkle_root, prev_batch_hash, batch_hash, created_at
+            FROM merkle_batches WHERE batch_number = ?
+        ''', (batch_number,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return {
+            'batch_number': row[0],
+            'start_index': row[1],
+            'end_index': row[2],
+            'merkle_root': row[3],
+            'prev_batch_hash': row[4],
+            'batch_hash': row[5],
+            'created_at': row[6],
+            'sealed': True
+        }
+    
+    def get_inclusion_proof(self, tx_hash):
+        # Audit path from the block's tx_hash to its batch root, plus the batch header that chains the
+        # root to the previous batch. Blocks in the open batch get a path to a provisional root.
+        with self.snapshot() as cursor:
+            block = self._get_block(cursor, 'tx_hash = ?', tx_hash)
+            if block is None:
+                return None
+            
+            batch_number = block['index'] // MERKLE_BATCH_SIZE
+            batch = self.get_merkle_batch(batch_number)
+            start_index = batch_number * MERKLE_BATCH_SIZE
+            end_index = batch['end_index'] if batch else start_index + MERKLE_BATCH_SIZE - 1
+            tx_hashes = self._tx_hashes(cursor, start_index, end_index)
+        
+        if batch is None:
+            batch = {
+                'batch_number': batch_number,
+                'start_index': start_index,
+                'end_index': start_index + len(tx_hashes) - 1,
+                'merkle_root': merkle_root(tx_hashes),
+                'sealed': False
+            }
+        
+        return {
+            'tx_hash': tx_hash,
+            'block_index': block['index'],
+            'block': block.to_dict(),
+            'path': merkle_path(tx_hashes, block['index'] - start_index),
+            'batch': batch
+        }
     
     def get_all_blocks(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT * FROM blocks ORDER BY block_index ASC')
-        rows = cursor.fetchall()
-        conn.close()
+        with self.snapshot() as cursor:
+            blocks = list(self._cold_blocks(cursor))
+            cursor.execute(f'SELECT {", ".join(BLOCK_COLUMNS)} FROM blocks ORDER BY block_index ASC')
+            return blocks + [row_to_block(row) for row in cursor.fetchall()]
+    
+    def get_blocks_page(self, limit=DEFAULT_PAGE_SIZE, cursor=None, order='desc', algorithm=None,
+                        file_name=None, file_hash=None, tx_hash=None, block_hash=None,
+                        since=None, until=None, min_size=None, max_size=None):
+        # Keyset pagination: cursor is the block_index of the last block on the previous page.
+        # file_name matches by prefix; block_hash matches either tx_hash or file_hash.
+        # Returns (blocks, next_cursor), next_cursor being None on the last page.
+        if order not in ('asc', 'desc'):
+            raise ValueError(f"Invalid order: {order}")
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
         
-        blocks = []
-        for row in rows:
-            blocks.append({
-                'index': row[0],
-                'timestamp': row[1],
-                'prev_hash': row[2],
-                'tx_hash': row[3],
-                'algorithm': row[4],
-                'file_name': row[5],
-                'file_hash': row[6],
-                'ciphertext_path': row[7],
-                'nonce_b64': row[8],
-                'tag_b64': row[9],
-                'salt_b64': row[10],
-                'file_size_bytes': row[11],
-                'enc_time_ms': row[12],
-                'dec_time_ms': row[13]
-            })
-        return blocks
-    
-    def verify_chain(self):
-        blocks = self.get_all_blocks()
-        
-        if not blocks:
-            return True, "Blockchain is empty"
+        conditions = []
+        params = []
+        if cursor is not None:
+            conditions.append('block_index < ?' if order == 'desc' else 'block_index > ?')
+            params.append(int(cursor))
+        if algorithm:
+            conditions.append('algorithm = ?')
+            params.append(algorithm)
+        if file_name:
+            # A range on the indexed column instead of LIKE, which cannot use the index
+            conditions.append('file_name >= ? AND file_name < ?')
+            params.extend([file_name, file_name + '\U0010ffff'])
+        if file_hash:
+            conditions.append('file_hash = ?')
+            params.append(file_hash)
+        if tx_hash:
+            conditions.append('tx_hash = ?')
+            params.append(tx_hash)
+        if block_hash:
+            conditions.append('(tx_hash = ? OR file_hash = ?)')
+            params.extend([block_hash, block_hash])
+        if since:
+            conditions.append('timestamp >= ?')
+            params.append(since)
+        if until:
+            conditions.append('timestamp <= ?')
+            params.append(until)
+        if min_size is not None:
+            conditions.append('file_size_bytes >= ?')
+            params.append(int(min_size))
+        if max_size is not None:
+            conditions.append('file_size_bytes <= ?')
+            params.append(int(max_size))
+        
+        where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
         
-        for i, block in enumerate(blocks):
-            if i == 0:
-                if block['prev_hash'] != '0' * 64:
-                    return False, f"Genesis block has invalid prev_hash"
+        # Archived blocks come before every hot block, so ascending pages read the cold tier first and
+        # descending pages fall through to it once the hot table is exhausted
+        matches = block_filter(algorithm, file_name, file_hash, tx_hash, block_hash, since, until, min_size, max_size)
+        with self.snapshot() as db_cursor:
+            cold_end = self._cold_end(db_cursor)
+            blocks = []
+            if order == 'asc' and cold_end >= 0 and (cursor is None or int(cursor) < cold_end):
+                after = None if cursor is None else int(cursor)
+                blocks = self._scan_cold(db_cursor, matches, limit + 1, after=after,
+                                         lookup=self._cold_lookup(file_hash, tx_hash, block_hash))
+            if len(blocks) <= limit:
+                db_cursor.execute(f'''
+                    SELECT {", ".join(BLOCK_COLUMNS)} FROM blocks {where}
+                    ORDER BY block_index {order.upper()} LIMIT ?
+                ''', params + [limit + 1 - len(blocks)])
+                blocks += [row_to_block(row) for row in db_cursor.fetchall()]
+            if order == 'desc' and len(blocks) <= limit and cold_end >= 0:
+                before = None if cursor is None else int(cursor)
+                blocks += self._scan_cold(db_cursor, matches, limit + 1 - len(blocks), before=before, reverse=True,
+                                          lookup=self._cold_lookup(file_hash, tx_hash, block_hash))
+        
+        next_cursor = blocks[limit - 1]['index'] if len(blocks) > limit else None
+        return blocks[:limit], next_cursor
+    
+    def _cold_lookup(self, file_hash, tx_hash, block_hash):
+        # Hash filters narrow a cold scan to the segment index candidates
+        if tx_hash:
+            return [('tx_hash', tx_hash)]
+        if file_hash:
+            return [('file_hash', file_hash)]
+        if block_hash:
+            return [('tx_hash', block_hash), ('file_hash', block_hash)]
+        return None
+    
+    def _scan_cold(self, cursor, matches, limit, after=None, before=None, reverse=False, lookup=None):
+        # Up to limit archived blocks accepted by matches, strictly between after and before
+        start = None if after is None else after + 1
+        end = None if before is None else before - 1
+        segments = self._cold_segments(cursor)
+        if reverse:
+            segments.reverse()
+        
+        found = []
+        for segment in segments:
+            if lookup is None:
+                blocks = self._cold_segment_blocks(segment, start, end, reverse)
             else:
-                if block['prev_hash'] != blocks[i-1]['tx_hash']:
-                    return False, f"Block {i} has broken chain link"
+                indexes = {i for column, value in lookup for i in segment.find(column, value)
+                           if (start is None or i >= start) and (end is None or i <= end)}
+                blocks = list(map(row_to_block, segment.rows_at(indexes, BLOCK_COLUMNS, SEGMENT_COLUMN_DEFAULTS)))
+                if reverse:
+                    blocks.reverse()
+            for block in blocks:
+                if matches(block):
+                    found.append(block)
+                    if len(found) >= limit:
+                        return found
+        return found
+    
+    def verify_chain(self, full=False):
+        with LEDGER_VERIFY_SECONDS.time(mode='full' if full else 'incremental'):
+            return self._verify_chain(full)
+    
+    def _verify_chain(self, full):
+        # Routine verification only checks blocks appended after the last verified checkpoint;
+        # full=True (or a checkpoint that no longer matches) re-verifies from genesis
+        checkpoint = None if full else self.get_verification_checkpoint()
+        
+        with self.snapshot() as cursor:
+            start_index, prev_hash = 0, GENESIS_PREV_HASH
+            if checkpoint:
+                if self._tx_hashes(cursor, checkpoint[0], checkpoint[0]) != [checkpoint[1]]:
+                    return False, f"Block {checkpoint[0]} no longer matches the verification checkpoint"
+                start_index, prev_hash = checkpoint[0] + 1, checkpoint[1]
             
-            block_data = {
-                'index': block['index'],
-                'timestamp': block['timestamp'],
-                'prev_hash': block['prev_hash'],
-                'algorithm': block['algorithm'],
-                'file_name': block['file_name'],
-                'file_hash': block['file_hash'],
-                'ciphertext_path': block['ciphertext_path'],
-                'nonce_b64': block['nonce_b64'],
-                'tag_b64': block['tag_b64'],
-                'salt_b64': block['salt_b64'],
-                'file_size_bytes': block['file_size_bytes'],
-                'enc_time_ms': block['enc_time_ms'],
-                'dec_time_ms': block['dec_time_ms']
-            }
+            cold_blocks = self._cold_blocks(cursor, start=start_index)
+            cursor.execute(f'''
+                SELECT {", ".join(BLOCK_COLUMNS)} FROM blocks
+                WHERE block_index >= ? ORDER BY block_index ASC
+            ''', (start_index,))
+            count, last_tx_hash, error = check_blocks(
+                chain(cold_blocks, (row_to_block(row) for row in cursor)), start_index, prev_hash
+            )
+        if error:
+            return False, error[1]
+        
+        if count == 0 and start_index == 0:
+            return True, "Blockchain is empty"
+        
+        last_index = start_index + count - 1
+        if count:
+            self.set_verification_checkpoint(last_index, last_tx_hash)
+        if checkpoint:
+            return True, f"Blockchain is valid ({count} new blocks verified, {last_index + 1} total)"
+        return True, f"Blockchain is valid ({count} blocks verified)"
+    
+    def audit_chain(self, workers=None, range_size=VERIFY_RANGE_SIZE, progress=None):
+        with LEDGER_VERIFY_SECONDS.time(mode='audit'):
+            return self._audit_chain(workers, range_size, progress)
+    
+    def _audit_chain(self, workers, range_size, progress):
+        # Full audit: each archived segment and each hot range is verified in a process pool, then
+        # their boundaries are stitched together. Returns (is_valid, message, first_bad_index).
+        with self.snapshot() as cursor:
+            last_block = self._get_last_block(cursor)
+            cursor.execute('''
+                SELECT start_index, end_index, file_name, file_sha256, head_hash
+                FROM ledger_segments ORDER BY segment_number
+            ''')
+            segments = cursor.fetchall()
+        if last_block is None:
+            return True, "Blockchain is empty", None
+        
+        total = last_block['index'] + 1
+        hot_start = segments[-1][1] + 1 if segments else 0
+        tasks = [(verify_segment, os.path.join(self.archive_dir, file_name), start, end, sha256, head_hash)
+                 for start, end, file_name, sha256, head_hash in segments]
+        tasks += [(verify_block_range, self.db_path, start, min(start + range_size, total) - 1)
+                  for start in range(hot_start, total, range_size)]
+        ranges = [(task[2], task[3]) for task in tasks]
+        results = {}
+        done = 0
+        
+        # forkserver, not fork: the caller is usually a multithreaded server, and a forked child could
+        # inherit a lock some other thread was holding
+        context = multiprocessing.get_context('forkserver')
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            futures = [executor.submit(*task) for task in tasks]
+            for future in as_completed(futures):
+                result = future.result()
+                results[result['start']] = result
+                done += result['end'] - result['start'] + 1
+                if progress:
+                    progress(done, total)
+        
+        first_error = None
+        prev_hash = GENESIS_PREV_HASH
+        for start, _ in ranges:
+            result = results[start]
+            if result['error'] and result['error'][0] == start:
+                first_error = result['error']
+            elif result['first_prev_hash'] != prev_hash:
+                if start == 0:
+                    first_error = (0, "Genesis block has invalid prev_hash")
+                else:
+                    first_error = (start, f"Block {start} has broken chain link")
+            else:
+                first_error = result['error']
+            if first_error:
+                break
+            prev_hash = result['last_tx_hash']
+        
+        if first_error:
+            return False, first_error[1], first_error[0]
+        
+        is_valid, message, first_bad_index = self.verify_merkle_batches()
+        if not is_valid:
+            return False, message, first_bad_index
+        
+        self.set_verification_checkpoint(total - 1, prev_hash)
+        return True, f"Blockchain is valid ({total} blocks verified)", None
+    
+    def verify_merkle_batches(self):
+        # Recomputes every sealed batch root and checks the batch hash chain.
+        # Returns (is_valid, message, first_bad_index), the index being the batch's first block.
+        with self.snapshot() as cursor:
+            cursor.execute('''
+                SELECT batch_number, start_index, end_index, merkle_root, prev_batch_hash, batch_hash
+                FROM merkle_batches ORDER BY batch_number
+            ''')
+            batches = cursor.fetchall()
             
-            calculated_hash = self.calculate_hash(block_data)
-            if calculated_hash != block['tx_hash']:
-                return False, f"Block {i} has invalid transaction hash"
+            prev_batch_hash = GENESIS_BATCH_HASH
+            for expected_number, batch in enumerate(batches):
+                batch_number, start_index, end_index, root, batch_prev, batch_hash = batch
+                if batch_number != expected_number or start_index != batch_number * MERKLE_BATCH_SIZE:
+                    return False, f"Merkle batch {expected_number} is missing", expected_number * MERKLE_BATCH_SIZE
+                if batch_prev != prev_batch_hash:
+                    return False, f"Merkle batch {batch_number} has broken chain link", start_index
+                tx_hashes = self._tx_hashes(cursor, start_index, end_index)
+                if (len(tx_hashes) != end_index - start_index + 1 or merkle_root(tx_hashes) != root or
+                        compute_batch_hash(batch_number, start_index, end_index, root, batch_prev) != batch_hash):
+                    return False, f"Merkle batch {batch_number} does not match its blocks", start_index
+                prev_batch_hash = batch_hash
         
-        return True, f"Blockchain is valid ({len(blocks)} blocks verified)"
+        return True, f"{len(batches)} Merkle batches verified", None
     
-    def get_benchmark_clear_timestamp(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute('SELECT value FROM benchmark_state WHERE key = ?', ('last_cleared_at',))
+    def archive_blocks(self, keep=None):
+        # Moves the oldest hot blocks into segment files of segment_blocks blocks while more than keep
+        # (default hot_blocks) newer blocks remain. Only whole, sealed Merkle batches are archived, and
+        # each range is re-verified before it is frozen. Returns the number of segments written.
+        keep = self.hot_blocks if keep is None else keep
+        if keep is None or keep < 0:
+            raise ValueError("archive_blocks needs a non-negative number of blocks to keep")
+        
+        written = 0
+        with self._archive_lock:
+            # Cheap read-only check first, so the common case never takes the write lock
+            while self._next_archive_range(self.connection().cursor(), keep):
+                with self.transaction() as cursor:
+                    archive_range = self._next_archive_range(cursor, keep)
+                    if archive_range is None:
+                        break
+                    self._archive_range(cursor, *archive_range)
+                written += 1
+        return written
+    
+    def _next_archive_range(self, cursor, keep):
+        cursor.execute('SELECT MIN(block_index), MAX(block_index) FROM blocks')
+        hot_start, last_index = cursor.fetchone()
+        if hot_start is None:
+            return None
+        end_index = hot_start + self.segment_blocks - 1
+        cursor.execute('SELECT MAX(end_index) FROM merkle_batches')
+        sealed_end = cursor.fetchone()[0]
+        if end_index > last_index - keep or sealed_end is None or end_index > sealed_end:
+            return None
+        return hot_start, end_index
+    
+    def _archive_range(self, cursor, start_index, end_index):
+        cursor.execute('SELECT segment_number, head_hash FROM ledger_segments ORDER BY segment_number DESC LIMIT 1')
+        row = cursor.fetchone()
+        segment_number, prev_hash = (row[0] + 1, row[1]) if row else (0, GENESIS_PREV_HASH)
+        
+        cursor.execute(f'''
+            SELECT {", ".join(BLOCK_COLUMNS)} FROM blocks
+            WHERE block_index BETWEEN ? AND ? ORDER BY block_index ASC
+        ''', (start_index, end_index))
+        rows = cursor.fetchall()
+        count, _, error = check_blocks(map(row_to_block, rows), start_index, prev_hash)
+        if error is None and count != end_index - start_index + 1:
+            error = (start_index + count, f"Block {start_index + count} is missing")
+        if error:
+            raise ValueError(f"Refusing to archive blocks {start_index}-{end_index}: {error[1]}")
+        
+        os.makedirs(self.archive_dir, exist_ok=True)
+        file_name = f"segment-{segment_number:06d}.lseg"
+        path = os.path.join(self.archive_dir, file_name)
+        sha256 = write_segment(path, rows, BLOCK_COLUMNS, prev_hash)
+        
+        timestamp_column = BLOCK_COLUMNS.index('timestamp')
+        cursor.execute('''
+            INSERT INTO ledger_segments
+            (segment_number, start_index, end_index, first_prev_hash, head_hash, first_timestamp,
+             last_timestamp, file_name, file_sha256, size_bytes, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (segment_number, start_index, end_index, prev_hash, rows[-1][BLOCK_COLUMNS.index('tx_hash')],
+              rows[0][timestamp_column], max(row[timestamp_column] for row in rows), file_name, sha256,
+              os.path.getsize(path), datetime.utcnow().isoformat()))
+        cursor.execute('DELETE FROM blocks WHERE block_index BETWEEN ? AND ?', (start_index, end_index))
+    
+    def get_segments(self):
+        cursor = self.connection().cursor()
+        cursor.execute('''
+            SELECT segment_number, start_index, end_index, head_hash, file_name, size_bytes, created_at
+            FROM ledger_segments ORDER BY segment_number
+        ''')
+        return [{
+            'segment_number': row[0],
+            'start_index': row[1],
+            'end_index': row[2],
+            'head_hash': row[3],
+            'file_name': row[4],
+            'size_bytes': row[5],
+            'created_at': row[6]
+        } for row in cursor.fetchall()]
+    
+    def get_verification_checkpoint(self):
+        cursor = self.connection().cursor()
+        cursor.execute('''
+            SELECT key, value FROM ledger_state WHERE key IN ('verified_index', 'verified_hash')
+        ''')
+        state = dict(cursor.fetchall())
+        if 'verified_index' not in state or 'verified_hash' not in state:
+            return None
+        return int(state['verified_index']), state['verified_hash']
+    
+    def set_verification_checkpoint(self, index, tx_hash):
+        with self.transaction() as cursor:
+            cursor.executemany('''
+                INSERT OR REPLACE INTO ledger_state (key, value) VALUES (?, ?)
+            ''', [('verified_index', str(index)), ('verified_hash', tx_hash)])
+    
+    def _get_benchmark_state(self, cursor, key):
+        cursor.execute('SELECT value FROM benchmark_state WHERE key = ?', (key,))
         row = cursor.fetchone()
-        conn.close()
         return row[0] if row else None
     
-    def set_benchmark_clear_timestamp(self, timestamp):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+    def _set_benchmark_state(self, cursor, key, value):
         cursor.execute('''
             INSERT OR REPLACE INTO benchmark_state (key, value)
             VALUES (?, ?)
-        ''', ('last_cleared_at', timestamp))
-        conn.commit()
-        conn.close()
+        ''', (key, value))
+    
+    def _get_benchmark_epoch(self, cursor):
+        return int(self._get_benchmark_state(cursor, 'epoch') or 0)
+    
+    def get_benchmark_clear_timestamp(self):
+        return self._get_benchmark_state(self.connection().cursor(), 'last_cleared_at')
+    
+    def get_benchmark_epoch(self):
+        return self._get_benchmark_epoch(self.connection().cursor())
+    
+    def get_benchmark_version(self):
+        # Cheap token that changes whenever the benchmark data does: on an append (head index), a
+        # clear (epoch) or a recorded decrypt time. Reads no sketch, so it suits cache revalidation.
+        with self.snapshot() as cursor:
+            epoch = self._get_benchmark_epoch(cursor)
+            cursor.execute('SELECT MAX(block_index) FROM blocks')
+            head_index = cursor.fetchone()[0]
+            if head_index is None:
+                head_index = self._cold_end(cursor)
+            cursor.execute('''
+                SELECT COALESCE(SUM(count), 0) FROM benchmark_aggregates WHERE epoch = ? AND metric = ?
+            ''', (epoch, 'dec_time_ms'))
+            return head_index, epoch, cursor.fetchone()[0]
+    
+    def set_benchmark_clear_timestamp(self, timestamp):
+        # Clearing the benchmark starts a new aggregate epoch; earlier epochs are left untouched
+        with self.transaction() as cursor:
+            self._set_benchmark_state(cursor, 'last_cleared_at', timestamp)
+            self._set_benchmark_state(cursor, 'epoch', str(self._get_benchmark_epoch(cursor) + 1))
     
     def get_blocks_for_benchmark(self):
-        clear_timestamp = self.get_benchmark_clear_timestamp()
-        blocks = self.get_all_blocks()
+        with self.snapshot() as cursor:
+            clear_timestamp = self._get_benchmark_state(cursor, 'last_cleared_at') or ''
+            blocks = list(self._cold_blocks(cursor, since=clear_timestamp))
+            cursor.execute(f'''
+                SELECT {", ".join(BLOCK_COLUMNS)} FROM blocks
+                WHERE timestamp > ? ORDER BY block_index ASC
+            ''', (clear_timestamp,))
+            return blocks + [row_to_block(row) for row in cursor.fetchall()]
+    
+    def get_benchmark_columns(self, columns):
+        # One tuple per requested column over the current epoch's blocks, archived blocks first;
+        # a single SELECT of just those columns keeps large ledgers cheap to analyse
+        with self.snapshot() as cursor:
+            clear_timestamp = self._get_benchmark_state(cursor, 'last_cleared_at') or ''
+            rows = [tuple(block[column] for column in columns)
+                    for block in self._cold_blocks(cursor, since=clear_timestamp)]
+            cursor.execute(f'''
+                SELECT {", ".join(columns)} FROM blocks
+                WHERE timestamp > ? ORDER BY block_index ASC
+            ''', (clear_timestamp,))
+            rows.extend(cursor.fetchall())
+        if not rows:
+            return [() for _ in columns]
+        return list(zip(*rows))
+    
+    def get_cipher_samples(self, limit):
+        # (algorithm, file_size_bytes, cipher bytes, cipher_time_ms) for the newest hot blocks with a
+        # cipher phase timing; compressed files were enciphered at their stored size
+        cursor = self.connection().cursor()
+        cursor.execute('''
+            SELECT algorithm, file_size_bytes, COALESCE(stored_size_bytes, file_size_bytes), cipher_time_ms
+            FROM blocks WHERE cipher_time_ms > 0 ORDER BY block_index DESC LIMIT ?
+        ''', (limit,))
+        return cursor.fetchall()
+    
+    def get_benchmark_aggregates(self):
+        # {algorithm: {metric: aggregate}} for the current epoch, independent of ledger size
+        with self.snapshot() as cursor:
+            epoch = self._get_benchmark_epoch(cursor)
+            cursor.execute('''
+                SELECT algorithm, metric, count, total, total_sq, min_value, max_value
+                FROM benchmark_aggregates WHERE epoch = ?
+            ''', (epoch,))
+            aggregates = {}
+            for algorithm, metric, count, total, total_sq, min_value, max_value in cursor.fetchall():
+                aggregates.setdefault(algorithm, {})[metric] = {
+                    'count': count,
+                    'sum': total,
+                    'sum_sq': total_sq,
+                    'min': min_value,
+                    'max': max_value,
+                    'histogram': {}
+                }
+            
+            cursor.execute('SELECT algorithm, metric, bucket, count FROM benchmark_sketch WHERE epoch = ?', (epoch,))
+            for algorithm, metric, bucket, count in cursor.fetchall():
+                aggregates[algorithm][metric]['histogram'][bucket] = count
+        return aggregates
+    
+    def rebuild_benchmark_aggregates(self):
+        with self.transaction() as cursor:
+            self._rebuild_benchmark_aggregates(cursor)
+    
+    def _rebuild_benchmark_aggregates(self, cursor):
+        # One pass over the current epoch's blocks; only needed for ledgers that predate aggregates
+        epoch = self._get_benchmark_epoch(cursor)
+        clear_timestamp = self._get_benchmark_state(cursor, 'last_cleared_at')
+        cursor.execute('DELETE FROM benchmark_aggregates WHERE epoch = ?', (epoch,))
+        cursor.execute('DELETE FROM benchmark_sketch WHERE epoch = ?', (epoch,))
+        cold_blocks = self._cold_blocks(cursor, since=clear_timestamp or '')
+        cursor.execute(f'''
+            SELECT {", ".join(BLOCK_COLUMNS)} FROM blocks WHERE timestamp > ?
+        ''', (clear_timestamp or '',))
         
-        if clear_timestamp:
-            blocks = [b for b in blocks if b['timestamp'] > clear_timestamp]
+        updates = {}
+        for block in chain(cold_blocks, map(row_to_block, cursor.fetchall())):
+            for metric, value in block_metric_values(block):
+                aggregate_add(updates.setdefault((block['algorithm'], metric), new_aggregate()), value)
         
-        return blocks
+        self._merge_aggregates(cursor, updates)
+        self._set_benchmark_state(cursor, 'aggregates_version', AGGREGATES_VERSION)
+    
+    def _merge_aggregates(self, cursor, updates):
+        # Adds to the stored aggregates in place: one upsert per (algorithm, metric) and one per touched
+        # sketch bucket, so an append costs the same however many buckets the sketch already has
+        epoch = self._get_benchmark_epoch(cursor)
+        cursor.executemany('''
+            INSERT INTO benchmark_aggregates
+            (epoch, algorithm, metric, count, total, total_sq, min_value, max_value)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (epoch, algorithm, metric) DO UPDATE SET
+                count = count + excluded.count,
+                total = total + excluded.total,
+                total_sq = total_sq + excluded.total_sq,
+                min_value = MIN(COALESCE(min_value, excluded.min_value), excluded.min_value),
+                max_value = MAX(COALESCE(max_value, excluded.max_value), excluded.max_value)
+        ''', [
+            (epoch, algorithm, metric, update['count'], update['sum'], update['sum_sq'], update['min'], update['max'])
+            for (algorithm, metric), update in updates.items()
+        ])
+        cursor.executemany('''
+            INSERT INTO benchmark_sketch (epoch, algorithm, metric, bucket, count)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (epoch, algorithm, metric, bucket) DO UPDATE SET count = count + excluded.count
+        ''', [
+            (epoch, algorithm, metric, bucket, count)
+            for (algorithm, metric), update in updates.items()
+            for bucket, count in update['histogram'].items()
+        ])
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    
+    parser = argparse.ArgumentParser(description='Verify the blockchain ledger')
+    parser.add_argument('--db', default='ledger.db')
+    parser.add_argument('--full', action='store_true', help='audit every block in a process pool')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--range-size', type=int, default=VERIFY_RANGE_SIZE)
+    parser.add_argument('--archive', action='store_true', help='move old blocks into segment files first')
+    parser.add_argument('--keep', type=int, default=100000, help='recent blocks to leave in the database')
+    parser.add_argument('--segment-blocks', type=int, default=DEFAULT_SEGMENT_BLOCKS)
+    parser.add_argument('--archive-dir', default=None)
+    parser.add_argument('--vacuum', action='store_true', help='shrink the database file after archiving')
+    args = parser.parse_args()
+    
+    blockchain = Blockchain(args.db, archive_dir=args.archive_dir, segment_blocks=args.segment_blocks)
+    if args.archive:
+        written = blockchain.archive_blocks(args.keep)
+        print(f"Archived {written} segment(s) of {args.segment_blocks} blocks", file=sys.stderr)
+        if args.vacuum:
+            blockchain.connection().execute('VACUUM')
+    if args.full:
+        def report(done, total):
+            print(f"\rVerified {done}/{total} blocks", end='', file=sys.stderr, flush=True)
+        is_valid, message, first_bad = blockchain.audit_chain(args.workers, args.range_size, report)
+        print(file=sys.stderr)
+    else:
+        is_valid, message = blockchain.verify_chain()
+    print(message)
+    sys.exit(0 if is_valid else 1)
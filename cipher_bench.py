@@ -0,0 +1,296 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import Crypto
+
+from crypto_utils import (ALGORITHM_IDS, DEFAULT_KDF_TARGET_MS, KDF_PARAMS, calibrate_kdf, clear_key_cache,
+                          decrypt_stream, derive_key, encrypt_stream)
+
+DEFAULT_SIZES = ['1K', '16K', '256K', '4M', '64M', '1G']
+DEFAULT_REPEAT = 5
+DEFAULT_WARMUP = 1
+DEFAULT_THRESHOLD = 0.10
+PAYLOAD_BLOCK_SIZE = 1024 * 1024
+BENCH_PASSPHRASE = 'cipher-bench-passphrase'
+
+SIZE_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+def parse_size(text):
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in SIZE_UNITS:
+        return int(float(text[:-1]) * SIZE_UNITS[text[-1]])
+    return int(text)
+
+def format_size(size):
+    for unit in ('G', 'M', 'K'):
+        if size >= SIZE_UNITS[unit] and size % SIZE_UNITS[unit] == 0:
+            return f'{size // SIZE_UNITS[unit]}{unit}'
+    return str(size)
+
+def payload_chunks(size, block):
+    # Cipher cost does not depend on content, so one random block is repeated instead of
+    # materializing the whole payload
+    remaining = size
+    while remaining > 0:
+        chunk = block if remaining >= len(block) else block[:remaining]
+        remaining -= len(chunk)
+        yield chunk
+
+class NullSink:
+    def write(self, data):
+        return len(data)
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    position = q * (len(ordered) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+def summarize(samples_ms, size=None):
+    summary = {
+        'samples': len(samples_ms),
+        'mean_ms': statistics.mean(samples_ms),
+        'p50_ms': percentile(samples_ms, 0.50),
+        'p95_ms': percentile(samples_ms, 0.95),
+        'p99_ms': percentile(samples_ms, 0.99),
+        'min_ms': min(samples_ms),
+        'max_ms': max(samples_ms)
+    }
+    if size is not None:
+        median_s = summary['p50_ms'] / 1000
+        summary['mb_per_s'] = size / (1024 * 1024) / median_s if median_s > 0 else None
+    return summary
+
+def measure_peak_memory(operation):
+    # Run once more under tracemalloc; kept out of the timed repetitions because tracing slows allocation
+    tracemalloc.start()
+    try:
+        operation()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak
+
+def bench_kdf(repeat, warmup):
+    salt = os.urandom(16)
+    for _ in range(warmup):
+        derive_key(BENCH_PASSPHRASE, salt)
+    
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        derive_key(BENCH_PASSPHRASE, salt)
+        samples.append((time.perf_counter() - start) * 1000)
+    
+    result = {'algorithm': 'PBKDF2-SHA256', 'op': 'kdf', 'size': 0}
+    result.update(summarize(samples))
+    result['peak_memory_bytes'] = measure_peak_memory(lambda: derive_key(BENCH_PASSPHRASE, salt))
+    return result
+
+def bench_cipher(algorithm, size, repeat, warmup, block, tmpdir=None, workers=1):
+    # Session key mode with a warm key cache keeps PBKDF2 out of the encrypt and decrypt numbers;
+    # what remains is the HKDF subkey, the cipher, hashing and container framing
+    with tempfile.TemporaryFile(dir=tmpdir) as ciphertext:
+        def encrypt_once():
+            ciphertext.seek(0)
+            ciphertext.truncate()
+            result = encrypt_stream(payload_chunks(size, block), ciphertext, BENCH_PASSPHRASE,
+                                    algorithm, key_mode='session', workers=workers)
+            return result[6]['cipher']
+        
+        def decrypt_once():
+            ciphertext.seek(0)
+            decrypt_stream(ciphertext, NullSink(), BENCH_PASSPHRASE, workers=workers)
+        
+        for _ in range(warmup):
+            encrypt_once()
+            decrypt_once()
+        
+        enc_samples, cipher_samples, dec_samples = [], [], []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            cipher_ms = encrypt_once()
+            enc_samples.append((time.perf_counter() - start) * 1000)
+            cipher_samples.append(cipher_ms)
+            
+            start = time.perf_counter()
+            decrypt_once()
+            dec_samples.append((time.perf_counter() - start) * 1000)
+        
+        encrypt_result = {'algorithm': algorithm, 'op': 'encrypt', 'size': size, 'workers': workers}
+        encrypt_result.update(summarize(enc_samples, size))
+        cipher_p50 = percentile(cipher_samples, 0.50) / 1000
+        encrypt_result['cipher_mb_per_s'] = size / (1024 * 1024) / cipher_p50 if cipher_p50 > 0 else None
+        encrypt_result['peak_memory_bytes'] = measure_peak_memory(encrypt_once)
+        
+        decrypt_result = {'algorithm': algorithm, 'op': 'decrypt', 'size': size, 'workers': workers}
+        decrypt_result.update(summarize(dec_samples, size))
+        decrypt_result['peak_memory_bytes'] = measure_peak_memory(decrypt_once)
+    
+    return [encrypt_result, decrypt_result]
+
+def run_suite(algorithms, sizes, repeat, warmup, tmpdir=None, log=None, workers=(1,)):
+    block = os.urandom(PAYLOAD_BLOCK_SIZE)
+    results = []
+    
+    if log:
+        log('kdf PBKDF2-SHA256')
+    results.append(bench_kdf(repeat, warmup))
+    
+    clear_key_cache()
+    for algorithm in algorithms:
+        for size in sizes:
+            for worker_count in workers:
+                if log:
+                    log(f'{algorithm} {format_size(size)} x{worker_count}')
+                results.extend(bench_cipher(algorithm, size, repeat, warmup, block, tmpdir, worker_count))
+    
+    return {
+        'created_at': datetime.utcnow().isoformat(),
+        'host': {
+            'platform': platform.platform(),
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+            'cpu_count': os.cpu_count(),
+            'python': platform.python_version(),
+            'pycryptodome': Crypto.__version__
+        },
+        'config': {'repeat': repeat, 'warmup': warmup, 'sizes': sizes, 'algorithms': algorithms,
+                   'workers': list(workers)},
+        'results': results
+    }
+
+def result_key(result):
+    return (result['algorithm'], result['op'], result['size'], result.get('workers', 1))
+
+def compare_results(baseline, current, threshold=DEFAULT_THRESHOLD):
+    # Throughput regressions for cipher runs, median latency regressions for the KDF
+    baseline_results = {result_key(r): r for r in baseline['results']}
+    comparisons = []
+    
+    for result in current['results']:
+        previous = baseline_results.get(result_key(result))
+        if previous is None:
+            continue
+        
+        if result['op'] == 'kdf':
+            metric, higher_is_better = 'p50_ms', False
+        else:
+            metric, higher_is_better = 'mb_per_s', True
+        old_value, new_value = previous.get(metric), result.get(metric)
+        if not old_value or new_value is None:
+            continue
+        
+        change = (new_value - old_value) / old_value
+        regression = change < -threshold if higher_is_better else change > threshold
+        comparisons.append({
+            'algorithm': result['algorithm'],
+            'op': result['op'],
+            'size': result['size'],
+            'workers': result.get('workers', 1),
+            'metric': metric,
+            'baseline': old_value,
+            'current': new_value,
+            'change': change,
+            'regression': regression
+        })
+    
+    return comparisons
+
+def print_results(report, out=sys.stdout):
+    print(f"{'algorithm':<20} {'op':<8} {'size':>6} {'thr':>3} {'p50 ms':>10} {'p95 ms':>10} {'p99 ms':>10} "
+          f"{'MB/s':>9} {'peak MB':>8}", file=out)
+    for result in report['results']:
+        mb_per_s = result.get('mb_per_s')
+        print(f"{result['algorithm']:<20} {result['op']:<8} {format_size(result['size']):>6} "
+              f"{result.get('workers', '-'):>3} {result['p50_ms']:>10.3f} {result['p95_ms']:>10.3f} {result['p99_ms']:>10.3f} "
+              f"{(f'{mb_per_s:.1f}' if mb_per_s else '-'):>9} "
+              f"{result['peak_memory_bytes'] / (1024 * 1024):>8.2f}", file=out)
+
+def print_comparisons(comparisons, threshold, out=sys.stdout):
+    for comparison in comparisons:
+        flag = 'REGRESSION' if comparison['regression'] else 'ok'
+        print(f"{flag:<10} {comparison['algorithm']:<20} {comparison['op']:<8} "
+              f"{format_size(comparison['size']):>6} x{comparison['workers']:<2} {comparison['metric']:<9} "
+              f"{comparison['baseline']:.3f} -> {comparison['current']:.3f} "
+              f"({comparison['change'] * 100:+.1f}%)", file=out)
+    regressions = sum(1 for c in comparisons if c['regression'])
+    print(f"{regressions} regression(s) beyond {threshold * 100:.0f}%", file=out)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline throughput benchmark for the supported ciphers')
+    parser.add_argument('--algorithms', default=','.join(ALGORITHM_IDS),
+                        help='comma-separated algorithm names')
+    parser.add_argument('--sizes', default=','.join(DEFAULT_SIZES),
+                        help='comma-separated payload sizes, e.g. 1K,4M,1G')
+    parser.add_argument('--max-size', default=None, help='skip sizes above this, e.g. 64M')
+    parser.add_argument('--workers', default='1',
+                        help='comma-separated thread counts for the segment pool, e.g. 1,4')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP)
+    parser.add_argument('--tmpdir', default=None, help='directory for ciphertext scratch files')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--input', help='load results from this file instead of running the suite')
+    parser.add_argument('--compare', help='baseline JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help='relative slowdown that counts as a regression (default 0.10)')
+    parser.add_argument('--calibrate-kdf', choices=list(KDF_PARAMS),
+                        help='instead of benchmarking, pick KDF parameters for this host and print the spec')
+    parser.add_argument('--target-ms', type=float, default=DEFAULT_KDF_TARGET_MS,
+                        help='target key derivation latency for --calibrate-kdf (default 250)')
+    args = parser.parse_args(argv)
+    
+    if args.calibrate_kdf:
+        if args.target_ms <= 0:
+            parser.error('--target-ms must be positive')
+        kdf, elapsed_ms = calibrate_kdf(args.calibrate_kdf, args.target_ms)
+        print(kdf)
+        print(f'{elapsed_ms:.1f} ms per derivation (target {args.target_ms:g} ms); '
+              f'set KDF in app.py to use it for new files', file=sys.stderr)
+        return 0
+    
+    if args.input:
+        with open(args.input) as f:
+            report = json.load(f)
+    else:
+        algorithms = [a.strip() for a in args.algorithms.split(',') if a.strip()]
+        for algorithm in algorithms:
+            if algorithm not in ALGORITHM_IDS:
+                parser.error(f'unknown algorithm: {algorithm}')
+        sizes = [parse_size(s) for s in args.sizes.split(',') if s.strip()]
+        if args.max_size:
+            sizes = [s for s in sizes if s <= parse_size(args.max_size)]
+        if args.repeat < 1:
+            parser.error('--repeat must be at least 1')
+        workers = [int(w) for w in args.workers.split(',') if w.strip()]
+        if not workers or min(workers) < 1:
+            parser.error('--workers must be positive integers')
+        
+        report = run_suite(algorithms, sizes, args.repeat, args.warmup, args.tmpdir,
+                           log=lambda message: print(f'running {message}', file=sys.stderr), workers=workers)
+        print_results(report)
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        comparisons = compare_results(baseline, report, args.threshold)
+        print_comparisons(comparisons, args.threshold)
+        if any(c['regression'] for c in comparisons):
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
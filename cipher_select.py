@@ -0,0 +1,139 @@
+import bisect
+import statistics
+import threading
+import time
+from datetime import datetime
+
+from Crypto.Random import get_random_bytes
+
+from crypto_utils import (ALGORITHM_IDS, DEFAULT_SEGMENT_SIZE, STREAM_NONCE_PREFIX_LENGTHS, new_cipher,
+                          segment_nonce)
+
+# Exclusive upper bounds (bytes) of the size buckets; the last bucket is open-ended
+SIZE_BUCKETS = (64 * 1024, 1024 * 1024, 16 * 1024 * 1024, 256 * 1024 * 1024)
+BUCKET_LABELS = ('<64K', '64K-1M', '1M-16M', '16M-256M', '256M+')
+# Payload encrypted for each bucket by the micro-benchmark; per-segment throughput has levelled off
+# well before the largest one, so bigger buckets reuse it
+BENCH_SIZES = (16 * 1024, 256 * 1024, 4 * 1024 * 1024, 4 * 1024 * 1024, 4 * 1024 * 1024)
+BENCH_REPEAT = 3
+DEFAULT_REFRESH_SECONDS = 300
+# Ledger measurements replace the micro-benchmark for a bucket and algorithm once there are this many
+MIN_LEDGER_SAMPLES = 5
+LEDGER_SAMPLE_LIMIT = 10000
+
+def bucket_index(size):
+    # Files of unknown size are treated as one full segment
+    return bisect.bisect_right(SIZE_BUCKETS, DEFAULT_SEGMENT_SIZE if size is None else size)
+
+def bench_throughput(algorithm, size, repeat=BENCH_REPEAT):
+    # MB/s for sealing size bytes the way StreamEncryptor does (one cipher per segment, header as AAD),
+    # best of repeat runs; key derivation is left out because it does not depend on the algorithm
+    key = get_random_bytes(32)
+    prefix = get_random_bytes(STREAM_NONCE_PREFIX_LENGTHS[algorithm])
+    header = get_random_bytes(64)
+    segment = get_random_bytes(min(size, DEFAULT_SEGMENT_SIZE))
+    segments = max(1, -(-size // DEFAULT_SEGMENT_SIZE))
+    
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for counter in range(segments):
+            cipher = new_cipher(algorithm, key, segment_nonce(prefix, counter, 0))
+            cipher.update(header)
+            cipher.encrypt_and_digest(segment)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return size / (1024 * 1024) / best if best > 0 else None
+
+class AlgorithmSelector:
+    """Picks the fastest algorithm for a file size from measured cipher throughput.
+
+    Each size bucket uses the median cipher-phase throughput of recent ledger blocks where
+    there are enough of them, and a micro-benchmark run once per process otherwise. Benchmark
+    figures are scaled by how the bucket's ledger medians compare with the benchmark, so both
+    sources rank on the same footing. Ledger measurements are re-read every ``refresh_interval``
+    seconds.
+    """
+    
+    def __init__(self, blockchain, algorithms=tuple(ALGORITHM_IDS), refresh_interval=DEFAULT_REFRESH_SECONDS):
+        self.blockchain = blockchain
+        self.algorithms = tuple(algorithms)
+        self.refresh_interval = refresh_interval
+        self._bench = None
+        self._table = None
+        self._refreshed_at = None
+        self._refreshed = 0.0
+        self._lock = threading.Lock()
+    
+    def choose(self, size):
+        return self.table()[bucket_index(size)]['choice']
+    
+    def table(self):
+        table = self._table
+        stale = table is None or time.monotonic() - self._refreshed >= self.refresh_interval
+        # Only the first call waits; later refreshes happen in whichever request gets the lock first
+        if stale and self._lock.acquire(blocking=table is None):
+            try:
+                if self._table is None or time.monotonic() - self._refreshed >= self.refresh_interval:
+                    self._refresh()
+            finally:
+                self._lock.release()
+        return self._table
+    
+    def refresh(self):
+        with self._lock:
+            self._refresh()
+        return self._table
+    
+    def snapshot(self):
+        table = self.table()
+        return {
+            'refreshed_at': self._refreshed_at,
+            'refresh_interval_seconds': self.refresh_interval,
+            'min_ledger_samples': MIN_LEDGER_SAMPLES,
+            'buckets': table
+        }
+    
+    def _refresh(self):
+        if self._bench is None:
+            measured = {size: {algorithm: bench_throughput(algorithm, size) for algorithm in self.algorithms}
+                        for size in set(BENCH_SIZES)}
+            self._bench = [measured[size] for size in BENCH_SIZES]
+        
+        samples = [{algorithm: [] for algorithm in self.algorithms} for _ in BUCKET_LABELS]
+        rows = self.blockchain.get_cipher_samples(LEDGER_SAMPLE_LIMIT)
+        for algorithm, file_size, cipher_bytes, cipher_time_ms in rows:
+            if algorithm in self.algorithms and file_size is not None:
+                mb_per_s = cipher_bytes / (1024 * 1024) / (cipher_time_ms / 1000)
+                samples[bucket_index(file_size)][algorithm].append(mb_per_s)
+        
+        table = []
+        for index, label in enumerate(BUCKET_LABELS):
+            bench = self._bench[index]
+            medians = {algorithm: statistics.median(ledger) for algorithm, ledger in samples[index].items()
+                       if len(ledger) >= MIN_LEDGER_SAMPLES}
+            # Real requests carry per-file overhead the micro-benchmark does not, so an algorithm
+            # without enough ledger samples is compared at its benchmark speed times that ratio
+            ratios = [median / bench[algorithm] for algorithm, median in medians.items() if bench[algorithm]]
+            scale = statistics.median(ratios) if ratios else 1.0
+            
+            measurements = {}
+            for algorithm in self.algorithms:
+                if algorithm in medians:
+                    mb_per_s, source = medians[algorithm], 'ledger'
+                else:
+                    mb_per_s, source = bench[algorithm] and bench[algorithm] * scale, 'benchmark'
+                measurements[algorithm] = {'mb_per_s': mb_per_s, 'source': source,
+                                           'samples': len(samples[index][algorithm])}
+            choice = max(self.algorithms, key=lambda algorithm: measurements[algorithm]['mb_per_s'] or 0)
+            table.append({
+                'bucket': label,
+                'max_size_bytes': SIZE_BUCKETS[index] if index < len(SIZE_BUCKETS) else None,
+                'choice': choice,
+                'benchmark_scale': scale,
+                'algorithms': measurements
+            })
+        
+        self._table = table
+        self._refreshed = time.monotonic()
+        self._refreshed_at = datetime.utcnow().isoformat()
@@ -1,12 +1,23 @@
+import io
+import mmap
 import os
 import struct
 import hashlib
+import hmac
+import threading
 import time
+import zlib
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import chain
 from Crypto.Cipher import AES, Blowfish, ChaCha20_Poly1305
-from Crypto.Protocol.KDF import PBKDF2
+from Crypto.Protocol.KDF import PBKDF2, HKDF, scrypt
 from Crypto.Random import get_random_bytes
 from Crypto.Hash import SHA256
 
+import metrics
+
 ALGORITHM_IDS = {
     'AES-256-GCM': 1,
     'Blowfish-256-EAX': 2,
@@ -15,14 +26,290 @@ ALGORITHM_IDS = {
 
 ALGORITHM_NAMES = {v: k for k, v in ALGORITHM_IDS.items()}
 
-def derive_key(passphrase, salt):
-    return PBKDF2(passphrase, salt, dkLen=32, count=200000, hmac_hash_module=SHA256)
+STREAM_MAGIC = b'ENCS'
+STREAM_VERSION = 2
+DEFAULT_SEGMENT_SIZE = 1024 * 1024
+READ_CHUNK_SIZE = 1024 * 1024
+
+# Per-segment nonce = random prefix | 4-byte segment counter | 1-byte final flag
+STREAM_NONCE_PREFIX_LENGTHS = {
+    'AES-256-GCM': 7,
+    'Blowfish-256-EAX': 11,
+    'ChaCha20-Poly1305': 7
+}
+
+STREAM_TAG_LENGTHS = {
+    'AES-256-GCM': 16,
+    'Blowfish-256-EAX': 8,
+    'ChaCha20-Poly1305': 16
+}
+
+# Header flags (version 2)
+FLAG_SESSION_KEY = 0x01
+# Header carries the total plaintext length and segment count (authenticated as part of the header AAD)
+FLAG_MANIFEST = 0x02
+# Segments may be zlib-compressed before encryption; the header names the codec
+FLAG_COMPRESSED = 0x04
+# Header names the KDF and its cost parameters; without it the key was derived with LEGACY_KDF
+FLAG_KDF = 0x08
+KNOWN_FLAGS = FLAG_SESSION_KEY | FLAG_MANIFEST | FLAG_COMPRESSED | FLAG_KDF
+
+# Segment record flags; the whole byte is part of the segment nonce, so it is authenticated
+SEGMENT_FINAL = 0x01
+SEGMENT_COMPRESSED = 0x02
+
+COMPRESSION_ZLIB = 1
+COMPRESSION_LEVEL = 6
+# 'auto' compresses when a fast zlib pass over samples of the first segment saves at least 10%
+COMPRESSION_MODES = ('off', 'auto', 'always')
+PROBE_SAMPLE_SIZE = 16 * 1024
+PROBE_SAMPLES = 4
+PROBE_MAX_RATIO = 0.9
+MIN_COMPRESS_SIZE = 512
+
+# Phases timed separately by StreamEncryptor; 'header' covers header and segment record packing
+ENCRYPT_PHASES = ('kdf', 'compress', 'cipher', 'hash', 'header', 'write')
+
+KDF_IDS = {
+    'pbkdf2-sha256': 1,
+    'scrypt': 2
+}
+
+KDF_NAMES = {v: k for k, v in KDF_IDS.items()}
+
+# Parameter names in header order (each a little-endian uint32) with their defaults
+KDF_PARAMS = {
+    'pbkdf2-sha256': {'iterations': 200000},
+    'scrypt': {'n': 2 ** 15, 'r': 8, 'p': 1}
+}
+
+# Bounds on KDF cost; the upper ones stop a crafted header from tying up a worker, so they sit at
+# about 10x the defaults: scrypt memory is 128*n*r bytes and its work n*r*p block mixes
+MIN_PBKDF2_ITERATIONS = 10000
+MAX_PBKDF2_ITERATIONS = 2000000
+MIN_SCRYPT_N = 2 ** 10
+MAX_SCRYPT_MEMORY = 256 * 1024 * 1024
+MAX_SCRYPT_PARALLELISM = 4
+MAX_SCRYPT_WORK = 2 ** 21
+
+# KDF specs are written 'name:param=value,...'; files without a KDF field used this one
+LEGACY_KDF = 'pbkdf2-sha256:iterations=200000'
+DEFAULT_KDF = LEGACY_KDF
+DEFAULT_KDF_TARGET_MS = 250
+
+KEY_MODES = ('file', 'session')
+KEY_CACHE_MAX_ENTRIES = 256
+KEY_CACHE_TTL_SECONDS = 600
+SUBKEY_CONTEXT = b'enc-dec per-file subkey'
+
+@lru_cache(maxsize=64)
+def parse_kdf(kdf):
+    # Accepts a 'name:param=value,...' spec or a (name, params) pair and returns the canonical
+    # (name, params) pair; omitted parameters take their defaults
+    if isinstance(kdf, str):
+        name, _, text = kdf.partition(':')
+        name = name.strip().lower()
+        if name not in KDF_PARAMS:
+            raise ValueError(f"Unknown KDF: {name}")
+        values = dict(KDF_PARAMS[name])
+        for item in filter(None, (part.strip() for part in text.split(','))):
+            key, sep, value = item.partition('=')
+            key = key.strip().lower()
+            if not sep or key not in values:
+                raise ValueError(f"Unknown {name} parameter: {item}")
+            values[key] = int(value)
+        params = tuple(values.values())
+    else:
+        name, params = kdf
+        if name not in KDF_PARAMS or len(params) != len(KDF_PARAMS[name]):
+            raise ValueError(f"Invalid KDF: {kdf}")
+        params = tuple(int(value) for value in params)
+    
+    if name == 'pbkdf2-sha256':
+        if not MIN_PBKDF2_ITERATIONS <= params[0] <= MAX_PBKDF2_ITERATIONS:
+            raise ValueError(f"PBKDF2 iterations must be between {MIN_PBKDF2_ITERATIONS} and {MAX_PBKDF2_ITERATIONS}")
+    else:
+        n, r, p = params
+        if n < MIN_SCRYPT_N or n & (n - 1):
+            raise ValueError(f"scrypt n must be a power of two of at least {MIN_SCRYPT_N}")
+        if r < 1 or 128 * n * r > MAX_SCRYPT_MEMORY:
+            raise ValueError(f"scrypt n and r need more than {MAX_SCRYPT_MEMORY // (1024 * 1024)} MiB")
+        if not 1 <= p <= MAX_SCRYPT_PARALLELISM:
+            raise ValueError(f"scrypt p must be between 1 and {MAX_SCRYPT_PARALLELISM}")
+        if n * r * p > MAX_SCRYPT_WORK:
+            raise ValueError(f"scrypt n*r*p must be at most {MAX_SCRYPT_WORK}")
+    return name, params
+
+def format_kdf(kdf):
+    name, params = parse_kdf(kdf)
+    return f"{name}:" + ','.join(f'{key}={value}' for key, value in zip(KDF_PARAMS[name], params))
+
+class KeyCache:
+    """Bounded, TTL-evicting cache of derived keys keyed by (passphrase digest, salt, KDF).
+
+    Passphrases are never stored: entries are keyed by an HMAC of the passphrase
+    under a per-process random secret. Cached key material is zeroized when an
+    entry is evicted, expires or the cache is cleared; callers get a copy.
+    """
+    
+    def __init__(self, max_entries=KEY_CACHE_MAX_ENTRIES, ttl_seconds=KEY_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._secret = get_random_bytes(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def passphrase_digest(self, passphrase):
+        if isinstance(passphrase, str):
+            passphrase = passphrase.encode('utf-8')
+        return hmac.new(self._secret, passphrase, hashlib.sha256).digest()
+    
+    def get(self, passphrase, salt, kdf=DEFAULT_KDF):
+        cache_key = (self.passphrase_digest(passphrase), bytes(salt), parse_kdf(kdf))
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                return None
+            expires_at, key = entry
+            if expires_at <= now:
+                self._evict(cache_key)
+                return None
+            self._entries.move_to_end(cache_key)
+            return bytes(key)
+    
+    def put(self, passphrase, salt, key, kdf=DEFAULT_KDF):
+        cache_key = (self.passphrase_digest(passphrase), bytes(salt), parse_kdf(kdf))
+        now = time.monotonic()
+        with self._lock:
+            if cache_key in self._entries:
+                self._evict(cache_key)
+            self._entries[cache_key] = (now + self.ttl_seconds, bytearray(key))
+            self._prune(now)
+    
+    def clear(self):
+        with self._lock:
+            for cache_key in list(self._entries):
+                self._evict(cache_key)
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def _prune(self, now):
+        expired = [k for k, (expires_at, _) in self._entries.items() if expires_at <= now]
+        for cache_key in expired:
+            self._evict(cache_key)
+        while len(self._entries) > self.max_entries:
+            self._evict(next(iter(self._entries)))
+    
+    def _evict(self, cache_key):
+        _, key = self._entries.pop(cache_key)
+        for i in range(len(key)):
+            key[i] = 0
+
+key_cache = KeyCache()
+
+KDF_SECONDS = metrics.histogram('encdec_kdf_duration_seconds', 'Key derivation time (key cache misses only)',
+                                ('kdf',))
+
+_sessions = OrderedDict()
+_sessions_lock = threading.Lock()
+
+def derive_key(passphrase, salt, kdf=DEFAULT_KDF):
+    name, params = parse_kdf(kdf)
+    with KDF_SECONDS.time(kdf=name):
+        if name == 'scrypt':
+            n, r, p = params
+            return scrypt(passphrase, salt, 32, N=n, r=r, p=p)
+        return PBKDF2(passphrase, salt, dkLen=32, count=params[0], hmac_hash_module=SHA256)
+
+def cached_derive_key(passphrase, salt, kdf=DEFAULT_KDF):
+    key = key_cache.get(passphrase, salt, kdf)
+    if key is None:
+        key = derive_key(passphrase, salt, kdf)
+        key_cache.put(passphrase, salt, key, kdf)
+    return key
+
+def time_kdf(kdf, repeat=3):
+    # Best of repeat derivations in milliseconds, bypassing the key cache
+    salt = get_random_bytes(16)
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        derive_key('kdf-calibration', salt, kdf)
+        samples.append((time.perf_counter() - start) * 1000)
+    return min(samples)
+
+def calibrate_kdf(name, target_ms=DEFAULT_KDF_TARGET_MS, repeat=3):
+    # Picks the cost parameters that bring one derivation on this host closest to target_ms
+    # without exceeding it; returns (kdf spec, measured ms)
+    if name not in KDF_PARAMS:
+        raise ValueError(f"Unknown KDF: {name}")
+    if target_ms <= 0:
+        raise ValueError("Target latency must be positive")
+    
+    if name == 'pbkdf2-sha256':
+        # PBKDF2 cost is linear in the iteration count: extrapolate from a short probe, then
+        # scale back once if the full-length run lands above the target
+        iterations = MIN_PBKDF2_ITERATIONS * 2
+        elapsed_ms = time_kdf(f'{name}:iterations={iterations}', repeat)
+        for _ in range(2):
+            iterations = int(iterations * target_ms / elapsed_ms) // 1000 * 1000
+            iterations = min(max(iterations, MIN_PBKDF2_ITERATIONS), MAX_PBKDF2_ITERATIONS)
+            elapsed_ms = time_kdf(f'{name}:iterations={iterations}', repeat)
+            if elapsed_ms <= target_ms:
+                break
+        return format_kdf(f'{name}:iterations={iterations}'), elapsed_ms
+    
+    # scrypt n must be a power of two: double it (r and p at their defaults) until the target is passed
+    defaults = KDF_PARAMS[name]
+    n = MIN_SCRYPT_N
+    kdf = f"{name}:n={n},r={defaults['r']},p={defaults['p']}"
+    elapsed_ms = time_kdf(kdf, repeat)
+    while (128 * n * 2 * defaults['r'] <= MAX_SCRYPT_MEMORY
+           and n * 2 * defaults['r'] * defaults['p'] <= MAX_SCRYPT_WORK):
+        candidate = f"{name}:n={n * 2},r={defaults['r']},p={defaults['p']}"
+        candidate_ms = time_kdf(candidate, repeat)
+        if candidate_ms > target_ms:
+            break
+        n, kdf, elapsed_ms = n * 2, candidate, candidate_ms
+    return format_kdf(kdf), elapsed_ms
+
+def derive_subkey(master_key, subkey_salt):
+    return HKDF(master_key, 32, subkey_salt, SHA256, context=SUBKEY_CONTEXT)
+
+def session_master_key(passphrase, kdf=DEFAULT_KDF):
+    # One KDF derivation per passphrase and KDF while its master key stays in the key cache;
+    # the session only remembers which salt that master key was derived with
+    session_key = (key_cache.passphrase_digest(passphrase), parse_kdf(kdf))
+    with _sessions_lock:
+        master_salt = _sessions.get(session_key)
+    
+    if master_salt is not None:
+        master_key = key_cache.get(passphrase, master_salt, kdf)
+        if master_key is not None:
+            return master_salt, master_key
+    
+    master_salt = get_random_bytes(16)
+    master_key = cached_derive_key(passphrase, master_salt, kdf)
+    with _sessions_lock:
+        _sessions[session_key] = master_salt
+        _sessions.move_to_end(session_key)
+        while len(_sessions) > key_cache.max_entries:
+            _sessions.popitem(last=False)
+    return master_salt, master_key
+
+def clear_key_cache():
+    with _sessions_lock:
+        _sessions.clear()
+    key_cache.clear()
 
 def encrypt_file(file_data, passphrase, algorithm):
     start_time = time.perf_counter()
     
+    # The version 1 header has no KDF field, so these files always use the legacy KDF
     salt = get_random_bytes(16)
-    key = derive_key(passphrase, salt)
+    key = derive_key(passphrase, salt, LEGACY_KDF)
     
     algorithm_id = ALGORITHM_IDS[algorithm]
     
@@ -57,49 +344,548 @@ def encrypt_file(file_data, passphrase, algorithm):
     return encrypted_data, enc_time_ms, file_hash, salt, nonce, tag
 
 def decrypt_file(encrypted_data, passphrase):
+    # The header is parsed in place and the ciphertext is decrypted straight from a view of the input
+    view = memoryview(encrypted_data)
+    if view[:len(STREAM_MAGIC)] == STREAM_MAGIC:
+        plaintext = io.BytesIO()
+        dec_time_ms, algorithm, _, _ = decrypt_stream(BufferReader(view), plaintext, passphrase)
+        return plaintext.getvalue(), dec_time_ms, algorithm
+    
     start_time = time.perf_counter()
     
     offset = 0
-    algorithm_id = struct.unpack('B', encrypted_data[offset:offset+1])[0]
+    algorithm_id = struct.unpack_from('B', view, offset)[0]
     offset += 1
     
     algorithm = ALGORITHM_NAMES.get(algorithm_id)
     if not algorithm:
         raise ValueError(f"Unknown algorithm ID: {algorithm_id}")
     
-    salt_len = struct.unpack('H', encrypted_data[offset:offset+2])[0]
-    offset += 2
-    salt = encrypted_data[offset:offset+salt_len]
-    offset += salt_len
+    fields = []
+    for _ in range(3):
+        field_len = struct.unpack_from('H', view, offset)[0]
+        offset += 2
+        if offset + field_len > len(view):
+            raise ValueError("Encrypted file is truncated")
+        fields.append(bytes(view[offset:offset+field_len]))
+        offset += field_len
+    salt, nonce, tag = fields
     
-    nonce_len = struct.unpack('H', encrypted_data[offset:offset+2])[0]
-    offset += 2
-    nonce = encrypted_data[offset:offset+nonce_len]
-    offset += nonce_len
+    ciphertext = view[offset:]
     
-    tag_len = struct.unpack('H', encrypted_data[offset:offset+2])[0]
-    offset += 2
-    tag = encrypted_data[offset:offset+tag_len]
-    offset += tag_len
+    key = cached_derive_key(passphrase, salt, LEGACY_KDF)
     
-    ciphertext = encrypted_data[offset:]
+    cipher = new_cipher(algorithm, key, nonce)
+    plaintext = cipher.decrypt_and_verify(ciphertext, tag)
     
-    key = derive_key(passphrase, salt)
+    end_time = time.perf_counter()
+    dec_time_ms = (end_time - start_time) * 1000
     
+    return plaintext, dec_time_ms, algorithm
+
+def new_cipher(algorithm, key, nonce):
     if algorithm == 'AES-256-GCM':
-        cipher = AES.new(key, AES.MODE_GCM, nonce=nonce)
-        plaintext = cipher.decrypt_and_verify(ciphertext, tag)
+        return AES.new(key, AES.MODE_GCM, nonce=nonce)
     elif algorithm == 'Blowfish-256-EAX':
-        cipher = Blowfish.new(key, Blowfish.MODE_EAX, nonce=nonce)
-        plaintext = cipher.decrypt_and_verify(ciphertext, tag)
+        return Blowfish.new(key, Blowfish.MODE_EAX, nonce=nonce)
     elif algorithm == 'ChaCha20-Poly1305':
-        cipher = ChaCha20_Poly1305.new(key=key, nonce=nonce)
-        plaintext = cipher.decrypt(ciphertext)
-        cipher.verify(tag)
+        return ChaCha20_Poly1305.new(key=key, nonce=nonce)
     else:
         raise ValueError(f"Unknown algorithm: {algorithm}")
+
+def segment_nonce(nonce_prefix, counter, record_flags):
+    return nonce_prefix + struct.pack('>IB', counter, record_flags)
+
+def is_compressible(data):
+    # Cheap probe: a level-1 zlib pass over a few evenly spaced samples. Media and already
+    # compressed formats barely shrink and are left alone.
+    if len(data) < MIN_COMPRESS_SIZE:
+        return False
+    view = memoryview(data)
+    if len(view) <= PROBE_SAMPLE_SIZE * PROBE_SAMPLES:
+        sample = bytes(view)
+    else:
+        step = (len(view) - PROBE_SAMPLE_SIZE) // (PROBE_SAMPLES - 1)
+        sample = b''.join(view[i * step:i * step + PROBE_SAMPLE_SIZE] for i in range(PROBE_SAMPLES))
+    return len(zlib.compress(sample, 1)) <= len(sample) * PROBE_MAX_RATIO
+
+def manifest_segment_count(total_size, segment_size):
+    # The encryptor always emits a final segment, even an empty one
+    return max(1, -(-total_size // segment_size))
+
+def read_exact(source, size):
+    data = source.read(size)
+    if len(data) == size:
+        return data
+    chunks = [data]
+    remaining = size - len(data)
+    while remaining > 0:
+        chunk = source.read(remaining)
+        if not chunk:
+            raise ValueError("Encrypted file is truncated")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+class BufferReader:
+    """Read-only file object over a buffer; reads return memoryview slices instead of copies."""
+    
+    def __init__(self, buffer):
+        self._view = memoryview(buffer)
+        self._pos = 0
+    
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else min(self._pos + size, len(self._view))
+        data = self._view[self._pos:end]
+        self._pos = end
+        return data
+
+def iter_chunks(source, chunk_size=READ_CHUNK_SIZE):
+    if hasattr(source, 'read'):
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    else:
+        for chunk in source:
+            if chunk:
+                yield chunk
+
+class StreamEncryptor:
+    """File-like writer for the segmented (version 2) container format.
+
+    With ``workers`` > 1 segments are sealed concurrently on a thread pool (the cipher
+    calls release the GIL) and written in order. Passing ``total_size`` records a manifest
+    in the header; close() fails if the data written does not match it. With ``compress``
+    each segment is deflated before encryption unless that would not make it smaller.
+    The key is derived with ``kdf`` and its parameters are recorded in the header.
+    """
+    
+    def __init__(self, dest, passphrase, algorithm, segment_size=DEFAULT_SEGMENT_SIZE, key_mode='file',
+                 workers=1, total_size=None, compress=False, kdf=DEFAULT_KDF):
+        if algorithm not in ALGORITHM_IDS:
+            raise ValueError(f"Unknown algorithm: {algorithm}")
+        if segment_size <= 0 or segment_size > 0xFFFFFFFF:
+            raise ValueError(f"Invalid segment size: {segment_size}")
+        if key_mode not in KEY_MODES:
+            raise ValueError(f"Unknown key mode: {key_mode}")
+        if workers < 1:
+            raise ValueError(f"Invalid worker count: {workers}")
+        
+        self.dest = dest
+        self.algorithm = algorithm
+        self.segment_size = segment_size
+        self.workers = workers
+        self.total_size = total_size
+        self.compress = compress
+        self.kdf = parse_kdf(kdf)
+        self.flags = FLAG_KDF
+        self.subkey_salt = None
+        self.nonce = get_random_bytes(STREAM_NONCE_PREFIX_LENGTHS[algorithm])
+        self.tag = None
+        self.size = 0
+        self.stored_size = 0
+        self.segments = 0
+        self.timings = {phase: 0.0 for phase in ENCRYPT_PHASES}
+        self._hasher = hashlib.sha256()
+        self._buffer = bytearray()
+        self._closed = False
+        self._pool = None
+        self._pending = deque()
+        
+        if total_size is not None:
+            self.flags |= FLAG_MANIFEST
+        if compress:
+            self.flags |= FLAG_COMPRESSED
+        
+        phase_start = time.perf_counter()
+        if key_mode == 'session':
+            self.flags |= FLAG_SESSION_KEY
+            self.salt, master_key = session_master_key(passphrase, self.kdf)
+            self.subkey_salt = get_random_bytes(16)
+            self._key = derive_subkey(master_key, self.subkey_salt)
+        else:
+            self.salt = get_random_bytes(16)
+            self._key = derive_key(passphrase, self.salt, self.kdf)
+        self.timings['kdf'] += time.perf_counter() - phase_start
+        
+        phase_start = time.perf_counter()
+        header = STREAM_MAGIC
+        header += struct.pack('<BBBI', STREAM_VERSION, ALGORITHM_IDS[algorithm], self.flags, segment_size)
+        header += struct.pack('<H', len(self.salt)) + self.salt
+        header += struct.pack('<H', len(self.nonce)) + self.nonce
+        if self.flags & FLAG_SESSION_KEY:
+            header += struct.pack('<H', len(self.subkey_salt)) + self.subkey_salt
+        if self.flags & FLAG_MANIFEST:
+            header += struct.pack('<QI', total_size, manifest_segment_count(total_size, segment_size))
+        if self.flags & FLAG_COMPRESSED:
+            header += struct.pack('<B', COMPRESSION_ZLIB)
+        kdf_name, kdf_params = self.kdf
+        header += struct.pack(f'<B{len(kdf_params)}I', KDF_IDS[kdf_name], *kdf_params)
+        self.header = header
+        self.timings['header'] += time.perf_counter() - phase_start
+        
+        phase_start = time.perf_counter()
+        self.dest.write(header)
+        self.timings['write'] += time.perf_counter() - phase_start
+    
+    def write(self, data):
+        if self._closed:
+            raise ValueError("Write to closed StreamEncryptor")
+        phase_start = time.perf_counter()
+        self._hasher.update(data)
+        self.timings['hash'] += time.perf_counter() - phase_start
+        self.size += len(data)
+        self._buffer += data
+        
+        # Always keep the trailing segment buffered: only close() knows it is final
+        while len(self._buffer) > self.segment_size:
+            segment = bytes(self._buffer[:self.segment_size])
+            del self._buffer[:self.segment_size]
+            self._seal(segment, final=False)
+        return len(data)
+    
+    def close(self):
+        if self._closed:
+            return
+        try:
+            if self.total_size is not None and self.size != self.total_size:
+                raise ValueError(f"Wrote {self.size} bytes but the manifest declares {self.total_size}")
+            self._seal(bytes(self._buffer), final=True)
+            self._drain(0)
+        finally:
+            self._buffer = bytearray()
+            self._closed = True
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+    
+    def _seal(self, segment, final):
+        counter = self.segments
+        self.segments += 1
+        # A single-segment file never starts the pool
+        if self.workers > 1 and (self._pool is not None or not final):
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='stream-encrypt')
+            self._pending.append(self._pool.submit(self._encrypt_segment, segment, counter, final))
+            self._drain(self.workers * 2)
+        else:
+            self._write_segment(*self._encrypt_segment(segment, counter, final))
+    
+    def _encrypt_segment(self, segment, counter, final):
+        record_flags = SEGMENT_FINAL if final else 0
+        compress_seconds = 0.0
+        if self.compress:
+            phase_start = time.perf_counter()
+            packed = zlib.compress(segment, COMPRESSION_LEVEL)
+            compress_seconds = time.perf_counter() - phase_start
+            # A segment that does not shrink (e.g. embedded media) is stored as-is
+            if len(packed) < len(segment):
+                segment = packed
+                record_flags |= SEGMENT_COMPRESSED
+        
+        phase_start = time.perf_counter()
+        cipher = new_cipher(self.algorithm, self._key, segment_nonce(self.nonce, counter, record_flags))
+        cipher.update(self.header)
+        ciphertext, tag = cipher.encrypt_and_digest(segment)
+        return record_flags, ciphertext, tag, time.perf_counter() - phase_start, compress_seconds
+    
+    def _drain(self, max_pending):
+        # Segments are written in counter order; at most max_pending stay in flight
+        while len(self._pending) > max_pending:
+            self._write_segment(*self._pending.popleft().result())
+    
+    def _write_segment(self, record_flags, ciphertext, tag, cipher_seconds, compress_seconds):
+        phase_start = time.perf_counter()
+        record = struct.pack('<BI', record_flags, len(ciphertext))
+        header_done = time.perf_counter()
+        self.dest.write(record)
+        self.dest.write(ciphertext)
+        self.dest.write(tag)
+        write_done = time.perf_counter()
+        
+        # With workers > 1 these are times summed across threads, not wall time
+        self.timings['cipher'] += cipher_seconds
+        self.timings['compress'] += compress_seconds
+        self.stored_size += len(ciphertext)
+        self.timings['header'] += header_done - phase_start
+        self.timings['write'] += write_done - header_done
+        self.tag = tag
+    
+    @property
+    def timings_ms(self):
+        return {phase: seconds * 1000 for phase, seconds in self.timings.items()}
+    
+    @property
+    def file_hash(self):
+        return self._hasher.hexdigest()
+
+class StreamDecryptor:
+    """Yields plaintext from a version 1 or version 2 container.
+
+    Version 1 files carry a single tag that is only checked at the end, so
+    callers must discard everything already yielded if iteration raises.
+    Version 2 segments are decrypted on ``workers`` threads when it is > 1.
+    """
+    
+    def __init__(self, source, passphrase, workers=1):
+        if workers < 1:
+            raise ValueError(f"Invalid worker count: {workers}")
+        self.source = source
+        self.workers = workers
+        self.total_size = None
+        self.segment_count = None
+        self.compression = None
+        
+        first = bytes(read_exact(source, 1))
+        if first == STREAM_MAGIC[:1]:
+            if read_exact(source, len(STREAM_MAGIC) - 1) != STREAM_MAGIC[1:]:
+                raise ValueError("Invalid encrypted file header")
+            self._read_stream_header()
+        else:
+            self._read_legacy_header(first)
+        
+        algorithm = ALGORITHM_NAMES.get(self.algorithm_id)
+        if not algorithm:
+            raise ValueError(f"Unknown algorithm ID: {self.algorithm_id}")
+        self.algorithm = algorithm
+        
+        # Repeat decrypts of the same file (same passphrase, salt and KDF) skip the KDF
+        key = cached_derive_key(passphrase, self.salt, self.kdf)
+        if self.flags & FLAG_SESSION_KEY:
+            key = derive_subkey(key, self.subkey_salt)
+        self._key = key
+    
+    def _read_stream_header(self):
+        # Header fields are small, so they are copied out of memoryview sources
+        fixed = bytes(read_exact(self.source, 7))
+        self.version, self.algorithm_id, self.flags, self.segment_size = struct.unpack('<BBBI', fixed)
+        if self.version != STREAM_VERSION:
+            raise ValueError(f"Unsupported container version: {self.version}")
+        if self.flags & ~KNOWN_FLAGS:
+            raise ValueError(f"Unsupported container flags: {self.flags:#04x}")
+        
+        salt_len_bytes = bytes(read_exact(self.source, 2))
+        self.salt = bytes(read_exact(self.source, struct.unpack('<H', salt_len_bytes)[0]))
+        nonce_len_bytes = bytes(read_exact(self.source, 2))
+        self.nonce = bytes(read_exact(self.source, struct.unpack('<H', nonce_len_bytes)[0]))
+        header = STREAM_MAGIC + fixed + salt_len_bytes + self.salt + nonce_len_bytes + self.nonce
+        
+        self.subkey_salt = None
+        if self.flags & FLAG_SESSION_KEY:
+            subkey_salt_len_bytes = bytes(read_exact(self.source, 2))
+            self.subkey_salt = bytes(read_exact(self.source, struct.unpack('<H', subkey_salt_len_bytes)[0]))
+            header += subkey_salt_len_bytes + self.subkey_salt
+        
+        if self.flags & FLAG_MANIFEST:
+            manifest = bytes(read_exact(self.source, 12))
+            self.total_size, self.segment_count = struct.unpack('<QI', manifest)
+            if self.segment_count != manifest_segment_count(self.total_size, self.segment_size):
+                raise ValueError("Corrupted container manifest")
+            header += manifest
+        
+        if self.flags & FLAG_COMPRESSED:
+            codec = bytes(read_exact(self.source, 1))
+            if codec[0] != COMPRESSION_ZLIB:
+                raise ValueError(f"Unsupported compression codec: {codec[0]}")
+            self.compression = 'zlib'
+            header += codec
+        
+        self.kdf = parse_kdf(LEGACY_KDF)
+        if self.flags & FLAG_KDF:
+            kdf_id = bytes(read_exact(self.source, 1))
+            kdf_name = KDF_NAMES.get(kdf_id[0])
+            if kdf_name is None:
+                raise ValueError(f"Unknown KDF ID: {kdf_id[0]}")
+            kdf_params = bytes(read_exact(self.source, 4 * len(KDF_PARAMS[kdf_name])))
+            # Rejects parameters outside the accepted cost bounds before any derivation runs
+            self.kdf = parse_kdf((kdf_name, struct.unpack(f'<{len(KDF_PARAMS[kdf_name])}I', kdf_params)))
+            header += kdf_id + kdf_params
+        
+        self.tag = None
+        self.header = header
+    
+    def _read_legacy_header(self, first):
+        self.version = 1
+        self.algorithm_id = struct.unpack('B', first)[0]
+        self.flags = 0
+        self.segment_size = None
+        self.subkey_salt = None
+        self.kdf = parse_kdf(LEGACY_KDF)
+        
+        salt_len = struct.unpack('H', read_exact(self.source, 2))[0]
+        self.salt = bytes(read_exact(self.source, salt_len))
+        nonce_len = struct.unpack('H', read_exact(self.source, 2))[0]
+        self.nonce = bytes(read_exact(self.source, nonce_len))
+        tag_len = struct.unpack('H', read_exact(self.source, 2))[0]
+        self.tag = bytes(read_exact(self.source, tag_len))
+    
+    def __iter__(self):
+        if self.version == 1:
+            return self._iter_legacy()
+        return self._iter_segments()
+    
+    def _iter_segments(self):
+        plaintexts = self._iter_plaintext_segments()
+        if self.compression is None:
+            yield from plaintexts
+            return
+        
+        # Stored lengths are compressed lengths, so the manifest total is checked on the inflated data
+        total = 0
+        for plaintext in plaintexts:
+            total += len(plaintext)
+            yield plaintext
+        if self.total_size is not None and total != self.total_size:
+            raise ValueError("Plaintext length does not match the container manifest")
+    
+    def _iter_plaintext_segments(self):
+        if self.workers == 1:
+            for segment in self._read_segments():
+                yield self._decrypt_segment(*segment)
+            return
+        
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='stream-decrypt') as pool:
+            for segment in self._read_segments():
+                pending.append(pool.submit(self._decrypt_segment, *segment))
+                while len(pending) > self.workers * 2:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    
+    def _decrypt_segment(self, counter, record_flags, ciphertext, tag):
+        cipher = new_cipher(self.algorithm, self._key, segment_nonce(self.nonce, counter, record_flags))
+        cipher.update(self.header)
+        plaintext = cipher.decrypt_and_verify(ciphertext, tag)
+        if not record_flags & SEGMENT_COMPRESSED:
+            return plaintext
+        
+        # Inflate at most one segment's worth, so a crafted stream cannot balloon in memory
+        inflater = zlib.decompressobj()
+        try:
+            data = inflater.decompress(plaintext, self.segment_size)
+        except zlib.error:
+            raise ValueError("Corrupted compressed segment")
+        if not inflater.eof or inflater.unconsumed_tail or inflater.unused_data:
+            raise ValueError("Corrupted compressed segment")
+        if not record_flags & SEGMENT_FINAL and len(data) != self.segment_size:
+            raise ValueError("Corrupted compressed segment")
+        return data
+    
+    def _read_segments(self):
+        # Yields (counter, record_flags, ciphertext, tag) records; authentication happens in _decrypt_segment
+        allowed_flags = SEGMENT_FINAL | (SEGMENT_COMPRESSED if self.compression else 0)
+        tag_len = STREAM_TAG_LENGTHS[self.algorithm]
+        counter = 0
+        total = 0
+        
+        while True:
+            record = self.source.read(5)
+            if not record:
+                raise ValueError("Encrypted file is truncated")
+            if len(record) < 5:
+                record += read_exact(self.source, 5 - len(record))
+            record_flags, length = struct.unpack('<BI', record)
+            if record_flags & ~allowed_flags or length > self.segment_size:
+                raise ValueError("Corrupted segment header")
+            final = bool(record_flags & SEGMENT_FINAL)
+            
+            if self.segment_count is not None and (counter >= self.segment_count or
+                                                   final != (counter == self.segment_count - 1)):
+                raise ValueError("Segment count does not match the container manifest")
+            
+            ciphertext = read_exact(self.source, length)
+            tag = bytes(read_exact(self.source, tag_len))
+            total += length
+            
+            yield counter, record_flags, ciphertext, tag
+            counter += 1
+            
+            if final:
+                self.tag = tag
+                break
+        
+        if self.total_size is not None and self.compression is None and total != self.total_size:
+            raise ValueError("Plaintext length does not match the container manifest")
+        if self.source.read(1):
+            raise ValueError("Unexpected data after final segment")
+    
+    def _iter_legacy(self):
+        cipher = new_cipher(self.algorithm, self._key, self.nonce)
+        for chunk in iter_chunks(self.source):
+            yield cipher.decrypt(chunk)
+        cipher.verify(self.tag)
+
+def encrypt_stream(source, dest, passphrase, algorithm, segment_size=DEFAULT_SEGMENT_SIZE, key_mode='file',
+                   workers=1, total_size=None, progress=None, compression='off', kdf=DEFAULT_KDF):
+    # progress, if given, is called with the number of plaintext bytes consumed so far.
+    # compression is one of COMPRESSION_MODES; 'auto' decides from the first segment.
+    if compression not in COMPRESSION_MODES:
+        raise ValueError(f"Unknown compression mode: {compression}")
+    start_time = time.perf_counter()
+    
+    chunks = iter_chunks(source, segment_size)
+    compress = compression == 'always'
+    if compression == 'auto':
+        first = next(chunks, b'')
+        compress = is_compressible(first)
+        chunks = chain([first], chunks)
+    
+    encryptor = StreamEncryptor(dest, passphrase, algorithm, segment_size, key_mode, workers, total_size, compress,
+                                kdf)
+    for chunk in chunks:
+        encryptor.write(chunk)
+        if progress is not None:
+            progress(encryptor.size)
+    encryptor.close()
+    
+    end_time = time.perf_counter()
+    enc_time_ms = (end_time - start_time) * 1000
+    
+    # stored_size is the segment payload after compression (equal to size when nothing was compressed)
+    return (enc_time_ms, encryptor.file_hash, encryptor.salt, encryptor.nonce, encryptor.tag,
+            encryptor.size, encryptor.timings_ms, encryptor.stored_size)
+
+def encrypt_path(source_path, dest_path, passphrase, algorithm, segment_size=DEFAULT_SEGMENT_SIZE, key_mode='file',
+                 workers=1, compression='off', kdf=DEFAULT_KDF):
+    # File-path wrapper around encrypt_stream so the work can be shipped to a process pool;
+    # the size is known up front, so the header always carries a manifest
+    with open(source_path, 'rb') as source, open(dest_path, 'wb') as dest:
+        total_size = os.fstat(source.fileno()).st_size
+        return encrypt_stream(source, dest, passphrase, algorithm, segment_size, key_mode, workers, total_size,
+                              compression=compression, kdf=kdf)
+
+def decrypt_stream(source, dest, passphrase, workers=1, progress=None):
+    start_time = time.perf_counter()
+    
+    decryptor = StreamDecryptor(source, passphrase, workers)
+    hasher = hashlib.sha256()
+    size = 0
+    for chunk in decryptor:
+        hasher.update(chunk)
+        dest.write(chunk)
+        size += len(chunk)
+        if progress is not None:
+            progress(size)
     
     end_time = time.perf_counter()
     dec_time_ms = (end_time - start_time) * 1000
     
-    return plaintext, dec_time_ms, algorithm
+    return dec_time_ms, decryptor.algorithm, hasher.hexdigest(), size
+
+def decrypt_path(source_path, dest, passphrase, workers=1, progress=None):
+    # Decrypts straight out of a read-only mapping of the file: segments are never copied into
+    # Python buffers, so memory use stays at roughly one segment plus the page cache
+    with open(source_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError("Encrypted file is truncated")
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        return decrypt_stream(BufferReader(mapped), dest, passphrase, workers, progress)
+    finally:
+        try:
+            mapped.close()
+        except BufferError:
+            # A traceback still holds views into the mapping; it is unmapped when they are released
+            pass
@@ -0,0 +1,212 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+FINISHED_STATES = ('succeeded', 'failed', 'cancelled')
+DEFAULT_MAX_QUEUED = 32
+DEFAULT_ABANDON_AFTER = 60
+DEFAULT_RETENTION = 600
+REAPER_INTERVAL = 5
+
+class JobQueueFull(Exception):
+    pass
+
+class JobCancelled(Exception):
+    pass
+
+class Job:
+    """State of one background job. Every update bumps ``version`` and wakes waiters."""
+    
+    def __init__(self, kind, total=None, cleanup=None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = 'queued'
+        self.bytes_done = 0
+        self.bytes_total = total
+        self.result = None
+        self.error = None
+        self.created_at = datetime.utcnow().isoformat()
+        self.started_at = None
+        self.finished_at = None
+        self.version = 0
+        self.last_seen = time.monotonic()
+        self.finished_monotonic = None
+        self.cancel_requested = False
+        self.future = None
+        self._cleanup = cleanup
+        self._changed = threading.Condition()
+    
+    def progress(self, bytes_done):
+        # Progress callback for encrypt_stream/decrypt_stream; cancellation takes effect here
+        if self.cancel_requested:
+            raise JobCancelled("Job cancelled")
+        self._update(bytes_done=bytes_done)
+    
+    def touch(self):
+        self.last_seen = time.monotonic()
+    
+    def wait(self, version, timeout=None):
+        with self._changed:
+            self._changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+    
+    def snapshot(self):
+        with self._changed:
+            progress = None
+            if self.bytes_total:
+                progress = min(1.0, self.bytes_done / self.bytes_total)
+            elif self.status == 'succeeded':
+                progress = 1.0
+            return self.version, {
+                'job_id': self.id,
+                'kind': self.kind,
+                'status': self.status,
+                'progress': progress,
+                'bytes_done': self.bytes_done,
+                'bytes_total': self.bytes_total,
+                'result': self.result,
+                'error': self.error,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at
+            }
+    
+    @property
+    def finished(self):
+        return self.status in FINISHED_STATES
+    
+    def _update(self, **fields):
+        with self._changed:
+            for name, value in fields.items():
+                setattr(self, name, value)
+            self.version += 1
+            self._changed.notify_all()
+    
+    def _finish(self, status, result=None, error=None):
+        with self._changed:
+            if self.finished:
+                return
+            self.finished_monotonic = time.monotonic()
+            self._update(status=status, result=result, error=error, finished_at=datetime.utcnow().isoformat())
+        cleanup, self._cleanup = self._cleanup, None
+        if cleanup is not None:
+            cleanup()
+
+class JobManager:
+    """Runs encrypt/decrypt work on a bounded thread pool.
+
+    At most ``max_workers`` jobs run at once and ``max_queued`` more may wait; beyond that
+    submit() raises JobQueueFull. Unfinished jobs nobody has polled for ``abandon_after``
+    seconds are cancelled, and finished jobs are forgotten after ``retention`` seconds.
+    """
+    
+    def __init__(self, max_workers=None, max_queued=DEFAULT_MAX_QUEUED, abandon_after=DEFAULT_ABANDON_AFTER,
+                 retention=DEFAULT_RETENTION):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queued = max_queued
+        self.abandon_after = abandon_after
+        self.retention = retention
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._reaper = None
+        self._stop = threading.Event()
+        self._pid = None
+        self._closed = False
+    
+    def submit(self, kind, fn, total=None, cleanup=None):
+        # fn(job) returns the job result; cleanup() runs once the job has finished, whatever the outcome
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("JobManager is closed")
+            self._ensure_started()
+            if self._count_unfinished() >= self.max_workers + self.max_queued:
+                raise JobQueueFull("Too many jobs in progress, try again later")
+            job = Job(kind, total, cleanup)
+            self._jobs[job.id] = job
+            job.future = self._executor.submit(self._run, job, fn)
+        return job
+    
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            job.touch()
+        return job
+    
+    def cancel(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return None
+        job.cancel_requested = True
+        # A job still waiting in the queue never runs; a running one stops at its next progress call
+        if job.future is not None and job.future.cancel():
+            job._finish('cancelled', error='Job cancelled')
+        return job
+    
+    def counts(self):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        counts = {}
+        for job in jobs:
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+    
+    def reap(self):
+        now = time.monotonic()
+        with self._lock:
+            jobs = list(self._jobs.values())
+        for job in jobs:
+            if job.finished:
+                if now - job.finished_monotonic > self.retention:
+                    with self._lock:
+                        self._jobs.pop(job.id, None)
+            elif now - job.last_seen > self.abandon_after:
+                self.cancel(job.id)
+    
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            executor = self._executor if self._pid == os.getpid() else None
+            jobs = list(self._jobs.values())
+        self._stop.set()
+        for job in jobs:
+            if not job.finished:
+                self.cancel(job.id)
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+    
+    def _count_unfinished(self):
+        return sum(1 for job in self._jobs.values() if not job.finished)
+    
+    def _ensure_started(self):
+        # Threads do not survive fork, so a forked worker starts its own pool on first use
+        if self._executor is not None and self._pid == os.getpid():
+            return
+        self._jobs = {}
+        self._pid = os.getpid()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='job')
+        self._reaper = threading.Thread(target=self._reap_loop, name='job-reaper', daemon=True)
+        self._reaper.start()
+    
+    def _reap_loop(self):
+        while not self._stop.wait(REAPER_INTERVAL):
+            self.reap()
+    
+    def _run(self, job, fn):
+        try:
+            if job.cancel_requested:
+                raise JobCancelled("Job cancelled")
+            job._update(status='running', started_at=datetime.utcnow().isoformat())
+            result = fn(job)
+        except JobCancelled as e:
+            job._finish('cancelled', error=str(e))
+        except Exception as e:
+            job._finish('failed', error=str(e))
+        else:
+            job._finish('succeeded', result=result)
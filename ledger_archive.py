@@ -0,0 +1,181 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+import zlib
+from datetime import datetime
+
+SEGMENT_MAGIC = b'LSEG'
+SEGMENT_VERSION = 1
+# magic, version, start_index, block_count, frame_blocks, frame_count, first_prev_hash, head_hash,
+# meta offset, meta length, frame table offset, index offset
+SEGMENT_HEADER = struct.Struct('>4sBQIII32s32sQIQQ')
+FRAME_ENTRY = struct.Struct('>QI')
+INDEX_ENTRY = struct.Struct('>16sI')
+DEFAULT_FRAME_BLOCKS = 256
+COMPRESSION_LEVEL = 6
+# Columns with a lookup index in every segment, in on-disk order
+INDEXED_COLUMNS = ('tx_hash', 'file_hash')
+
+def index_key(value):
+    return hashlib.sha256((value or '').encode('utf-8')).digest()[:16]
+
+def write_segment(path, rows, columns, first_prev_hash, frame_blocks=DEFAULT_FRAME_BLOCKS):
+    # Writes rows (tuples in columns order, consecutive block_index) as an immutable segment file.
+    # Rows are stored as zlib-compressed JSON frames of frame_blocks rows; sorted lookup tables for
+    # INDEXED_COLUMNS let a reader find a block without decompressing the whole segment.
+    if not rows:
+        raise ValueError("Cannot write an empty ledger segment")
+    index_column = columns.index('block_index')
+    tx_column = columns.index('tx_hash')
+    start_index = rows[0][index_column]
+    
+    meta = zlib.compress(json.dumps({
+        'columns': list(columns),
+        'created_at': datetime.utcnow().isoformat()
+    }).encode('utf-8'), COMPRESSION_LEVEL)
+    
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(b'\0' * SEGMENT_HEADER.size)
+        meta_offset = f.tell()
+        f.write(meta)
+        
+        frames = []
+        for start in range(0, len(rows), frame_blocks):
+            frame = zlib.compress(json.dumps(rows[start:start + frame_blocks]).encode('utf-8'), COMPRESSION_LEVEL)
+            frames.append((f.tell(), len(frame)))
+            f.write(frame)
+        
+        frame_table_offset = f.tell()
+        f.write(b''.join(FRAME_ENTRY.pack(offset, length) for offset, length in frames))
+        
+        index_offset = f.tell()
+        for column in INDEXED_COLUMNS:
+            position = columns.index(column)
+            entries = sorted((index_key(row[position]), i) for i, row in enumerate(rows))
+            f.write(b''.join(INDEX_ENTRY.pack(key, i) for key, i in entries))
+        
+        f.seek(0)
+        f.write(SEGMENT_HEADER.pack(
+            SEGMENT_MAGIC, SEGMENT_VERSION, start_index, len(rows), frame_blocks, len(frames),
+            bytes.fromhex(first_prev_hash), bytes.fromhex(rows[-1][tx_column]),
+            meta_offset, len(meta), frame_table_offset, index_offset
+        ))
+        f.flush()
+        os.fsync(f.fileno())
+    # The file only appears under its final name once complete
+    os.replace(tmp_path, path)
+    return file_sha256(path)
+
+def file_sha256(path):
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+class LedgerSegment:
+    """Read-only, memory-mapped view of a segment file written by write_segment.
+
+    Only the frames a read touches are decompressed, so the resident cost of an open segment
+    is its header and frame table.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, version, self.start_index, self.block_count, self.frame_blocks, frame_count,
+             first_prev_hash, head_hash, meta_offset, meta_length, frame_table_offset,
+             index_offset) = SEGMENT_HEADER.unpack_from(self._map, 0)
+            if magic != SEGMENT_MAGIC:
+                raise ValueError(f"Not a ledger segment: {path}")
+            if version != SEGMENT_VERSION:
+                raise ValueError(f"Unsupported ledger segment version: {version}")
+            
+            self.end_index = self.start_index + self.block_count - 1
+            self.first_prev_hash = first_prev_hash.hex()
+            self.head_hash = head_hash.hex()
+            meta = json.loads(zlib.decompress(self._map[meta_offset:meta_offset + meta_length]))
+            self.columns = meta['columns']
+            self._frames = [FRAME_ENTRY.unpack_from(self._map, frame_table_offset + i * FRAME_ENTRY.size)
+                            for i in range(frame_count)]
+            self._index_offsets = {
+                column: index_offset + i * self.block_count * INDEX_ENTRY.size
+                for i, column in enumerate(INDEXED_COLUMNS)
+            }
+        except Exception:
+            self._map.close()
+            raise
+    
+    def close(self):
+        self._map.close()
+    
+    def frame_rows(self, number):
+        offset, length = self._frames[number]
+        return json.loads(zlib.decompress(self._map[offset:offset + length]))
+    
+    def rows(self, columns, start=None, end=None, reverse=False, defaults=None):
+        # Rows with block_index in [start, end] as tuples in the requested columns order.
+        # Columns the segment predates are filled from defaults (None otherwise).
+        start = self.start_index if start is None else max(start, self.start_index)
+        end = self.end_index if end is None else min(end, self.end_index)
+        if start > end:
+            return
+        convert = self._converter(columns, defaults)
+        first_frame = (start - self.start_index) // self.frame_blocks
+        last_frame = (end - self.start_index) // self.frame_blocks
+        frames = range(last_frame, first_frame - 1, -1) if reverse else range(first_frame, last_frame + 1)
+        for number in frames:
+            frame_start = self.start_index + number * self.frame_blocks
+            rows = self.frame_rows(number)
+            lower = max(start - frame_start, 0)
+            upper = min(end - frame_start + 1, len(rows))
+            selected = rows[lower:upper]
+            if reverse:
+                selected.reverse()
+            for row in selected:
+                yield convert(row)
+    
+    def rows_at(self, indexes, columns, defaults=None):
+        # Rows for specific block indexes (ascending), decompressing each touched frame once
+        convert = self._converter(columns, defaults)
+        cached_number, cached_rows = None, None
+        for index in sorted(indexes):
+            position = index - self.start_index
+            number = position // self.frame_blocks
+            if number != cached_number:
+                cached_number, cached_rows = number, self.frame_rows(number)
+            yield convert(cached_rows[position - number * self.frame_blocks])
+    
+    def find(self, column, value):
+        # Block indexes whose column (one of INDEXED_COLUMNS) may equal value, ascending.
+        # Keys are truncated hashes, so callers must compare the decoded row.
+        key = index_key(value)
+        offset = self._index_offsets[column]
+        lo, hi = 0, self.block_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if INDEX_ENTRY.unpack_from(self._map, offset + mid * INDEX_ENTRY.size)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        indexes = []
+        while lo < self.block_count:
+            entry_key, position = INDEX_ENTRY.unpack_from(self._map, offset + lo * INDEX_ENTRY.size)
+            if entry_key != key:
+                break
+            indexes.append(self.start_index + position)
+            lo += 1
+        return sorted(indexes)
+    
+    def _converter(self, columns, defaults):
+        if list(columns) == self.columns:
+            return tuple
+        defaults = defaults or {}
+        positions = [self.columns.index(c) if c in self.columns else None for c in columns]
+        fills = [defaults.get(c) for c in columns]
+        return lambda row: tuple(row[p] if p is not None else fill for p, fill in zip(positions, fills))
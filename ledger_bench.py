@@ -0,0 +1,207 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from blockchain import (BLOCK_COLUMNS, HASHED_FIELDS, PHASE_COLUMNS, Blockchain, binary_hashed_values,
+                        check_blocks, encode_block, row_to_block)
+from cipher_bench import summarize
+from crypto_utils import ALGORITHM_IDS
+from ledger_writer import LedgerWriter
+from sharded_ledger import ShardedBlockchain, ShardedLedgerWriter
+
+DEFAULT_BLOCKS = 100000
+DEFAULT_REPEAT = 5
+INSERT_CHUNK = 1000
+DEFAULT_APPEND_THREADS = 16
+DEFAULT_APPEND_BLOCKS = 5000
+# Synthetic blocks cycle through the app's real algorithms so they land in the same aggregates
+SYNTHETIC_ALGORITHMS = tuple(ALGORITHM_IDS)
+
+def legacy_row_to_block(row):
+    # Dict materialization as it was before Block existed, kept here as the baseline
+    block = {
+        'index': row[0],
+        'timestamp': row[1],
+        'prev_hash': row[2],
+        'tx_hash': row[3],
+        'algorithm': row[4],
+        'file_name': row[5],
+        'file_hash': row[6],
+        'ciphertext_path': row[7],
+        'nonce_b64': row[8],
+        'tag_b64': row[9],
+        'salt_b64': row[10],
+        'file_size_bytes': row[11],
+        'enc_time_ms': row[12],
+        'dec_time_ms': row[13]
+    }
+    for i, column in enumerate(PHASE_COLUMNS, start=14):
+        block[column] = row[i]
+    return block
+
+def legacy_hash(block):
+    # Hash version 0: sorted-key JSON of HASHED_FIELDS
+    block_data = {field: block[field] for field in HASHED_FIELDS}
+    return hashlib.sha256(json.dumps(block_data, sort_keys=True).encode()).hexdigest()
+
+def binary_hash(block):
+    return hashlib.sha256(encode_block(binary_hashed_values(block))).hexdigest()
+
+def synthetic_entry(i):
+    return {
+        'algorithm': SYNTHETIC_ALGORITHMS[i % len(SYNTHETIC_ALGORITHMS)],
+        'file_name': f'file_{i}.bin',
+        'file_hash': hashlib.sha256(str(i).encode()).hexdigest(),
+        'ciphertext_path': f'storage/encrypted/file_{i}_encrypted.bin.enc',
+        'nonce': os.urandom(12),
+        'tag': os.urandom(16),
+        'salt': os.urandom(16),
+        'file_size_bytes': 1024 * (i % 4096 + 1),
+        'enc_time_ms': 1.0 + i % 97,
+        'dec_time_ms': None
+    }
+
+def build_ledger(path, count, log=None):
+    blockchain = Blockchain(path)
+    for start in range(0, count, INSERT_CHUNK):
+        blockchain.add_blocks([synthetic_entry(i) for i in range(start, min(start + INSERT_CHUNK, count))])
+        if log:
+            log(f'{min(start + INSERT_CHUNK, count)}/{count} blocks')
+    return blockchain
+
+def timed(operation, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        operation()
+        samples.append((time.perf_counter() - start) * 1000)
+    return summarize(samples)
+
+def retained_bytes(operation):
+    tracemalloc.start()
+    try:
+        result = operation()
+        current, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return current
+
+def run_suite(blockchain, repeat):
+    cursor = blockchain.connection().cursor()
+    cursor.execute(f'SELECT {", ".join(BLOCK_COLUMNS)} FROM blocks ORDER BY block_index ASC')
+    rows = cursor.fetchall()
+    legacy_blocks = [legacy_row_to_block(row) for row in rows]
+    blocks = [row_to_block(row) for row in rows]
+    
+    results = {
+        'blocks': len(rows),
+        'materialize_dict': timed(lambda: [legacy_row_to_block(row) for row in rows], repeat),
+        'materialize_block': timed(lambda: [row_to_block(row) for row in rows], repeat),
+        'memory_dict_bytes': retained_bytes(lambda: [legacy_row_to_block(row) for row in rows]),
+        'memory_block_bytes': retained_bytes(lambda: [row_to_block(row) for row in rows]),
+        'hash_json': timed(lambda: [legacy_hash(block) for block in legacy_blocks], repeat),
+        'hash_binary': timed(lambda: [binary_hash(block) for block in blocks], repeat),
+        'verify_chain': timed(lambda: check_blocks(iter(blocks), 0, None), repeat)
+    }
+    results['materialize_speedup'] = results['materialize_dict']['p50_ms'] / results['materialize_block']['p50_ms']
+    results['hash_speedup'] = results['hash_json']['p50_ms'] / results['hash_binary']['p50_ms']
+    return results
+
+def append_throughput(tmpdir, shards, threads, count):
+    # Blocks/s for count appends from threads request-like threads, each waiting for its own block,
+    # through the app's writer for the given shard count (1 = the unsharded ledger)
+    path = os.path.join(tmpdir, f'append-{shards}.db')
+    if shards == 1:
+        writer = LedgerWriter(Blockchain(path))
+    else:
+        writer = ShardedLedgerWriter(ShardedBlockchain(path, shards), anchor_interval=1.0)
+    
+    def work(worker):
+        for i in range(worker, count, threads):
+            writer.append(**synthetic_entry(i))
+    
+    workers = [threading.Thread(target=work, args=(worker,)) for worker in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    writer.close()
+    
+    is_valid, message = writer.blockchain.verify_chain(full=True)
+    if not is_valid:
+        raise RuntimeError(f'{shards}-shard ledger failed verification: {message}')
+    return {'shards': shards, 'threads': threads, 'blocks': count, 'seconds': elapsed,
+            'blocks_per_s': count / elapsed, 'batches': writer.batches_committed}
+
+def print_results(results, out=sys.stdout):
+    count = results['blocks']
+    print(f'{count} blocks', file=out)
+    print(f'{"operation":<20}{"p50 ms":>12}{"p95 ms":>12}{"us/block":>12}', file=out)
+    for name in ('materialize_dict', 'materialize_block', 'hash_json', 'hash_binary', 'verify_chain'):
+        summary = results[name]
+        print(f'{name:<20}{summary["p50_ms"]:>12.1f}{summary["p95_ms"]:>12.1f}'
+              f'{summary["p50_ms"] * 1000 / count:>12.2f}', file=out)
+    print(f'retained memory: dict {results["memory_dict_bytes"] / 1024 / 1024:.1f} MiB, '
+          f'Block {results["memory_block_bytes"] / 1024 / 1024:.1f} MiB', file=out)
+    print(f'speedup: materialize {results["materialize_speedup"]:.1f}x, hash {results["hash_speedup"]:.1f}x',
+          file=out)
+
+def print_append_results(results, out=sys.stdout):
+    print(f'{"shards":>8}{"threads":>10}{"blocks":>10}{"blocks/s":>12}{"batches":>10}', file=out)
+    for result in results:
+        print(f'{result["shards"]:>8}{result["threads"]:>10}{result["blocks"]:>10}'
+              f'{result["blocks_per_s"]:>12.0f}{result["batches"]:>10}', file=out)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Ledger row materialization and block hashing benchmark')
+    parser.add_argument('--blocks', type=int, default=DEFAULT_BLOCKS, help='size of the synthetic ledger')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--db', help='benchmark an existing ledger instead of building a synthetic one')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--append-shards',
+                        help='instead, measure concurrent append throughput for these shard counts, e.g. 1,2,4')
+    parser.add_argument('--append-threads', type=int, default=DEFAULT_APPEND_THREADS)
+    parser.add_argument('--append-blocks', type=int, default=DEFAULT_APPEND_BLOCKS)
+    args = parser.parse_args(argv)
+    if args.repeat < 1:
+        parser.error('--repeat must be at least 1')
+    
+    if args.append_shards:
+        shard_counts = [int(count) for count in args.append_shards.split(',')]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            results = [append_throughput(tmpdir, shards, args.append_threads, args.append_blocks)
+                       for shards in shard_counts]
+        print_append_results(results)
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=2)
+        return 0
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        if args.db:
+            blockchain = Blockchain(args.db)
+        else:
+            blockchain = build_ledger(os.path.join(tmpdir, 'ledger.db'), args.blocks,
+                                      log=lambda message: print(f'building {message}', file=sys.stderr))
+        try:
+            results = run_suite(blockchain, args.repeat)
+        finally:
+            blockchain.close()
+    print_results(results)
+    
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,168 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_FLUSH_INTERVAL = 0.002
+
+class LedgerWriter:
+    """Background group-commit writer for a Blockchain.
+
+    Request threads submit block entries and get a Future for the tx_hash. A single writer
+    thread chains and hashes them in submission order and commits up to ``batch_size`` entries
+    per transaction, waiting at most ``flush_interval`` seconds for a batch to fill.
+    """
+    
+    def __init__(self, blockchain, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        if batch_size < 1:
+            raise ValueError(f"Invalid batch size: {batch_size}")
+        
+        self.blockchain = blockchain
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.batches_committed = 0
+        self.blocks_committed = 0
+        self.archive_error = None
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+    
+    def submit(self, **entry):
+        return self.submit_many([entry])[0]
+    
+    def submit_many(self, entries):
+        # One Future per entry, in order. The entries are queued together, so they are committed
+        # contiguously with nothing from other threads in between.
+        futures = [Future() for _ in entries]
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("LedgerWriter is closed")
+            self._ensure_started()
+            start_time = time.perf_counter()
+            for entry, future in zip(entries, futures):
+                self._queue.put((entry, start_time, future))
+        return futures
+    
+    def append(self, timeout=None, **entry):
+        return self.submit(**entry).result(timeout)
+    
+    def flush(self, timeout=None):
+        # Resolves once every entry submitted before the call has been committed
+        with self._lock:
+            if self._thread is None or self._pid != os.getpid():
+                return
+            marker = Future()
+            self._queue.put((None, None, marker))
+        marker.result(timeout)
+    
+    def close(self, timeout=None):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread if self._pid == os.getpid() else None
+            if thread is not None:
+                self._queue.put(None)
+        if thread is not None:
+            thread.join(timeout)
+    
+    @property
+    def pending(self):
+        return self._queue.qsize()
+    
+    def _ensure_started(self):
+        # Threads do not survive fork, so a forked worker starts its own writer on first use
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        self._queue = queue.Queue()
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='ledger-writer', daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            
+            batch = []
+            markers = []
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item[0] is None:
+                    markers.append(item[2])
+                    # A flush marker ends the batch so the caller is not kept waiting
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = self._queue.get(timeout=timeout)
+                    except queue.Empty:
+                        break
+                if item is None:
+                    stopping = True
+                    break
+            
+            if batch:
+                self._commit(batch)
+                self._archive()
+            for marker in markers:
+                marker.set_result(None)
+        
+        # Drain anything submitted before close() so no caller is left waiting
+        remaining = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                continue
+            if item[0] is None:
+                item[2].set_result(None)
+            else:
+                remaining.append(item)
+        for start in range(0, len(remaining), self.batch_size):
+            self._commit(remaining[start:start + self.batch_size])
+    
+    def _commit(self, batch):
+        entries = [entry for entry, _, _ in batch]
+        start_times = [start_time for _, start_time, _ in batch]
+        try:
+            tx_hashes = self.blockchain.add_blocks(entries, start_times)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][2].set_exception(e)
+                return
+            # Retry one by one so a single bad entry does not fail the whole batch
+            for item in batch:
+                self._commit([item])
+            return
+        
+        self.batches_committed += 1
+        self.blocks_committed += len(batch)
+        for (_, _, future), tx_hash in zip(batch, tx_hashes):
+            future.set_result(tx_hash)
+    
+    def _archive(self):
+        # Archival runs on the writer thread between batches, so it never races an append
+        if self.blockchain.hot_blocks is None:
+            return
+        try:
+            self.blockchain.archive_blocks()
+            self.archive_error = None
+        except Exception as e:
+            self.archive_error = str(e)
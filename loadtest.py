@@ -0,0 +1,428 @@
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from urllib.parse import urlencode, urlsplit
+
+from cipher_bench import format_size, parse_size, summarize
+
+DEFAULT_MIX = 'encrypt=4,decrypt=3,ledger=2,verify=1,stats=1,chart=1,analytics=1'
+DEFAULT_SIZES = '1K=40,64K=30,1M=20,8M=10'
+DEFAULT_ALGORITHMS = 'AES-256-GCM,Blowfish-256-EAX,ChaCha20-Poly1305'
+DEFAULT_CONCURRENCY = 8
+DEFAULT_REQUESTS = 200
+DEFAULT_TIMEOUT = 120
+DEFAULT_PASSPHRASE = 'loadtest-passphrase'
+SERVER_START_TIMEOUT = 30
+# How long to wait for the asynchronous ledger writer to catch up before counting blocks
+LEDGER_SETTLE_TIMEOUT = 30
+LEDGER_PAGE_SIZE = 1000
+
+# Operation name -> route label used in the report
+ROUTES = {
+    'encrypt': 'POST /api/encrypt',
+    'decrypt': 'POST /api/decrypt',
+    'ledger': 'GET /api/ledger',
+    'verify': 'GET /api/verify',
+    'stats': 'GET /api/benchmark/stats',
+    'chart': 'GET /api/benchmark/chart',
+    'analytics': 'GET /api/benchmark/analytics'
+}
+
+def parse_weights(text, parse_key=str):
+    # 'a=3,b=1' -> [(a, 3.0), (b, 1.0)]
+    weights = []
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        key, _, weight = item.partition('=')
+        weight = float(weight) if weight else 1.0
+        if weight < 0:
+            raise ValueError(f'negative weight: {item}')
+        weights.append((parse_key(key.strip()), weight))
+    if not weights or sum(weight for _, weight in weights) <= 0:
+        raise ValueError(f'no positive weights in {text!r}')
+    return weights
+
+def multipart_body(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode())
+        parts.append(data)
+        parts.append(b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+class Client:
+    """Keep-alive HTTP connection, reopened after a failed request."""
+    
+    def __init__(self, host, port, timeout=DEFAULT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._connection = None
+    
+    def request(self, method, path, body=None, content_type=None):
+        # Returns (status, body bytes); the body is read in full so latency covers the whole response
+        if self._connection is None:
+            self._connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        headers = {'Content-Type': content_type} if content_type else {}
+        try:
+            self._connection.request(method, path, body=body, headers=headers)
+            response = self._connection.getresponse()
+            return response.status, response.read()
+        except Exception:
+            self.close()
+            raise
+    
+    def json(self, method, path, body=None, content_type=None):
+        status, data = self.request(method, path, body, content_type)
+        return status, json.loads(data) if data else None
+    
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+class RouteStats:
+    def __init__(self):
+        self.latencies_ms = []
+        self.errors = Counter()
+        self.bytes = 0
+        self._lock = threading.Lock()
+    
+    def record(self, elapsed_ms, error=None, size=0):
+        with self._lock:
+            self.latencies_ms.append(elapsed_ms)
+            if error is not None:
+                self.errors[error] += 1
+            else:
+                self.bytes += size
+    
+    def report(self, elapsed_s):
+        count = len(self.latencies_ms)
+        errors = sum(self.errors.values())
+        result = {'requests': count, 'errors': errors, 'error_rate': errors / count if count else 0.0,
+                  'requests_per_s': count / elapsed_s if elapsed_s > 0 else None,
+                  'mb_per_s': self.bytes / (1024 * 1024) / elapsed_s if self.bytes and elapsed_s > 0 else None,
+                  'error_kinds': dict(self.errors)}
+        if count:
+            result.update(summarize(self.latencies_ms))
+        return result
+
+class LoadTest:
+    """Drives the API from ``concurrency`` threads with a seeded, weighted request mix.
+
+    Every encrypted file gets a name starting with ``prefix`` so the ledger check afterwards
+    can account for each successful upload. Decrypt requests upload ciphertexts prepared
+    before the run, one per payload size.
+    """
+    
+    def __init__(self, host, port, mix, sizes, algorithms, passphrase=DEFAULT_PASSPHRASE, seed=1,
+                 timeout=DEFAULT_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.mix = mix
+        self.sizes = sizes
+        self.algorithms = algorithms
+        self.passphrase = passphrase
+        self.seed = seed
+        self.timeout = timeout
+        self.prefix = f'lt-{uuid.uuid4().hex[:8]}-'
+        self.stats = {operation: RouteStats() for operation, _ in mix}
+        self.encrypted_names = set()
+        self.ciphertexts = {}
+        self._payload = os.urandom(max(size for size, _ in sizes))
+        self._lock = threading.Lock()
+    
+    def client(self):
+        return Client(self.host, self.port, self.timeout)
+    
+    def prepare(self):
+        # One ciphertext per payload size for the decrypt requests to upload
+        client = self.client()
+        try:
+            for size, _ in self.sizes:
+                name = f'{self.prefix}seed-{size}.bin'
+                status, result = self.encrypt(client, name, size, self.algorithms[0])
+                if status != 200:
+                    raise RuntimeError(f'seeding a {format_size(size)} ciphertext failed: {status} {result}')
+                status, data = client.request('GET', f"/api/download/{result['encrypted_filename']}")
+                if status != 200:
+                    raise RuntimeError(f'downloading the {format_size(size)} ciphertext failed: {status}')
+                self.ciphertexts[size] = (result['encrypted_filename'], data)
+        finally:
+            client.close()
+    
+    def encrypt(self, client, name, size, algorithm):
+        body, content_type = multipart_body({'passphrase': self.passphrase, 'algorithm': algorithm},
+                                            {'file': (name, self._payload[:size])})
+        status, result = client.json('POST', '/api/encrypt', body, content_type)
+        if status == 200 and result.get('success'):
+            with self._lock:
+                self.encrypted_names.add(name)
+        return status, result
+    
+    def run(self, concurrency, requests=None, duration=None):
+        # Either requests in total (split across workers) or as many as fit in duration seconds
+        deadline = time.perf_counter() + duration if duration else None
+        workers = []
+        start = time.perf_counter()
+        for worker in range(concurrency):
+            count = None if deadline else requests // concurrency + (worker < requests % concurrency)
+            thread = threading.Thread(target=self._worker, args=(worker, count, deadline), daemon=True)
+            thread.start()
+            workers.append(thread)
+        for thread in workers:
+            thread.join()
+        return time.perf_counter() - start
+    
+    def _worker(self, worker, count, deadline):
+        rng = random.Random(self.seed * 1000003 + worker)
+        operations, operation_weights = zip(*self.mix)
+        sizes, size_weights = zip(*self.sizes)
+        client = self.client()
+        sequence = 0
+        try:
+            while (deadline is None and sequence < count) or (deadline is not None and time.perf_counter() < deadline):
+                operation = rng.choices(operations, operation_weights)[0]
+                size = rng.choices(sizes, size_weights)[0]
+                algorithm = rng.choice(self.algorithms)
+                self._request(client, operation, f'{self.prefix}{worker}-{sequence}.bin', size, algorithm)
+                sequence += 1
+        finally:
+            client.close()
+    
+    def _request(self, client, operation, name, size, algorithm):
+        moved = 0
+        start = time.perf_counter()
+        try:
+            if operation == 'encrypt':
+                status, _ = self.encrypt(client, name, size, algorithm)
+                moved = size
+            elif operation == 'decrypt':
+                filename, data = self.ciphertexts[size]
+                body, content_type = multipart_body({'passphrase': self.passphrase}, {'file': (filename, data)})
+                status, _ = client.request('POST', '/api/decrypt', body, content_type)
+                moved = size
+            elif operation == 'ledger':
+                status, _ = client.request('GET', '/api/ledger?limit=50')
+            elif operation == 'verify':
+                status, _ = client.request('GET', '/api/verify')
+            elif operation == 'stats':
+                status, _ = client.request('GET', '/api/benchmark/stats')
+            elif operation == 'chart':
+                status, _ = client.request('GET', '/api/benchmark/chart?format=png')
+                # No data yet is a valid answer for the chart
+                status = 200 if status == 404 else status
+            else:
+                status, _ = client.request('GET', '/api/benchmark/analytics')
+            error = None if status < 400 else f'HTTP {status}'
+        except Exception as e:
+            error = type(e).__name__
+        self.stats[operation].record((time.perf_counter() - start) * 1000, error, moved)
+    
+    def check_ledger(self, settle_timeout=LEDGER_SETTLE_TIMEOUT):
+        # Every successful encrypt must appear in the ledger exactly once with a unique block_index,
+        # and a full audit must find the chain intact (no gaps or forks in block_index)
+        client = self.client()
+        try:
+            deadline = time.monotonic() + settle_timeout
+            while True:
+                blocks = self._run_blocks(client)
+                names = Counter(block['file_name'] for block in blocks)
+                missing = self.encrypted_names - set(names)
+                if not missing or time.monotonic() >= deadline:
+                    break
+                time.sleep(0.2)
+            
+            # block_index restarts in every shard of a sharded ledger
+            indexes = Counter((block.get('shard'), block['index']) for block in blocks)
+            status, audit = client.json('GET', '/api/verify?mode=full')
+        finally:
+            client.close()
+        
+        audit_valid = status == 200 and bool(audit.get('is_valid'))
+        duplicates = sorted(name for name, count in names.items() if count > 1)
+        duplicate_indexes = sorted(index for index, count in indexes.items() if count > 1)
+        unexpected = sorted(set(names) - self.encrypted_names)
+        return {
+            'ok': audit_valid and not missing and not duplicates and not duplicate_indexes and not unexpected,
+            'expected_blocks': len(self.encrypted_names),
+            'found_blocks': len(blocks),
+            'missing': sorted(missing),
+            'duplicates': duplicates,
+            'duplicate_indexes': duplicate_indexes,
+            'unexpected': unexpected,
+            'audit': audit if status == 200 else {'status': status, 'body': audit}
+        }
+    
+    def _run_blocks(self, client):
+        blocks, cursor = [], None
+        while True:
+            params = {'order': 'asc', 'limit': LEDGER_PAGE_SIZE, 'file_name': self.prefix}
+            if cursor is not None:
+                params['cursor'] = cursor
+            status, page = client.json('GET', f'/api/ledger?{urlencode(params)}')
+            if status != 200:
+                raise RuntimeError(f'reading the ledger failed: {status} {page}')
+            blocks.extend(page['blocks'])
+            cursor = page.get('next_cursor')
+            if cursor is None:
+                return blocks
+    
+    def report(self, elapsed_s):
+        return {route: self.stats[operation].report(elapsed_s) for operation, route in ROUTES.items()
+                if operation in self.stats}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(workdir, port):
+    # The app runs in its own process (and working directory, so it gets a fresh ledger and storage)
+    # to keep the load generator's threads from competing with it for the GIL
+    log = open(os.path.join(workdir, 'server.log'), 'wb')
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', str(port)],
+                               cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+    log.close()
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    client = Client('127.0.0.1', port, timeout=5)
+    try:
+        while True:
+            if process.poll() is not None:
+                raise RuntimeError(f'server exited with status {process.returncode}; see {workdir}/server.log')
+            try:
+                if client.request('GET', '/api/ledger?limit=1')[0] == 200:
+                    return process
+            except OSError:
+                pass
+            if time.monotonic() >= deadline:
+                process.terminate()
+                raise RuntimeError('server did not start in time')
+            time.sleep(0.2)
+    finally:
+        client.close()
+
+def serve(port):
+    from werkzeug.serving import make_server
+    from app import app
+    make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+
+def print_report(report, out=sys.stdout):
+    print(f"{'route':<30} {'reqs':>6} {'err %':>6} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+          f"{'MB/s':>8}", file=out)
+    for route, result in report['routes'].items():
+        if not result['requests']:
+            continue
+        mb_per_s = result['mb_per_s']
+        print(f"{route:<30} {result['requests']:>6} {result['error_rate'] * 100:>6.1f} "
+              f"{result['requests_per_s']:>8.1f} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} "
+              f"{result['p99_ms']:>9.1f} {(f'{mb_per_s:.1f}' if mb_per_s else '-'):>8}", file=out)
+        for kind, count in result['error_kinds'].items():
+            print(f"    {count} x {kind}", file=out)
+    
+    ledger = report['ledger']
+    status = 'ok' if ledger['ok'] else 'FAILED'
+    print(f"ledger {status}: {ledger['found_blocks']}/{ledger['expected_blocks']} blocks, "
+          f"{len(ledger['missing'])} missing, {len(ledger['duplicates'])} duplicated, "
+          f"{len(ledger['duplicate_indexes'])} duplicate block_index, audit: {ledger['audit'].get('message')}",
+          file=out)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Concurrent load test for the Flask API')
+    parser.add_argument('--url', help='test an already running server instead of starting one')
+    parser.add_argument('--workdir', help='working directory for the started server (default: a temporary one)')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY)
+    parser.add_argument('--requests', type=int, default=DEFAULT_REQUESTS, help='total requests to send')
+    parser.add_argument('--duration', type=float, help='send requests for this many seconds instead')
+    parser.add_argument('--mix', default=DEFAULT_MIX,
+                        help=f'weighted request mix over {", ".join(ROUTES)} (default {DEFAULT_MIX})')
+    parser.add_argument('--sizes', default=DEFAULT_SIZES,
+                        help=f'weighted payload sizes for encrypt/decrypt (default {DEFAULT_SIZES})')
+    parser.add_argument('--algorithms', default=DEFAULT_ALGORITHMS, help='algorithms encrypt requests pick from')
+    parser.add_argument('--passphrase', default=DEFAULT_PASSPHRASE)
+    parser.add_argument('--seed', type=int, default=1, help='seed for the request sequence')
+    parser.add_argument('--timeout', type=float, default=DEFAULT_TIMEOUT, help='per-request timeout in seconds')
+    parser.add_argument('--max-error-rate', type=float,
+                        help='exit with status 1 when any route exceeds this error rate (0-1)')
+    parser.add_argument('--output', help='write the report as JSON to this file')
+    parser.add_argument('--serve', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    
+    if args.serve:
+        serve(args.serve)
+        return 0
+    
+    try:
+        mix = parse_weights(args.mix)
+        sizes = parse_weights(args.sizes, parse_size)
+    except ValueError as e:
+        parser.error(str(e))
+    unknown = [operation for operation, _ in mix if operation not in ROUTES]
+    if unknown:
+        parser.error(f'unknown operations in --mix: {", ".join(unknown)}')
+    if args.concurrency < 1:
+        parser.error('--concurrency must be at least 1')
+    if args.duration is None and args.requests < 1:
+        parser.error('--requests must be at least 1')
+    algorithms = [a.strip() for a in args.algorithms.split(',') if a.strip()]
+    
+    process = None
+    workdir = None
+    if args.url:
+        url = urlsplit(args.url)
+        host, port = url.hostname, url.port or 80
+    else:
+        workdir = args.workdir or tempfile.mkdtemp(prefix='loadtest-')
+        host, port = '127.0.0.1', free_port()
+        process = start_server(workdir, port)
+    
+    try:
+        test = LoadTest(host, port, mix, sizes, algorithms, args.passphrase, args.seed, args.timeout)
+        test.prepare()
+        log = lambda message: print(message, file=sys.stderr)
+        log(f'running {args.duration:g}s' if args.duration else f'running {args.requests} requests')
+        elapsed = test.run(args.concurrency, args.requests, args.duration)
+        log('checking ledger integrity')
+        report = {
+            'config': {'concurrency': args.concurrency, 'requests': args.requests, 'duration': args.duration,
+                       'mix': args.mix, 'sizes': args.sizes, 'algorithms': algorithms, 'seed': args.seed},
+            'elapsed_s': elapsed,
+            'routes': test.report(elapsed),
+            'ledger': test.check_ledger()
+        }
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+            if not args.workdir:
+                shutil.rmtree(workdir, ignore_errors=True)
+    
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    
+    if not report['ledger']['ok']:
+        return 1
+    if args.max_error_rate is not None and any(r['error_rate'] > args.max_error_rate
+                                               for r in report['routes'].values()):
+        return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
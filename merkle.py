@@ -0,0 +1,129 @@
+import argparse
+import hashlib
+import json
+import sys
+
+# Domain separation keeps a leaf from ever being confused with an interior node
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+GENESIS_BATCH_HASH = '0' * 64
+
+def merkle_leaf(tx_hash):
+    return hashlib.sha256(LEAF_PREFIX + bytes.fromhex(tx_hash)).digest()
+
+def merkle_node(left, right):
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+def merkle_levels(tx_hashes):
+    # Every level of the tree, leaves first. An unpaired last node is carried up unchanged.
+    if not tx_hashes:
+        raise ValueError("Cannot build a Merkle tree without leaves")
+    levels = [[merkle_leaf(tx_hash) for tx_hash in tx_hashes]]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        parent = [merkle_node(level[i], level[i + 1]) for i in range(0, len(level) - 1, 2)]
+        if len(level) % 2:
+            parent.append(level[-1])
+        levels.append(parent)
+    return levels
+
+def merkle_root(tx_hashes):
+    return merkle_levels(tx_hashes)[-1][0].hex()
+
+def merkle_path(tx_hashes, position):
+    # Audit path for the leaf at position: [{'side': 'left'|'right', 'hash': hex}], leaf to root
+    levels = merkle_levels(tx_hashes)
+    if not 0 <= position < len(tx_hashes):
+        raise ValueError(f"Leaf position out of range: {position}")
+    path = []
+    for level in levels[:-1]:
+        sibling = position ^ 1
+        if sibling < len(level):
+            path.append({'side': 'left' if sibling < position else 'right', 'hash': level[sibling].hex()})
+        position //= 2
+    return path
+
+def merkle_path_sides(leaf_count, position):
+    # The sibling sides an audit path for position must have in a tree of leaf_count leaves; they
+    # pin the path to that one leaf
+    if not 0 <= position < leaf_count:
+        raise ValueError(f"Leaf position out of range: {position}")
+    sides = []
+    while leaf_count > 1:
+        sibling = position ^ 1
+        if sibling < leaf_count:
+            sides.append('left' if sibling < position else 'right')
+        position //= 2
+        leaf_count = (leaf_count + 1) // 2
+    return sides
+
+def root_from_path(tx_hash, path):
+    node = merkle_leaf(tx_hash)
+    for step in path:
+        sibling = bytes.fromhex(step['hash'])
+        if step['side'] == 'left':
+            node = merkle_node(sibling, node)
+        elif step['side'] == 'right':
+            node = merkle_node(node, sibling)
+        else:
+            raise ValueError(f"Invalid path side: {step['side']}")
+    return node.hex()
+
+def compute_batch_hash(batch_number, start_index, end_index, root, prev_batch_hash):
+    data = f"{batch_number}:{start_index}:{end_index}:{root}:{prev_batch_hash}".encode()
+    return hashlib.sha256(data).hexdigest()
+
+def verify_proof(proof, trusted_batch_hash=None):
+    # Checks a proof from /api/proof without touching the ledger. Returns (is_valid, message).
+    try:
+        batch = proof['batch']
+        if not batch['start_index'] <= proof['block_index'] <= batch['end_index']:
+            return False, "Block index lies outside the batch"
+        # A valid path for one leaf must not pass as proof for another index
+        leaf_count = batch['end_index'] - batch['start_index'] + 1
+        expected_sides = merkle_path_sides(leaf_count, proof['block_index'] - batch['start_index'])
+        if [step['side'] for step in proof['path']] != expected_sides:
+            return False, "Audit path does not match the block's position in the batch"
+        root = root_from_path(proof['tx_hash'], proof['path'])
+        if root != batch['merkle_root']:
+            return False, "Audit path does not lead to the batch Merkle root"
+        if 'block' in proof:
+            # The record itself is optional; when present it must hash to the proven tx_hash
+            from blockchain import block_hash_matches
+            if (proof['block']['tx_hash'] != proof['tx_hash'] or proof['block']['index'] != proof['block_index']
+                    or not block_hash_matches(proof['block'])):
+                return False, "Block record does not match its tx_hash"
+        
+        if not batch.get('sealed'):
+            # The server computed this root for the same request, so it proves nothing yet
+            return False, "Pending: the batch is not sealed, so its provisional root is not anchored to the chain"
+        
+        batch_hash = compute_batch_hash(batch['batch_number'], batch['start_index'], batch['end_index'],
+                                        batch['merkle_root'], batch['prev_batch_hash'])
+        if batch_hash != batch['batch_hash']:
+            return False, "Batch header does not match its batch hash"
+        if trusted_batch_hash is not None and batch_hash != trusted_batch_hash:
+            return False, "Batch hash does not match the trusted value"
+        return True, f"Block {proof['block_index']} is included in batch {batch['batch_number']}"
+    except (KeyError, TypeError, ValueError) as e:
+        return False, f"Malformed proof: {e}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Verify a ledger inclusion proof offline')
+    parser.add_argument('proof', help='proof JSON as returned by /api/proof/<tx_hash> ("-" for stdin)')
+    parser.add_argument('--batch-hash', help='trusted batch hash to anchor the proof to')
+    args = parser.parse_args(argv)
+    
+    if args.proof == '-':
+        proof = json.load(sys.stdin)
+    else:
+        with open(args.proof) as f:
+            proof = json.load(f)
+    proof = proof.get('proof', proof)
+    
+    is_valid, message = verify_proof(proof, args.batch_hash)
+    print(f"{'VALID' if is_valid else 'INVALID'}: {message}")
+    return 0 if is_valid else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,185 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Seconds; covers sub-millisecond cache hits up to minute-long uploads
+DEFAULT_LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Bytes per second, doubling from 1 MiB/s to 4 GiB/s
+THROUGHPUT_BUCKETS = tuple(float(2 ** (20 + i)) for i in range(13))
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if value == -math.inf:
+        return '-Inf'
+    if value != value:
+        return 'NaN'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in zip(names, values)) + '}'
+
+class Metric:
+    kind = 'untyped'
+    
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+    
+    def _key(self, labels):
+        if len(labels) != len(self.label_names) or any(name not in labels for name in self.label_names):
+            raise ValueError(f"{self.name} expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+    
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+    
+    def samples(self):
+        return []
+
+class Counter(Metric):
+    kind = 'counter'
+    
+    def __init__(self, name, help, labels=()):
+        super().__init__(name, help, labels)
+        self._values = {}
+    
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("Counters can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{format_labels(self.label_names, key)} {format_value(value)}' for key, value in values]
+
+class Gauge(Metric):
+    """Gauge set directly, or read from ``callback`` at scrape time.
+
+    A callback returns a number for an unlabelled gauge, or a dict mapping label value tuples to
+    numbers.
+    """
+    kind = 'gauge'
+    
+    def __init__(self, name, help, labels=(), callback=None):
+        super().__init__(name, help, labels)
+        self._values = {}
+        self.callback = callback
+    
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+    
+    def samples(self):
+        if self.callback is not None:
+            values = self.callback()
+            values = values if isinstance(values, dict) else {(): values}
+            values = sorted((tuple(str(v) for v in key), value) for key, value in values.items())
+        else:
+            with self._lock:
+                values = sorted(self._values.items())
+        return [f'{self.name}{format_labels(self.label_names, key)} {format_value(value)}' for key, value in values]
+
+class Histogram(Metric):
+    kind = 'histogram'
+    
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self._series = {}
+    
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+    
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+    
+    def samples(self):
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        lines = []
+        for key, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), values):
+                cumulative += count
+                labels = format_labels(self.label_names + ('le',), key + (format_value(bound),))
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = format_labels(self.label_names, key)
+            lines.append(f'{self.name}_sum{labels} {format_value(values[-1])}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+class Registry:
+    """In-process metric registry rendered in the Prometheus text exposition format.
+
+    Registering a name again returns the existing metric, so modules can declare their metrics at
+    import time. Each process keeps its own registry.
+    """
+    
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+    
+    def register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is None:
+                self._metrics[metric.name] = metric
+                return metric
+        if type(existing) is not type(metric) or existing.label_names != metric.label_names:
+            raise ValueError(f"Metric {metric.name} is already registered with a different type or labels")
+        return existing
+    
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+    
+    def gauge(self, name, help, labels=(), callback=None):
+        gauge = self.register(Gauge(name, help, labels, callback))
+        if callback is not None:
+            gauge.callback = callback
+        return gauge
+    
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+    
+    def render(self):
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+REGISTRY = Registry()
+counter = REGISTRY.counter
+gauge = REGISTRY.gauge
+histogram = REGISTRY.histogram
@@ -0,0 +1,608 @@
+import hashlib
+import heapq
+import os
+import threading
+from collections import namedtuple
+from datetime import datetime
+from itertools import chain, zip_longest
+
+import metrics
+from blockchain import (BLOCK_FIELDS, DEFAULT_PAGE_SIZE, DEFAULT_SEGMENT_BLOCKS, GENESIS_PREV_HASH, MAX_PAGE_SIZE,
+                        VERIFY_RANGE_SIZE, Block, Blockchain, LedgerDatabase, aggregate_merge, new_aggregate)
+from ledger_writer import DEFAULT_BATCH_SIZE, DEFAULT_FLUSH_INTERVAL, LedgerWriter
+
+SHARD_KEYS = ('file_hash', 'algorithm')
+DEFAULT_SHARD_KEY = 'file_hash'
+DEFAULT_ANCHOR_INTERVAL = 5.0
+GENESIS_ANCHOR_HASH = '0' * 64
+# Head recorded for a shard that has no blocks yet
+EMPTY_HEAD = (-1, GENESIS_PREV_HASH)
+
+LEDGER_ANCHORS = metrics.counter('encdec_ledger_anchors_total', 'Anchor blocks added to the root chain')
+
+def compute_anchor_hash(anchor_index, timestamp, prev_hash, heads):
+    # heads: (block_index, tx_hash) of every shard, in shard order
+    shard_heads = ';'.join(f"{block_index}:{tx_hash}" for block_index, tx_hash in heads)
+    data = f"{anchor_index}:{timestamp}:{prev_hash}:{shard_heads}".encode()
+    return hashlib.sha256(data).hexdigest()
+
+def shard_number(value, shards):
+    # Stable across processes and restarts, unlike hash()
+    return int.from_bytes(hashlib.sha256(str(value).encode()).digest()[:8], 'big') % shards
+
+class ShardBlock(namedtuple('ShardBlockRecord', BLOCK_FIELDS + ['shard']), Block):
+    """Block read from one shard of a ShardedBlockchain.
+
+    ``shard`` is a trailing tuple field, so instances stay as compact as Block; the Block fields
+    keep their positions and it is included in to_dict().
+    """
+    __slots__ = ()
+    
+    def __getitem__(self, key):
+        if key == 'shard':
+            return self.shard
+        return super().__getitem__(key)
+    
+    def get(self, key, default=None):
+        return self.shard if key == 'shard' else super().get(key, default)
+    
+    def to_dict(self):
+        return {**super().to_dict(), 'shard': self.shard}
+
+def shard_block(block, shard):
+    return tuple.__new__(ShardBlock, (*block, shard))
+
+def block_order(block):
+    # Interleaving order across shards; within a shard this follows block_index
+    return block.timestamp, block.shard, block.index
+
+class AnchorChain(LedgerDatabase):
+    """Root hash chain of a sharded ledger. Each anchor commits the head block of every shard."""
+    
+    def __init__(self, db_path):
+        super().__init__(db_path)
+        self.connection().execute('PRAGMA journal_mode = WAL')
+        with self.transaction() as cursor:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS anchors (
+                    anchor_index INTEGER PRIMARY KEY,
+                    timestamp TEXT,
+                    prev_hash TEXT,
+                    anchor_hash TEXT
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS anchor_heads (
+                    anchor_index INTEGER,
+                    shard INTEGER,
+                    block_index INTEGER,
+                    tx_hash TEXT,
+                    PRIMARY KEY (anchor_index, shard)
+                )
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_anchor_heads_block ON anchor_heads (shard, block_index)')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS ledger_state (
+                    key TEXT PRIMARY KEY,
+                    value TEXT
+                )
+            ''')
+    
+    def _get_state(self, cursor, key):
+        cursor.execute('SELECT value FROM ledger_state WHERE key = ?', (key,))
+        row = cursor.fetchone()
+        return row[0] if row else None
+    
+    def check_layout(self, shards, shard_key):
+        # The layout is fixed when the ledger is created, since routing and every anchor depend on it
+        with self.transaction() as cursor:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'blocks'")
+            if cursor.fetchone():
+                cursor.execute('SELECT COUNT(*) FROM blocks')
+                if cursor.fetchone()[0]:
+                    raise ValueError(f"{self.db_path} holds an unsharded ledger; open it with Blockchain instead")
+            
+            layout = (self._get_state(cursor, 'shards'), self._get_state(cursor, 'shard_key'))
+            if layout == (None, None):
+                cursor.executemany('INSERT INTO ledger_state (key, value) VALUES (?, ?)',
+                                   [('shards', str(shards)), ('shard_key', shard_key)])
+            elif layout != (str(shards), shard_key):
+                raise ValueError(f"{self.db_path} was created with {layout[0]} shards keyed by {layout[1]}, "
+                                 f"not {shards} keyed by {shard_key}")
+    
+    def append(self, read_heads):
+        # read_heads() runs under the root write lock, so anchors written by concurrent processes still see
+        # the heads in order. Returns the new anchor, or None when the heads are unchanged since the last one.
+        with self.transaction() as cursor:
+            heads = read_heads()
+            last = self._last_anchor(cursor)
+            if last is not None and self._heads(cursor, last[0]) == heads:
+                return None
+            anchor_index, prev_hash = (last[0] + 1, last[1]) if last else (0, GENESIS_ANCHOR_HASH)
+            timestamp = datetime.utcnow().isoformat()
+            anchor_hash = compute_anchor_hash(anchor_index, timestamp, prev_hash, heads)
+            cursor.execute('INSERT INTO anchors (anchor_index, timestamp, prev_hash, anchor_hash) VALUES (?, ?, ?, ?)',
+                           (anchor_index, timestamp, prev_hash, anchor_hash))
+            cursor.executemany('''
+                INSERT INTO anchor_heads (anchor_index, shard, block_index, tx_hash) VALUES (?, ?, ?, ?)
+            ''', [(anchor_index, shard, block_index, tx_hash) for shard, (block_index, tx_hash) in enumerate(heads)])
+        return self._anchor_dict((anchor_index, timestamp, prev_hash, anchor_hash), heads)
+    
+    def _last_anchor(self, cursor):
+        cursor.execute('SELECT anchor_index, anchor_hash FROM anchors ORDER BY anchor_index DESC LIMIT 1')
+        return cursor.fetchone()
+    
+    def _heads(self, cursor, anchor_index):
+        cursor.execute('SELECT block_index, tx_hash FROM anchor_heads WHERE anchor_index = ? ORDER BY shard',
+                       (anchor_index,))
+        return [tuple(row) for row in cursor.fetchall()]
+    
+    def _anchor_dict(self, row, heads):
+        anchor_index, timestamp, prev_hash, anchor_hash = row
+        return {
+            'anchor_index': anchor_index,
+            'timestamp': timestamp,
+            'prev_hash': prev_hash,
+            'anchor_hash': anchor_hash,
+            'heads': [{'shard': shard, 'block_index': block_index, 'tx_hash': tx_hash}
+                      for shard, (block_index, tx_hash) in enumerate(heads)]
+        }
+    
+    def get_anchor(self, anchor_index):
+        with self.snapshot() as cursor:
+            cursor.execute('SELECT anchor_index, timestamp, prev_hash, anchor_hash FROM anchors WHERE anchor_index = ?',
+                           (anchor_index,))
+            row = cursor.fetchone()
+            return None if row is None else self._anchor_dict(row, self._heads(cursor, anchor_index))
+    
+    def get_last_anchor(self):
+        with self.snapshot() as cursor:
+            last = self._last_anchor(cursor)
+        return None if last is None else self.get_anchor(last[0])
+    
+    def covering_anchor(self, shard, block_index):
+        # The first anchor whose head for shard is at or past block_index, or None if it is not anchored yet
+        cursor = self.connection().cursor()
+        cursor.execute('SELECT MIN(anchor_index) FROM anchor_heads WHERE shard = ? AND block_index >= ?',
+                       (shard, block_index))
+        anchor_index = cursor.fetchone()[0]
+        return None if anchor_index is None else self.get_anchor(anchor_index)
+    
+    def get_anchors(self, start=0):
+        # [(anchor_index, timestamp, prev_hash, anchor_hash, heads)] from start on, in order
+        with self.snapshot() as cursor:
+            cursor.execute('''
+                SELECT anchor_index, block_index, tx_hash FROM anchor_heads
+                WHERE anchor_index >= ? ORDER BY anchor_index, shard
+            ''', (start,))
+            heads = {}
+            for anchor_index, block_index, tx_hash in cursor.fetchall():
+                heads.setdefault(anchor_index, []).append((block_index, tx_hash))
+            cursor.execute('''
+                SELECT anchor_index, timestamp, prev_hash, anchor_hash FROM anchors
+                WHERE anchor_index >= ? ORDER BY anchor_index
+            ''', (start,))
+            return [(*row, heads.get(row[0], [])) for row in cursor.fetchall()]
+    
+    def get_verification_checkpoint(self):
+        with self.snapshot() as cursor:
+            index, anchor_hash = self._get_state(cursor, 'verified_anchor'), self._get_state(cursor, 'verified_anchor_hash')
+        return None if index is None or anchor_hash is None else (int(index), anchor_hash)
+    
+    def set_verification_checkpoint(self, anchor_index, anchor_hash):
+        with self.transaction() as cursor:
+            cursor.executemany('INSERT OR REPLACE INTO ledger_state (key, value) VALUES (?, ?)',
+                               [('verified_anchor', str(anchor_index)), ('verified_anchor_hash', anchor_hash)])
+
+class ShardedBlockchain:
+    """Ledger split into independent hash chains, each in its own SQLite database.
+
+    Entries are routed to a shard by ``shard_key`` (the file hash or the algorithm), so appends to
+    different shards never wait on the same write lock or tip. anchor() commits the head block of
+    every shard to a root chain kept in ``db_path``; rewriting a shard after it was anchored breaks
+    the match with its anchors, so the ledger as a whole stays tamper-evident. Shards are stored
+    next to the root as ``<db name>-shard-NN.db``. Block indexes are per shard; blocks read through
+    this class are ShardBlocks carrying their shard number.
+    """
+    
+    def __init__(self, db_path='ledger.db', shards=2, shard_key=DEFAULT_SHARD_KEY, archive_dir=None,
+                 hot_blocks=None, segment_blocks=DEFAULT_SEGMENT_BLOCKS):
+        if shards < 1:
+            raise ValueError(f"Invalid shard count: {shards}")
+        if shard_key not in SHARD_KEYS:
+            raise ValueError(f"Invalid shard key: {shard_key} (expected one of {', '.join(SHARD_KEYS)})")
+        self.db_path = db_path
+        self.shard_key = shard_key
+        self.hot_blocks = hot_blocks
+        self.root = AnchorChain(db_path)
+        self.root.check_layout(shards, shard_key)
+        
+        stem = os.path.splitext(db_path)[0]
+        self.shards = [
+            Blockchain(f"{stem}-shard-{n:02d}.db",
+                       archive_dir=os.path.join(archive_dir, f"shard-{n:02d}") if archive_dir else None,
+                       hot_blocks=hot_blocks, segment_blocks=segment_blocks)
+            for n in range(shards)
+        ]
+        self._anchor_lock = threading.Lock()
+    
+    def close(self):
+        self.root.close()
+        for shard in self.shards:
+            shard.close()
+    
+    def shard_for(self, entry):
+        # Shard number for an entry (a dict of add_block arguments)
+        return shard_number(entry[self.shard_key], len(self.shards))
+    
+    def add_block(self, algorithm, file_name, file_hash, *args, **kwargs):
+        shard = self.shard_for({'algorithm': algorithm, 'file_hash': file_hash})
+        return self.shards[shard].add_block(algorithm, file_name, file_hash, *args, **kwargs)
+    
+    def add_blocks(self, entries, start_times=None):
+        # One transaction per shard, so a failure can leave other shards' entries committed.
+        # ShardedLedgerWriter is the concurrent path; this one appends shard after shard.
+        if start_times is None:
+            start_times = [None] * len(entries)
+        groups = {}
+        for position, entry in enumerate(entries):
+            groups.setdefault(self.shard_for(entry), []).append(position)
+        
+        tx_hashes = [None] * len(entries)
+        for shard, positions in sorted(groups.items()):
+            times = [start_times[p] for p in positions]
+            hashes = self.shards[shard].add_blocks([entries[p] for p in positions],
+                                                   None if None in times else times)
+            for position, tx_hash in zip(positions, hashes):
+                tx_hashes[position] = tx_hash
+        return tx_hashes
+    
+    def update_block_dec_time(self, file_hash, dec_time_ms):
+        if self.shard_key == 'file_hash':
+            shards = [self.shards[shard_number(file_hash, len(self.shards))]]
+        else:
+            shards = self.shards
+        for shard in shards:
+            shard.update_block_dec_time(file_hash, dec_time_ms)
+    
+    def update_block_dec_time_by_tx_hash(self, tx_hash, dec_time_ms):
+        return any(shard.update_block_dec_time_by_tx_hash(tx_hash, dec_time_ms) for shard in self.shards)
+    
+    def get_block(self, tx_hash=None, file_hash=None):
+        # Like Blockchain.get_block; for a file_hash the newest matching block across shards
+        if tx_hash is None and file_hash is None:
+            raise ValueError("tx_hash or file_hash is required")
+        if tx_hash is None and self.shard_key == 'file_hash':
+            candidates = [shard_number(file_hash, len(self.shards))]
+        else:
+            candidates = range(len(self.shards))
+        
+        found = []
+        for n in candidates:
+            block = self.shards[n].get_block(tx_hash=tx_hash, file_hash=file_hash)
+            if block is not None:
+                if tx_hash is not None:
+                    return shard_block(block, n)
+                found.append(shard_block(block, n))
+        return max(found, key=block_order, default=None)
+    
+    def get_last_block(self):
+        # The most recently appended block across all shards
+        tips = [shard_block(block, n) for n, block in enumerate(self._tips()) if block is not None]
+        return max(tips, key=block_order, default=None)
+    
+    def _tips(self):
+        return [shard.get_last_block() for shard in self.shards]
+    
+    def _heads(self):
+        return [EMPTY_HEAD if block is None else (block.index, block.tx_hash) for block in self._tips()]
+    
+    def get_inclusion_proof(self, tx_hash):
+        # The shard's Merkle proof, plus the first anchor that commits the block's shard past it
+        for n, shard in enumerate(self.shards):
+            proof = shard.get_inclusion_proof(tx_hash)
+            if proof is not None:
+                proof['shard'] = n
+                proof['block']['shard'] = n
+                proof['anchor'] = self.root.covering_anchor(n, proof['block_index'])
+                return proof
+        return None
+    
+    def anchor(self):
+        # Commits every shard's current head to the root chain. Returns the new anchor, or None when no
+        # shard has moved since the last one.
+        with self._anchor_lock:
+            anchor = self.root.append(self._heads)
+        if anchor is not None:
+            LEDGER_ANCHORS.inc()
+        return anchor
+    
+    def get_last_anchor(self):
+        return self.root.get_last_anchor()
+    
+    def get_all_blocks(self):
+        return list(heapq.merge(*[[shard_block(block, n) for block in shard.get_all_blocks()]
+                                  for n, shard in enumerate(self.shards)], key=block_order))
+    
+    def get_blocks_page(self, limit=DEFAULT_PAGE_SIZE, cursor=None, order='desc', **filters):
+        # Takes the same filters as Blockchain.get_blocks_page and interleaves the shards by timestamp.
+        # The cursor holds the last block_index returned from each shard, comma-separated (empty for a
+        # shard nothing has been returned from yet).
+        if order not in ('asc', 'desc'):
+            raise ValueError(f"Invalid order: {order}")
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        cursors = self._parse_cursor(cursor)
+        
+        pages = []
+        more = False
+        for n, (shard, shard_cursor) in enumerate(zip(self.shards, cursors)):
+            blocks, next_cursor = shard.get_blocks_page(limit, shard_cursor, order, **filters)
+            pages.append([shard_block(block, n) for block in blocks])
+            more = more or next_cursor is not None
+        
+        merged = list(heapq.merge(*pages, key=block_order, reverse=order == 'desc'))
+        page = merged[:limit]
+        for block in page:
+            cursors[block.shard] = block.index
+        next_cursor = None
+        if more or len(merged) > limit:
+            next_cursor = ','.join('' if index is None else str(index) for index in cursors)
+        return page, next_cursor
+    
+    def _parse_cursor(self, cursor):
+        if cursor is None or cursor == '':
+            return [None] * len(self.shards)
+        parts = str(cursor).split(',')
+        if len(parts) != len(self.shards):
+            raise ValueError(f"Invalid cursor: {cursor}")
+        return [int(part) if part else None for part in parts]
+    
+    def verify_chain(self, full=False):
+        # Verifies each shard chain (incrementally unless full), then the root chain of anchors
+        for n, shard in enumerate(self.shards):
+            is_valid, message = shard.verify_chain(full)
+            if not is_valid:
+                return False, f"Shard {n}: {message}"
+        
+        is_valid, message, _ = self.verify_anchors(full)
+        if not is_valid:
+            return False, message
+        return self._summary(message)
+    
+    def audit_chain(self, workers=None, range_size=VERIFY_RANGE_SIZE, progress=None):
+        # Full audit of every shard in turn (each in a process pool), then of every anchor.
+        # Returns (is_valid, message, first_bad_index); the index is within the shard named in the message.
+        heads = self._heads()
+        total = sum(block_index + 1 for block_index, _ in heads)
+        offset = 0
+        for n, shard in enumerate(self.shards):
+            report = None
+            if progress is not None:
+                report = lambda done, _, offset=offset: progress(offset + done, total)
+            is_valid, message, first_bad_index = shard.audit_chain(workers, range_size, report)
+            if not is_valid:
+                return False, f"Shard {n}: {message}", first_bad_index
+            offset += heads[n][0] + 1
+        
+        is_valid, message, _ = self.verify_anchors(full=True)
+        if not is_valid:
+            return False, message, None
+        return (*self._summary(message), None)
+    
+    def _summary(self, anchor_message):
+        total = sum(block_index + 1 for block_index, _ in self._heads())
+        if total == 0:
+            return True, "Blockchain is empty"
+        last_anchor = self.root.get_last_anchor()
+        anchored = sum(head['block_index'] + 1 for head in last_anchor['heads']) if last_anchor else 0
+        if total > anchored:
+            anchor_message += f", {total - anchored} newer blocks not anchored yet"
+        return True, f"Blockchain is valid ({total} blocks in {len(self.shards)} shards verified, {anchor_message})"
+    
+    def verify_anchors(self, full=False):
+        # Checks the root chain's links and hashes, that no shard head moves backwards, and that each
+        # anchored head is still the block at that index in its shard. Routine runs start from the last
+        # verified anchor, whose heads are re-checked. Returns (is_valid, message, first_bad_anchor).
+        checkpoint = None if full else self.root.get_verification_checkpoint()
+        anchors = self.root.get_anchors(checkpoint[0] if checkpoint else 0)
+        if checkpoint and (not anchors or anchors[0][0] != checkpoint[0] or anchors[0][3] != checkpoint[1]):
+            return False, f"Anchor {checkpoint[0]} no longer matches the verification checkpoint", checkpoint[0]
+        
+        expected_index = checkpoint[0] if checkpoint else 0
+        prev_hash = anchors[0][2] if checkpoint else GENESIS_ANCHOR_HASH
+        prev_heads = None
+        for anchor_index, timestamp, anchor_prev_hash, anchor_hash, heads in anchors:
+            if anchor_index != expected_index:
+                return False, f"Anchor {expected_index} is missing", expected_index
+            if anchor_prev_hash != prev_hash:
+                return False, f"Anchor {anchor_index} has broken chain link", anchor_index
+            if len(heads) != len(self.shards) or compute_anchor_hash(anchor_index, timestamp, anchor_prev_hash,
+                                                                     heads) != anchor_hash:
+                return False, f"Anchor {anchor_index} has invalid anchor hash", anchor_index
+            for n, (block_index, tx_hash) in enumerate(heads):
+                if prev_heads is not None and block_index < prev_heads[n][0]:
+                    return False, f"Anchor {anchor_index} moves shard {n} backwards", anchor_index
+                if not self._head_matches(n, block_index, tx_hash):
+                    return False, f"Shard {n} no longer matches anchor {anchor_index} at block {block_index}", anchor_index
+            prev_hash, prev_heads = anchor_hash, heads
+            expected_index += 1
+        
+        if anchors:
+            self.root.set_verification_checkpoint(anchors[-1][0], anchors[-1][3])
+        return True, f"{expected_index} anchors verified", None
+    
+    def _head_matches(self, shard, block_index, tx_hash):
+        if block_index < 0:
+            return (block_index, tx_hash) == EMPTY_HEAD
+        block = self.shards[shard].get_block(tx_hash=tx_hash)
+        return block is not None and block.index == block_index
+    
+    def archive_blocks(self, keep=None):
+        return sum(shard.archive_blocks(keep) for shard in self.shards)
+    
+    def get_segments(self):
+        return [{**segment, 'shard': n} for n, shard in enumerate(self.shards) for segment in shard.get_segments()]
+    
+    def get_benchmark_clear_timestamp(self):
+        # Every shard is cleared together; the newest timestamp wins if a clear was interrupted
+        return max((shard.get_benchmark_clear_timestamp() for shard in self.shards), key=lambda t: t or '')
+    
+    def get_benchmark_epoch(self):
+        return max(shard.get_benchmark_epoch() for shard in self.shards)
+    
+    def get_benchmark_version(self):
+        return tuple(shard.get_benchmark_version() for shard in self.shards)
+    
+    def set_benchmark_clear_timestamp(self, timestamp):
+        for shard in self.shards:
+            shard.set_benchmark_clear_timestamp(timestamp)
+    
+    def get_blocks_for_benchmark(self):
+        return list(heapq.merge(*[[shard_block(block, n) for block in shard.get_blocks_for_benchmark()]
+                                  for n, shard in enumerate(self.shards)], key=block_order))
+    
+    def get_benchmark_columns(self, columns):
+        # Shard after shard; the column tuples line up because every shard returns the same columns
+        per_shard = [shard.get_benchmark_columns(columns) for shard in self.shards]
+        return [tuple(chain.from_iterable(values)) for values in zip(*per_shard)]
+    
+    def get_cipher_samples(self, limit):
+        # Each shard's newest samples, interleaved so the first limit rows are spread over all shards
+        samples = zip_longest(*[shard.get_cipher_samples(limit) for shard in self.shards])
+        return [row for row in chain.from_iterable(samples) if row is not None][:limit]
+    
+    def get_benchmark_aggregates(self):
+        aggregates = {}
+        for shard in self.shards:
+            for algorithm, shard_metrics in shard.get_benchmark_aggregates().items():
+                for metric, aggregate in shard_metrics.items():
+                    target = aggregates.setdefault(algorithm, {}).setdefault(metric, new_aggregate())
+                    aggregate_merge(target, aggregate)
+        return aggregates
+    
+    def rebuild_benchmark_aggregates(self):
+        for shard in self.shards:
+            shard.rebuild_benchmark_aggregates()
+
+class ShardedLedgerWriter:
+    """LedgerWriter for a ShardedBlockchain.
+
+    Each shard gets its own group-commit writer thread, so shards append concurrently, and a
+    background thread anchors the shard heads every ``anchor_interval`` seconds (None disables it;
+    a final anchor is still written on close).
+    """
+    
+    def __init__(self, blockchain, batch_size=DEFAULT_BATCH_SIZE, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 anchor_interval=DEFAULT_ANCHOR_INTERVAL):
+        self.blockchain = blockchain
+        self.anchor_interval = anchor_interval
+        self.anchor_error = None
+        self.writers = [LedgerWriter(shard, batch_size, flush_interval) for shard in blockchain.shards]
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._closed = False
+    
+    def submit(self, **entry):
+        self._ensure_started()
+        return self.writers[self.blockchain.shard_for(entry)].submit(**entry)
+    
+    def submit_many(self, entries):
+        # Futures in entry order; each shard's share is queued together, in order, on its own writer
+        self._ensure_started()
+        positions = {}
+        for position, entry in enumerate(entries):
+            positions.setdefault(self.blockchain.shard_for(entry), []).append(position)
+        futures = [None] * len(entries)
+        for shard, shard_positions in positions.items():
+            shard_futures = self.writers[shard].submit_many([entries[position] for position in shard_positions])
+            for position, future in zip(shard_positions, shard_futures):
+                futures[position] = future
+        return futures
+    
+    def append(self, timeout=None, **entry):
+        return self.submit(**entry).result(timeout)
+    
+    def flush(self, timeout=None):
+        for writer in self.writers:
+            writer.flush(timeout)
+    
+    def close(self, timeout=None):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            thread = self._thread if self._pid == os.getpid() else None
+        for writer in self.writers:
+            writer.close(timeout)
+        self._stop.set()
+        if thread is not None:
+            thread.join(timeout)
+        # Covers whatever was committed since the last periodic anchor
+        self._anchor()
+    
+    @property
+    def pending(self):
+        return sum(writer.pending for writer in self.writers)
+    
+    @property
+    def batches_committed(self):
+        return sum(writer.batches_committed for writer in self.writers)
+    
+    @property
+    def blocks_committed(self):
+        return sum(writer.blocks_committed for writer in self.writers)
+    
+    @property
+    def archive_error(self):
+        return next((writer.archive_error for writer in self.writers if writer.archive_error), None)
+    
+    def _ensure_started(self):
+        # Like LedgerWriter, a forked worker starts its own anchoring thread on first use
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("ShardedLedgerWriter is closed")
+            if self.anchor_interval is None or (self._thread is not None and self._pid == os.getpid()):
+                return
+            self._stop = threading.Event()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='ledger-anchor', daemon=True)
+            self._thread.start()
+    
+    def _run(self):
+        while not self._stop.wait(self.anchor_interval):
+            self._anchor()
+    
+    def _anchor(self):
+        try:
+            self.blockchain.anchor()
+            self.anchor_error = None
+        except Exception as e:
+            self.anchor_error = str(e)
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    
+    parser = argparse.ArgumentParser(description='Anchor and verify a sharded ledger')
+    parser.add_argument('--db', default='ledger.db', help='root database of the sharded ledger')
+    parser.add_argument('--shards', type=int, required=True)
+    parser.add_argument('--shard-key', default=DEFAULT_SHARD_KEY, choices=SHARD_KEYS)
+    parser.add_argument('--archive-dir', default=None)
+    parser.add_argument('--anchor', action='store_true', help='anchor the current shard heads first')
+    parser.add_argument('--full', action='store_true', help='audit every block in a process pool')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+    
+    blockchain = ShardedBlockchain(args.db, args.shards, args.shard_key, archive_dir=args.archive_dir)
+    if args.anchor:
+        anchor = blockchain.anchor() or blockchain.get_last_anchor()
+        if anchor:
+            print(f"Anchor {anchor['anchor_index']}: {anchor['anchor_hash']}", file=sys.stderr)
+    if args.full:
+        is_valid, message, _ = blockchain.audit_chain(args.workers)
+    else:
+        is_valid, message = blockchain.verify_chain()
+    print(message)
+    sys.exit(0 if is_valid else 1)
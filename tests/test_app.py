@@ -0,0 +1,64 @@
+import io
+import os
+import shutil
+
+import pytest
+
+@pytest.fixture(scope='module')
+def app_module(tmp_path_factory):
+    # app creates its storage folders and ledger relative to the working directory on import
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('app'))
+    import app
+    yield app
+    os.chdir(cwd)
+
+@pytest.fixture(scope='module')
+def same_name_blocks(app_module):
+    client = app_module.app.test_client()
+    datas = [b'A' * 100, b'B' * 5000]
+    names = []
+    for data in datas:
+        response = client.post('/api/encrypt', data={'passphrase': 'pw', 'algorithm': 'AES-256-GCM',
+                                                     'file': (io.BytesIO(data), 'same.txt')})
+        assert response.status_code == 200
+        names.append(response.json['encrypted_filename'])
+    blocks = [app_module.blockchain.get_block(tx_hash=block.tx_hash)
+              for block in app_module.blockchain.get_all_blocks() if block.file_name == 'same.txt']
+    return client, datas, names, blocks
+
+def decrypt_ref(client, block):
+    return client.post('/api/decrypt/ref', json={'tx_hash': block.tx_hash, 'passphrase': 'pw'})
+
+def test_same_name_uploads_get_their_own_ciphertext(same_name_blocks):
+    _, _, names, blocks = same_name_blocks
+    assert names[0] != names[1]
+    assert blocks[0].ciphertext_path != blocks[1].ciphertext_path
+
+def test_decrypt_ref_serves_each_blocks_plaintext(same_name_blocks):
+    client, datas, _, blocks = same_name_blocks
+    for data, block in zip(datas, blocks):
+        response = decrypt_ref(client, block)
+        assert response.status_code == 200
+        assert response.data == data
+        assert int(response.headers['Content-Length']) == len(data)
+
+def test_decrypt_ref_rejects_a_replaced_ciphertext(same_name_blocks, tmp_path):
+    client, _, _, blocks = same_name_blocks
+    original = tmp_path / 'original.enc'
+    shutil.copy(blocks[0].ciphertext_path, original)
+    shutil.copy(blocks[1].ciphertext_path, blocks[0].ciphertext_path)
+    try:
+        assert decrypt_ref(client, blocks[0]).status_code == 409
+    finally:
+        shutil.copy(original, blocks[0].ciphertext_path)
+    assert decrypt_ref(client, blocks[0]).status_code == 200
+
+def test_decrypt_ref_aborts_on_a_digest_mismatch(same_name_blocks, app_module, monkeypatch):
+    # Headers are already sent by the time the digest is known, so the stream must fail rather than end cleanly
+    client, _, _, blocks = same_name_blocks
+    get_block = app_module.blockchain.get_block
+    monkeypatch.setattr(app_module.blockchain, 'get_block',
+                        lambda **kwargs: get_block(**kwargs)._replace(file_hash='0' * 64))
+    with pytest.raises(app_module.CiphertextMismatch):
+        decrypt_ref(client, blocks[1]).data
@@ -0,0 +1,92 @@
+import hashlib
+import io
+import os
+import struct
+
+import pytest
+
+import crypto_utils
+from crypto_utils import ALGORITHM_IDS, STREAM_TAG_LENGTHS, decrypt_file, decrypt_stream, encrypt_stream
+
+SEGMENT_SIZE = 4096
+# Per-segment framing around the ciphertext: 1 flag byte and a 4-byte length, then the tag
+SEGMENT_FRAMING = 5
+
+def encrypt(data, algorithm, **kwargs):
+    out = io.BytesIO()
+    result = encrypt_stream(io.BytesIO(data), out, 'pw', algorithm, segment_size=SEGMENT_SIZE, **kwargs)
+    return out.getvalue(), result
+
+def segment_lengths(data_size):
+    full, rest = divmod(data_size, SEGMENT_SIZE)
+    return [SEGMENT_SIZE] * full + ([rest] if rest or not full else [])
+
+def header_length(blob, data_size, algorithm):
+    lengths = segment_lengths(data_size)
+    start = len(blob) - sum(SEGMENT_FRAMING + length + STREAM_TAG_LENGTHS[algorithm] for length in lengths)
+    # The first segment record must start right there, or the offsets below would miss the segments
+    assert struct.unpack('<BI', blob[start:start + SEGMENT_FRAMING])[1] == lengths[0]
+    return start
+
+@pytest.mark.parametrize('algorithm', list(ALGORITHM_IDS))
+@pytest.mark.parametrize('size', [0, 1, SEGMENT_SIZE, SEGMENT_SIZE + 1, 3 * SEGMENT_SIZE + 100])
+def test_round_trip(algorithm, size):
+    data = os.urandom(size)
+    blob, result = encrypt(data, algorithm)
+    assert result[1] == hashlib.sha256(data).hexdigest()
+    
+    out = io.BytesIO()
+    _, decrypted_algorithm, file_hash, file_size = decrypt_stream(io.BytesIO(blob), out, 'pw')
+    assert out.getvalue() == data
+    assert (decrypted_algorithm, file_hash, file_size) == (algorithm, result[1], size)
+
+@pytest.mark.parametrize('compression', ['auto', 'always'])
+def test_round_trip_compressed(compression):
+    data = b'compressible line of text\n' * 2000
+    blob, result = encrypt(data, 'AES-256-GCM', compression=compression)
+    assert len(blob) < len(data)
+    assert decrypt_file(blob, 'pw')[0] == data
+
+@pytest.mark.parametrize('algorithm', list(ALGORITHM_IDS))
+def test_tampered_ciphertext_is_rejected(algorithm):
+    data = os.urandom(2 * SEGMENT_SIZE + 10)
+    blob, _ = encrypt(data, algorithm)
+    start = header_length(blob, len(data), algorithm)
+    for position in (start + SEGMENT_FRAMING, start + SEGMENT_FRAMING + SEGMENT_SIZE + 1, len(blob) - 1):
+        tampered = bytearray(blob)
+        tampered[position] ^= 1
+        with pytest.raises(ValueError):
+            decrypt_file(bytes(tampered), 'pw')
+
+def test_swapped_segments_are_rejected():
+    algorithm = 'ChaCha20-Poly1305'
+    data = os.urandom(3 * SEGMENT_SIZE + 10)
+    blob, _ = encrypt(data, algorithm)
+    start = header_length(blob, len(data), algorithm)
+    framed = SEGMENT_FRAMING + SEGMENT_SIZE + STREAM_TAG_LENGTHS[algorithm]
+    first, second = blob[start:start + framed], blob[start + framed:start + 2 * framed]
+    swapped = blob[:start] + second + first + blob[start + 2 * framed:]
+    with pytest.raises(ValueError):
+        decrypt_file(swapped, 'pw')
+
+@pytest.mark.parametrize('algorithm', list(ALGORITHM_IDS))
+def test_truncation_is_rejected(algorithm):
+    data = os.urandom(2 * SEGMENT_SIZE + 10)
+    blob, _ = encrypt(data, algorithm)
+    start = header_length(blob, len(data), algorithm)
+    framed = SEGMENT_FRAMING + SEGMENT_SIZE + STREAM_TAG_LENGTHS[algorithm]
+    # Inside the header, at a segment boundary (final segment dropped), and inside the final segment
+    for length in (start - 1, start + framed, start + 2 * framed, len(blob) - 1):
+        with pytest.raises(ValueError):
+            decrypt_file(blob[:length], 'pw')
+
+def test_wrong_passphrase_is_rejected():
+    blob, _ = encrypt(os.urandom(100), 'AES-256-GCM')
+    with pytest.raises(ValueError):
+        decrypt_file(blob, 'wrong')
+
+def test_header_kdf_cost_is_bounded():
+    with pytest.raises(ValueError):
+        crypto_utils.parse_kdf(f'pbkdf2-sha256:iterations={crypto_utils.MAX_PBKDF2_ITERATIONS + 1}')
+    with pytest.raises(ValueError):
+        crypto_utils.parse_kdf('scrypt:n=262144,r=8,p=2')
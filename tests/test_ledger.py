@@ -0,0 +1,130 @@
+import hashlib
+import threading
+
+import pytest
+
+import blockchain
+from blockchain import Blockchain
+from ledger_writer import LedgerWriter
+from sharded_ledger import ShardedBlockchain
+
+BATCH_SIZE = 8
+
+def entry(name, algorithm='AES-256-GCM', **overrides):
+    values = dict(algorithm=algorithm, file_name=f'f{name}', file_hash=hashlib.sha256(str(name).encode()).hexdigest(),
+                  ciphertext_path=f'p{name}', nonce=b'n', tag=b't', salt=b's', file_size_bytes=100, enc_time_ms=1.0)
+    return {**values, **overrides}
+
+def page_through(chain, limit, order, **filters):
+    # Every page in turn until next_cursor runs out; returns the indexes in the order they came
+    indexes, cursor = [], None
+    while True:
+        blocks, cursor = chain.get_blocks_page(limit, cursor, order, **filters)
+        indexes.extend(block.index for block in blocks)
+        if cursor is None:
+            return indexes
+
+@pytest.fixture
+def chain(tmp_path, monkeypatch):
+    monkeypatch.setattr(blockchain, 'MERKLE_BATCH_SIZE', BATCH_SIZE)
+    chain = Blockchain(str(tmp_path / 'ledger.db'), segment_blocks=2 * BATCH_SIZE)
+    yield chain
+    chain.close()
+
+@pytest.mark.parametrize('limit', [1, 7, 10, 25, 100])
+def test_cursor_pages_cover_every_block_once(chain, limit):
+    chain.add_blocks([entry(i) for i in range(25)])
+    assert page_through(chain, limit, 'desc') == list(range(24, -1, -1))
+    assert page_through(chain, limit, 'asc') == list(range(25))
+
+def test_cursor_pages_span_archived_blocks(chain):
+    chain.add_blocks([entry(i) for i in range(40)])
+    assert chain.archive_blocks(keep=BATCH_SIZE) > 0
+    assert page_through(chain, 6, 'desc') == list(range(39, -1, -1))
+    assert page_through(chain, 6, 'asc') == list(range(40))
+
+def test_cursor_with_filter(chain):
+    chain.add_blocks([entry(i, 'AES-256-GCM' if i % 3 else 'ChaCha20-Poly1305') for i in range(30)])
+    assert page_through(chain, 4, 'desc', algorithm='ChaCha20-Poly1305') == list(range(27, -1, -3))
+
+def test_cursor_is_stable_under_appends(chain):
+    # Keyset paging: blocks appended between requests do not shift or repeat the later pages
+    chain.add_blocks([entry(i) for i in range(20)])
+    first, cursor = chain.get_blocks_page(5, None, 'desc')
+    chain.add_blocks([entry(i) for i in range(20, 30)])
+    second, _ = chain.get_blocks_page(5, cursor, 'desc')
+    assert [block.index for block in first] == [19, 18, 17, 16, 15]
+    assert [block.index for block in second] == [14, 13, 12, 11, 10]
+
+def test_last_page_has_no_cursor(chain):
+    chain.add_blocks([entry(i) for i in range(5)])
+    blocks, cursor = chain.get_blocks_page(5, None, 'desc')
+    assert len(blocks) == 5 and cursor is None
+
+def test_invalid_order_is_rejected(chain):
+    with pytest.raises(ValueError):
+        chain.get_blocks_page(5, None, 'sideways')
+
+def test_sharded_cursor_pages_cover_every_block_once(tmp_path):
+    sharded = ShardedBlockchain(str(tmp_path / 'root.db'), shards=3)
+    for i in range(30):
+        sharded.add_block(**entry(i))
+    seen = []
+    cursor = None
+    while True:
+        blocks, cursor = sharded.get_blocks_page(4, cursor, 'asc')
+        seen.extend((block.shard, block.index) for block in blocks)
+        if cursor is None:
+            break
+    assert len(seen) == len(set(seen)) == 30
+    with pytest.raises(ValueError):
+        sharded.get_blocks_page(4, '1,2', 'asc')
+
+def test_writer_commits_in_submission_order(chain):
+    writer = LedgerWriter(chain, batch_size=4)
+    futures = writer.submit_many([entry(i) for i in range(10)])
+    tx_hashes = [future.result(10) for future in futures]
+    writer.close()
+    assert [block.tx_hash for block in chain.get_all_blocks()] == tx_hashes
+    assert writer.blocks_committed == 10
+    assert chain.verify_chain(full=True)[0]
+
+def test_writer_retries_around_a_failing_entry(chain):
+    # nonce=None cannot be encoded, which fails the batch transaction; the writer then retries each
+    # entry on its own, so only the bad one fails
+    writer = LedgerWriter(chain, batch_size=16, flush_interval=0.05)
+    futures = writer.submit_many([entry(0), entry(1, nonce=None), entry(2)])
+    assert futures[0].result(10)
+    with pytest.raises(TypeError):
+        futures[1].result(10)
+    assert futures[2].result(10)
+    writer.close()
+    assert [block.file_name for block in chain.get_all_blocks()] == ['f0', 'f2']
+    assert chain.verify_chain(full=True)[0]
+
+def test_writer_keeps_concurrent_submissions_contiguous(chain):
+    writer = LedgerWriter(chain, batch_size=4)
+    
+    def submit(prefix):
+        futures = writer.submit_many([entry(f'{prefix}-{i}') for i in range(12)])
+        for future in futures:
+            future.result(10)
+    
+    threads = [threading.Thread(target=submit, args=(prefix,)) for prefix in 'abc']
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.close()
+    
+    names = [block.file_name for block in chain.get_all_blocks()]
+    for prefix in 'abc':
+        positions = [i for i, name in enumerate(names) if name.startswith(f'f{prefix}-')]
+        assert positions == list(range(positions[0], positions[0] + 12))
+        assert [names[i] for i in positions] == [f'f{prefix}-{i}' for i in range(12)]
+
+def test_closed_writer_refuses_entries(chain):
+    writer = LedgerWriter(chain)
+    writer.close()
+    with pytest.raises(RuntimeError):
+        writer.submit(**entry(0))
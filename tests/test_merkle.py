@@ -0,0 +1,90 @@
+import hashlib
+import json
+import os
+
+import pytest
+
+import blockchain
+import merkle
+from blockchain import Blockchain
+from merkle import merkle_path, merkle_path_sides, merkle_root, root_from_path, verify_proof
+
+BATCH_SIZE = 8
+
+def entry(i):
+    return dict(algorithm='AES-256-GCM', file_name=f'f{i}', file_hash=hashlib.sha256(str(i).encode()).hexdigest(),
+                ciphertext_path=f'p{i}', nonce=b'n', tag=b't', salt=b's', file_size_bytes=i, enc_time_ms=1.0)
+
+@pytest.fixture
+def ledger(tmp_path, monkeypatch):
+    # Two sealed batches of BATCH_SIZE blocks and an open batch of four
+    monkeypatch.setattr(blockchain, 'MERKLE_BATCH_SIZE', BATCH_SIZE)
+    chain = Blockchain(str(tmp_path / 'ledger.db'), segment_blocks=2 * BATCH_SIZE)
+    tx_hashes = chain.add_blocks([entry(i) for i in range(2 * BATCH_SIZE + 4)])
+    yield chain, tx_hashes
+    chain.close()
+
+@pytest.mark.parametrize('leaf_count', range(1, 40))
+def test_paths_lead_to_the_root(leaf_count):
+    tx_hashes = [os.urandom(32).hex() for _ in range(leaf_count)]
+    root = merkle_root(tx_hashes)
+    for position in range(leaf_count):
+        path = merkle_path(tx_hashes, position)
+        assert root_from_path(tx_hashes[position], path) == root
+        assert [step['side'] for step in path] == merkle_path_sides(leaf_count, position)
+
+def test_sealed_proof_verifies(ledger):
+    chain, tx_hashes = ledger
+    for tx_hash in tx_hashes[:2 * BATCH_SIZE]:
+        proof = chain.get_inclusion_proof(tx_hash)
+        assert proof['batch']['sealed']
+        assert verify_proof(proof)[0]
+        assert verify_proof(proof, proof['batch']['batch_hash'])[0]
+
+def test_untrusted_batch_hash_is_rejected(ledger):
+    chain, tx_hashes = ledger
+    proof = chain.get_inclusion_proof(tx_hashes[3])
+    assert not verify_proof(proof, '0' * 64)[0]
+
+def test_unsealed_proof_is_pending(ledger):
+    chain, tx_hashes = ledger
+    proof = chain.get_inclusion_proof(tx_hashes[-1])
+    assert not proof['batch']['sealed']
+    is_valid, message = verify_proof(proof)
+    assert not is_valid
+    assert message.startswith('Pending')
+
+@pytest.mark.parametrize('position, claimed', [(2, 3), (3, 2), (0, 4), (7, 0)])
+def test_path_for_another_index_is_rejected(ledger, position, claimed):
+    chain, tx_hashes = ledger
+    proof = chain.get_inclusion_proof(tx_hashes[position])
+    proof['block_index'] = claimed
+    del proof['block']
+    assert not verify_proof(proof)[0]
+
+def test_block_record_must_match_the_index(ledger):
+    chain, tx_hashes = ledger
+    proof = chain.get_inclusion_proof(tx_hashes[2])
+    proof['block']['index'] = 3
+    assert not verify_proof(proof)[0]
+
+def test_tampered_path_or_block_is_rejected(ledger):
+    chain, tx_hashes = ledger
+    proof = chain.get_inclusion_proof(tx_hashes[5])
+    proof['path'][0]['hash'] = '00' * 32
+    assert not verify_proof(proof)[0]
+    
+    proof = chain.get_inclusion_proof(tx_hashes[5])
+    proof['block']['file_name'] = 'other'
+    assert not verify_proof(proof)[0]
+
+def test_malformed_proof_is_rejected():
+    assert verify_proof({'tx_hash': 'zz'}) == (False, "Malformed proof: 'batch'")
+
+def test_cli_exit_status(ledger, tmp_path):
+    chain, tx_hashes = ledger
+    proof_path = tmp_path / 'proof.json'
+    proof_path.write_text(json.dumps({'proof': chain.get_inclusion_proof(tx_hashes[0])}))
+    assert merkle.main([str(proof_path)]) == 0
+    proof_path.write_text(json.dumps({'proof': chain.get_inclusion_proof(tx_hashes[-1])}))
+    assert merkle.main([str(proof_path)]) == 1